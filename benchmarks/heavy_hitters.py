@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# Copright (C) 2024 Dylan Middendorf
+# SPDX-License-Identifier: BSD-2-Clause
+
+"""Accuracy of bounded-memory heavy-hitter profiles against exact profiles.
+
+For every capacity, each cross-validation fold is attributed twice: once with
+exact author profiles and once with profiles pruned to that many heavy hitters
+while they are built. The report lists both accuracies, how often the two
+attribute a document to the same author, and the n-grams held per profile.
+"""
+
+import os
+import sys
+import time
+
+from argparse import ArgumentParser
+from typing import Optional, Sequence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "models", "frantzeskou_2007"))
+
+# pylint: disable-next=wrong-import-position
+from ngramValidated import (
+    NgramCache,
+    Profile,
+    attribute_profiles,
+    get_author_profiles,
+    k_fold_splits,
+    scapRD,
+    scapSPI,
+)
+
+
+def main(args: Optional[Sequence[str]] = None) -> int:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source_code_dir", metavar="DIR")
+    parser.add_argument("-n", default=30, type=int, dest="n")
+    parser.add_argument("-L", default=6000, type=int, dest="L")
+    parser.add_argument("--method", default="rd", choices=("rd", "spi"))
+    parser.add_argument("--folds", default=5, type=int, dest="k_folds")
+    parser.add_argument(
+        "--capacities",
+        default=None,
+        type=int,
+        nargs="+",
+        metavar="<m>",
+        help="heavy-hitter capacities to compare (defaults to 1x, 2x and 4x L)",
+    )
+    args = parser.parse_args(args)
+
+    capacities = args.capacities or [args.L, 2 * args.L, 4 * args.L]
+    if min(capacities) < args.L:
+        parser.error("every capacity must be at least L")
+
+    method = scapRD if args.method == "rd" else scapSPI
+    file_paths = sorted(
+        os.path.join(args.source_code_dir, f) for f in os.listdir(args.source_code_dir)
+    )
+    cache = NgramCache(args.n)
+
+    # capacity -> [correct, agreeing, documents, stored n-grams, profiles, seconds]
+    totals = {capacity: [0, 0, 0, 0, 0, 0.0] for capacity in [None, *capacities]}
+    predictions = {}
+    for fold, (train_files, test_files) in enumerate(
+        k_fold_splits(file_paths, args.k_folds)
+    ):
+        true_authors = [a for a, files in test_files.items() for _ in files]
+        test_paths = [path for files in test_files.values() for path in files]
+        unknown_profiles = [Profile(*cache.counts(path)) for path in test_paths]
+
+        for capacity, total in totals.items():
+            start = time.perf_counter()
+            author_profiles = get_author_profiles(
+                train_files, args.n, cache=cache, capacity=capacity
+            )
+            attributed = attribute_profiles(
+                author_profiles, unknown_profiles, args.L, method
+            )
+            total[5] += time.perf_counter() - start
+
+            predictions[fold, capacity] = attributed
+            exact = predictions[fold, None]  # Exact profiles are attributed first
+            total[0] += sum(a == t for a, t in zip(attributed, true_authors))
+            total[1] += sum(a == e for a, e in zip(attributed, exact))
+            total[2] += len(true_authors)
+            total[3] += sum(len(profile) for profile in author_profiles.values())
+            total[4] += len(author_profiles)
+
+    print(f"{'capacity':>10}{'accuracy':>10}{'agreement':>11}{'n-grams':>12}{'seconds':>9}")
+    for capacity, (correct, agreeing, documents, stored, profiles, elapsed) in totals.items():
+        print(
+            f"{capacity or 'exact':>10}"
+            f"{correct / max(documents, 1):>10.4f}"
+            f"{agreeing / max(documents, 1):>11.4f}"
+            f"{stored / max(profiles, 1):>12.0f}"
+            f"{elapsed:>9.2f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# Copright (C) 2024 Dylan Middendorf
+# SPDX-License-Identifier: BSD-2-Clause
+
+"""Import-time budget for the command line entry points.
+
+Each entry point is imported in a fresh interpreter several times, and the
+fastest run (less the cost of an empty interpreter) is compared against its
+budget. The script exits with a non-zero status if any entry point exceeds it,
+so it can gate changes that pull heavy dependencies back into module scope.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+from argparse import ArgumentParser
+from typing import Optional, Sequence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Entry point name -> (directory added to `sys.path`, module to import, budget
+# in milliseconds). ngramValidated imports numpy up front, which alone took
+# 70-115 ms (and the entry point 125-180 ms) on a laptop-class machine.
+ENTRY_POINTS = {
+    "graphite": ("models/caliskan_2015/syntactic", "graphite", 150.0),
+    "stylometry": ("models/caliskan_2015/syntactic", "stylometry", 150.0),
+    "ngramValidated": ("models/frantzeskou_2007", "ngramValidated", 250.0),
+}
+
+
+def _startup_time(statement: str, path: str, repeat: int) -> float:
+    """Return the fastest wall-clock time (in seconds) to run `statement`."""
+    env = {**os.environ, "PYTHONPATH": path, "PYTHONDONTWRITEBYTECODE": "1"}
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], env=env, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(args: Optional[Sequence[str]] = None) -> int:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--budget",
+        default=None,
+        type=float,
+        metavar="<ms>",
+        help="maximum import time of every entry point, in milliseconds, instead "
+        "of their own budgets",
+    )
+    parser.add_argument("--repeat", default=5, type=int, metavar="<n>")
+    parser.add_argument("entry_points", nargs="*", metavar="ENTRY_POINT")
+    args = parser.parse_args(args)
+
+    for name in set(args.entry_points) - ENTRY_POINTS.keys():
+        parser.error(f"unknown entry point: {name}")
+
+    baseline = _startup_time("pass", ROOT, args.repeat)
+
+    exceeded = False
+    for name in args.entry_points or ENTRY_POINTS:
+        directory, module, budget = ENTRY_POINTS[name]
+        budget = budget if args.budget is None else args.budget
+        path = os.path.join(ROOT, directory)
+        try:
+            elapsed = _startup_time(f"import {module}", path, args.repeat)
+        except subprocess.CalledProcessError:
+            print(f"{name}: FAILED (import raised an exception)")
+            exceeded = True
+            continue
+
+        elapsed = (elapsed - baseline) * 1000  # Only the import's own cost
+        status = "ok" if elapsed <= budget else "OVER BUDGET"
+        print(f"{name}: {elapsed:.1f} ms (budget {budget:.0f} ms) {status}")
+        exceeded |= elapsed > budget
+    return 1 if exceeded else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# Copright (C) 2024 Dylan Middendorf
+# SPDX-License-Identifier: BSD-2-Clause
+
+"""End-to-end ingestion throughput against a local stand-in of the platforms.
+
+For every connection pool size, a fresh stand-in server (scripts/standin.py)
+serves synthetic contests at the requested scale, with the requested latency,
+rate limit and faults, and three stages are timed against it:
+
+- metadata: each contest's standings, user info and submissions are fetched in
+  the blocks and order `CodeforcesDatasetBuilder` uses (without its database),
+  through the streaming API;
+- sources: the sources of a sample of those submissions are downloaded into a
+  source store, like scripts/download.py;
+- leetcode: each contest's ranking pages are fetched, then the sources of the
+  submissions listed in them.
+
+Each stage reports its rows (or sources) per second along with the clients'
+per-endpoint request metrics, as JSON, so changes to the scraping stack can be
+compared across commits.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser
+from itertools import islice
+from typing import Optional, Sequence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+# pylint: disable=wrong-import-position
+from api import CodeforcesAPI, LeetCodeAPI
+from download import SourceStore, download
+from metrics import Metrics
+from standin import RANKING_PAGE_SIZE, FaultInjector, StandinServer, SyntheticPlatform
+
+# pylint: enable=wrong-import-position
+
+AUTHOR_BLOCK_SIZE = 512  # As `CodeforcesDatasetBuilder`'s
+SUBMISSION_BLOCK_SIZE = 16384
+
+
+def _totals(metrics: Metrics) -> dict:
+    totals = {"requests": 0, "errors": 0, "throttled": 0, "retries": 0, "bytes": 0}
+    for endpoint in metrics.snapshot()["endpoints"].values():
+        for field in totals:
+            totals[field] += endpoint[field]
+    return totals
+
+
+def _stage(name: str, rows: int, seconds: float, metrics: Metrics) -> dict:
+    totals = _totals(metrics)
+    return {
+        "stage": name,
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_second": rows / max(seconds, 1e-9),
+        "megabytes_per_second": totals["bytes"] / (1 << 20) / max(seconds, 1e-9),
+        **totals,
+        "endpoints": {
+            endpoint: {
+                "requests": snapshot["requests"],
+                "p50": snapshot["latency"]["p50"],
+                "p99": snapshot["latency"]["p99"],
+                "parse_seconds": snapshot["parse_seconds"],
+            }
+            for endpoint, snapshot in metrics.snapshot()["endpoints"].items()
+        },
+    }
+
+
+def ingest_metadata(api: CodeforcesAPI, contests: int) -> tuple[int, list[int]]:
+    """Fetches every contest's metadata as `CodeforcesDatasetBuilder` does.
+
+    Returns:
+        The number of rows received, and the ids of the submissions.
+    """
+    rows, submission_ids = 0, []
+    for contest_id in range(1, contests + 1):
+        offset = 1
+        while True:
+            handles = [
+                row["party"]["members"][0]["handle"]
+                for row in api.iter_contest_standings(contest_id, offset, AUTHOR_BLOCK_SIZE)
+            ]
+            if handles:
+                rows += len(api.get_user_info(handles)["result"])
+            rows += len(handles)
+            if len(handles) < AUTHOR_BLOCK_SIZE:
+                break
+            offset += AUTHOR_BLOCK_SIZE
+
+        offset = 1
+        while True:
+            received = 0
+            for submission in api.iter_contest_status(
+                contest_id, offset=offset, count=SUBMISSION_BLOCK_SIZE
+            ):
+                received += 1
+                submission_ids.append((contest_id, submission["id"]))
+            rows += received
+            if received < SUBMISSION_BLOCK_SIZE:
+                break
+            offset += SUBMISSION_BLOCK_SIZE
+    return rows, submission_ids
+
+
+def ingest_sources(api, store: SourceStore, submissions: list[tuple[int, int]]) -> int:
+    """Downloads the sources of (contest id, submission id) pairs into a store."""
+    contests = dict((s, c) for c, s in submissions)
+
+    def fetch(submission_id: int):
+        response = api.get_submission(contests[submission_id], submission_id)
+        return response["source"].encode(), response.get("lang")
+
+    downloaded, _, _ = download(store, list(contests), fetch, api.map)
+    return downloaded
+
+
+def ingest_leetcode(api: LeetCodeAPI, contests: int, participants: int, limit: int) -> int:
+    """Fetches every ranking page, then up to `limit` of the listed sources."""
+    rows, submission_ids = 0, []
+    pages = -(-participants // RANKING_PAGE_SIZE)
+    for contest_id in range(1, contests + 1):
+        for page in range(1, pages + 1):
+            ranking = api.get_contest_ranking(f"weekly-contest-{contest_id}", page)
+            rows += len(ranking["total_rank"])
+            for solved in ranking["submissions"]:
+                submission_ids.extend(s["submission_id"] for s in solved.values())
+
+    sample = list(islice(submission_ids, limit))
+    rows += sum(len(s["code"]) > 0 for s in api.map(api.get_submission, sample))
+    return rows
+
+
+def run(args, pool_size: int) -> list[dict]:
+    """Benchmarks every stage against a fresh stand-in, at one pool size."""
+    synthetic = SyntheticPlatform(
+        args.contests, args.participants, args.submissions, args.source_size, args.seed
+    )
+    faults = FaultInjector(
+        args.latency, args.rate, args.error_rate, args.drop_rate, args.truncate_rate, args.seed
+    )
+
+    results = []
+    with StandinServer(("127.0.0.1", 0), synthetic, faults) as server:
+        port = server.server_port
+
+        # Clients throttle themselves at the stand-in's limit (if any), as
+        # they would at the real one's, unless told to exceed it
+        client_rate = args.client_rate or args.rate or 1e6
+        cf_args = dict(
+            secure=False, pool_size=pool_size, api_rate=client_rate, source_rate=client_rate
+        )
+
+        api = CodeforcesAPI("127.0.0.1", port, **cf_args)
+        start = time.perf_counter()
+        rows, submissions = ingest_metadata(api, args.contests)
+        results.append(_stage("metadata", rows, time.perf_counter() - start, api.metrics))
+        api.client.close()
+
+        api = CodeforcesAPI("127.0.0.1", port, **cf_args)
+        sample = submissions[:: max(1, len(submissions) // max(args.sources, 1))]
+        with tempfile.TemporaryDirectory() as directory:
+            store = SourceStore(directory)
+            start = time.perf_counter()
+            downloaded = ingest_sources(api, store, sample[: args.sources])
+            seconds = time.perf_counter() - start
+            store.close()
+        results.append(_stage("sources", downloaded, seconds, api.metrics))
+        api.client.close()
+
+        api = LeetCodeAPI("127.0.0.1", port, False, pool_size, client_rate)
+        start = time.perf_counter()
+        rows = ingest_leetcode(api, args.contests, args.participants, args.sources)
+        results.append(_stage("leetcode", rows, time.perf_counter() - start, api.metrics))
+        api.client.close()
+
+        server_stats = dict(server.stats)
+
+    for result in results:
+        result["pool_size"] = pool_size
+        result["server"] = server_stats
+    return results
+
+
+def _revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args: Optional[Sequence[str]] = None) -> int:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--contests", default=2, type=int)
+    parser.add_argument("--participants", default=2000, type=int)
+    parser.add_argument(
+        "--submissions",
+        default=8,
+        type=int,
+        help="submissions per participant and contest",
+    )
+    parser.add_argument("--source-size", default=2000, type=int, metavar="BYTES")
+    parser.add_argument(
+        "--sources",
+        default=2000,
+        type=int,
+        help="sources downloaded per platform",
+    )
+    parser.add_argument(
+        "--jobs", default=[1, 8], type=int, nargs="+", help="connection pool sizes"
+    )
+    parser.add_argument(
+        "--latency", default=0.005, type=float, metavar="SECONDS", help="mean added latency"
+    )
+    parser.add_argument(
+        "--rate",
+        default=0.0,
+        type=float,
+        help="the stand-in's requests per second before throttling (0 for no limit)",
+    )
+    parser.add_argument(
+        "--client-rate",
+        type=float,
+        help="the clients' requests per second, which defaults to --rate",
+    )
+    parser.add_argument("--error-rate", default=0.0, type=float)
+    parser.add_argument("--drop-rate", default=0.0, type=float)
+    parser.add_argument("--truncate-rate", default=0.0, type=float)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--output", default="ingestion_benchmark.json", metavar="<file>")
+    args = parser.parse_args(args)
+
+    report = {
+        "revision": _revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "parameters": {
+            key: value for key, value in vars(args).items() if key not in ("jobs", "output")
+        },
+        "results": [],
+    }
+
+    for pool_size in args.jobs:
+        for result in run(args, pool_size):
+            report["results"].append(result)
+            print(
+                f"jobs={pool_size} {result['stage']}: {result['rows']} rows in "
+                f"{result['seconds']:.2f} s ({result['rows_per_second']:.0f} rows/s, "
+                f"{result['megabytes_per_second']:.1f} MB/s), "
+                f"{result['requests']} requests, {result['retries']} retries, "
+                f"{result['throttled']} throttled"
+            )
+
+    with open(args.output, "w", encoding="utf-8") as output:
+        json.dump(report, output, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# Copright (C) 2024 Dylan Middendorf
+# SPDX-License-Identifier: BSD-2-Clause
+
+"""Throughput, memory and accuracy benchmark of SCAP n-gram attribution.
+
+A deterministic synthetic corpus is generated for every combination of author
+count, files per author and file size: each author writes with a vocabulary
+and layout habits of their own, so attribution is learnable, and the same seed
+always yields the same corpus. Each corpus is packed into a corpus archive,
+split into training and test files (every fifth file of an author is held
+out), and benchmarked once per n in a fresh process, so that its peak RSS is
+not inflated by earlier runs. Results are written as JSON, so optimizations
+to the n-gram model can be compared across commits.
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from typing import Optional, Sequence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "models", "frantzeskou_2007"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+# pylint: disable-next=wrong-import-position
+from corpus import CorpusWriter
+from ngramValidated import (  # pylint: disable=wrong-import-position
+    attribute_batch,
+    get_author_profiles,
+    group_by_author,
+    load_corpus,
+    read_source,
+    scapRD,
+    scapSPI,
+)
+
+METHODS = {"rd": scapRD, "spi": scapSPI}
+
+# fmt: off
+TOKENS = [
+    "int", "long long", "auto", "for", "while", "if", "else", "return",
+    "vector<int>", "std::", "cin", "cout", ">>", "<<", "=", "+=", "==", "<",
+    "++", "--", "(", ")", "[", "]", ";", ",", "0", "1", "n", "m", "i", "j",
+    "k", "x", "y", "ans", "dp", "res", "cnt", "const", "#define", "void",
+    "solve", "main", "size()", "push_back", "sort", "begin()", "end()",
+]
+# fmt: on
+
+
+def generate_source(rng: random.Random, style: dict, size: int) -> str:
+    """Generate roughly `size` characters of code in an author's style."""
+    lines, length = [], 0
+    while length < size:
+        depth = rng.randint(0, 3)
+        words = rng.choices(style["tokens"], style["weights"], k=rng.randint(3, 12))
+        line = style["indent"] * depth + style["space"].join(words) + ";"
+        if rng.random() < 0.15:
+            line += style["brace"]
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)[:size] + "\n"
+
+
+def generate_corpus(
+    archive: str, authors: int, files_per_author: int, file_size: int, seed: int = 0
+) -> None:
+    """Write a deterministic synthetic corpus to a corpus archive."""
+    with CorpusWriter(archive) as writer:
+        for author in range(authors):
+            rng = random.Random(f"{seed}:{author}")
+            tokens = rng.sample(TOKENS, 16)
+            style = {
+                "tokens": tokens + TOKENS,  # Favourite tokens, then everything
+                "weights": [rng.uniform(2, 8) for _ in tokens] + [1] * len(TOKENS),
+                "indent": rng.choice(["\t", "  ", "    "]),
+                "space": rng.choice([" ", " ", ""]),
+                "brace": rng.choice([" {", "\n{", " {\n"]),
+            }
+            for submission in range(files_per_author):
+                source = generate_source(rng, style, file_size)
+                writer.add(f"author{author}", submission, "cpp", source.encode())
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20 if sys.platform == "darwin" else 1 << 10)  # Bytes or KiB
+
+
+def run(archive: str, n: int, Ls: Sequence[int], methods: Sequence[str]) -> list[dict]:
+    """Benchmark one corpus at one n, for every L and method."""
+    author_files = group_by_author(load_corpus(archive))
+    train_files, test_files = {}, {}
+    for author, files in author_files.items():
+        train_files[author] = [f for i, f in enumerate(files) if i % 5 != 4]
+        test_files[author] = [f for i, f in enumerate(files) if i % 5 == 4]
+
+    train_count = sum(map(len, train_files.values()))
+    start = time.perf_counter()
+    author_profiles = get_author_profiles(train_files, n)
+    build_seconds = time.perf_counter() - start
+
+    true_authors = [a for a, files in test_files.items() for _ in files]
+    unknown_codes = [
+        bytes(read_source(f)).decode() for files in test_files.values() for f in files
+    ]
+
+    # Pay for the deferred imports of batch attribution outside of any timing
+    attribute_batch(author_profiles, unknown_codes[:1], n, Ls[0])
+
+    results = []
+    for L, method in product(Ls, methods):
+        start = time.perf_counter()
+        attributed = attribute_batch(author_profiles, unknown_codes, n, L, METHODS[method])
+        seconds = time.perf_counter() - start
+
+        results.append(
+            {
+                "n": n,
+                "L": L,
+                "method": method,
+                "train_documents": train_count,
+                "test_documents": len(unknown_codes),
+                "build_seconds": build_seconds,
+                "build_documents_per_second": train_count / max(build_seconds, 1e-9),
+                "attribution_seconds": seconds,
+                "documents_per_second": len(unknown_codes) / max(seconds, 1e-9),
+                "accuracy": sum(a == t for a, t in zip(attributed, true_authors))
+                / max(len(true_authors), 1),
+            }
+        )
+
+    peak_rss_mb = _peak_rss_mb()  # Of this (fresh) process, so only this run
+    for result in results:
+        result["peak_rss_mb"] = peak_rss_mb
+    return results
+
+
+def _revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args: Optional[Sequence[str]] = None) -> int:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--authors", default=[10, 50], type=int, nargs="+")
+    parser.add_argument("--files", default=[10], type=int, nargs="+", metavar="FILES")
+    parser.add_argument(
+        "--size",
+        default=[2000],
+        type=int,
+        nargs="+",
+        metavar="BYTES",
+        help="approximate size of each generated file",
+    )
+    parser.add_argument("-n", default=[4, 8], type=int, nargs="+", dest="ns")
+    parser.add_argument("-L", default=[1000, 6000], type=int, nargs="+", dest="Ls")
+    parser.add_argument(
+        "--method", default=["rd", "spi"], nargs="+", choices=METHODS, dest="methods"
+    )
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--output", default="scap_benchmark.json", metavar="<file>")
+    args = parser.parse_args(args)
+
+    report = {
+        "revision": _revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "seed": args.seed,
+        "results": [],
+    }
+
+    # Each run gets a fresh (spawned, rather than forked) process for its RSS
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        for authors, files, size in product(args.authors, args.files, args.size):
+            archive = os.path.join(directory, f"{authors}-{files}-{size}.corpus")
+            generate_corpus(archive, authors, files, size, args.seed)
+
+            for n in args.ns:
+                with ProcessPoolExecutor(1, mp_context=context) as executor:
+                    results = executor.submit(run, archive, n, args.Ls, args.methods)
+                    results = results.result()
+
+                for result in results:
+                    result = {
+                        "authors": authors,
+                        "files_per_author": files,
+                        "file_size": size,
+                        **result,
+                    }
+                    report["results"].append(result)
+                    print(
+                        f"authors={authors} files={files} size={size} n={n} "
+                        f"L={result['L']} {result['method']}: "
+                        f"accuracy {result['accuracy']:.4f}, "
+                        f"{result['documents_per_second']:.0f} docs/s, "
+                        f"build {result['build_seconds']:.3f} s, "
+                        f"peak RSS {result['peak_rss_mb']:.0f} MB"
+                    )
+
+    with open(args.output, "w", encoding="utf-8") as output:
+        json.dump(report, output, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -21,6 +21,7 @@ CREATE TABLE codeforces_submission (
   author_handle VARCHAR(24),
   programming_language VARCHAR(32),
   verdict VARCHAR(32),
+  duplicate_of INTEGER UNSIGNED,
   FOREIGN KEY (contest_id) REFERENCES codeforces_contest (id),
   FOREIGN KEY (author_handle) REFERENCES codeforces_user (handle)
 );
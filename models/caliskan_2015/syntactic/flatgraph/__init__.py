@@ -13,8 +13,6 @@ import struct
 from os import PathLike
 from typing import Any, BinaryIO, Literal, Optional, Union, cast
 
-import zstandard as zstd
-
 MAGIC_BYTES = b"FLT GRPH"
 HEADER_FORMAT = f"<{len(MAGIC_BYTES)}sQ"
 
@@ -362,6 +360,10 @@ class Graph:
                 f"bytes, but only {len(compressed)} bytes were read."
             )
 
+        # Deferred until the first stream is decompressed, which keeps the
+        # startup of short-lived command line invocations (e.g., --help) fast
+        import zstandard as zstd  # pylint: disable=import-outside-toplevel
+
         # Decompress the ZStandard stream to get the raw bytes
         decompressed = zstd.decompress(compressed)
         if decompressedLength is None:  # Ensure that
@@ -2,18 +2,24 @@
 # Copright (C) 2024 Dylan Middendorf
 # SPDX-License-Identifier: BSD-2-Clause
 
-from argparse import ArgumentParser, Namespace
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
+import struct
+import subprocess
+import sys
+import tempfile
 import zlib
 import os
 
 from os import PathLike
-from typing import Literal, Optional, Sequence
-
-import pandas as pd
+from typing import Iterator, Literal, Optional, Sequence
 
 from flatgraph.layers.ast import AST
 from flatgraph import Graph
 
+# Directory holding the scripts shared by every model, such as corpus.py
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+SCRIPTS_DIR = os.path.join(ROOT, "scripts")
+
 # TODO: Optimize by "digesting" CPGs, then exporting at once (decrease proccess
 #       times, but increases memory usage)? Decouples feature extraction and
 #       exportation, which will make the linter happy (too-many-locals) and my
@@ -32,10 +38,54 @@ AST_NODE_TYPES = [
 # fmt: on
 
 
+def _fold_hash(feature_hash: int, hash_dim: Optional[int]) -> tuple[int, int]:
+    """Fold a CRC-32 feature hash into one of `hash_dim` signed buckets.
+
+    The low bits of the hash select the bucket, while the most significant bit
+    selects the sign, so colliding features cancel out in expectation instead
+    of accumulating. Without a `hash_dim`, the hash is returned unchanged.
+    """
+    if hash_dim is None:
+        return feature_hash, 1
+    return feature_hash & (hash_dim - 1), -1 if feature_hash >> 31 else 1
+
+
+def _ast_order(node: AST) -> int:
+    """Sort key placing AST children in their source order."""
+    return node.properties.get("ORDER", 0)
+
+
+def _submissions(sources: str | Sequence[str]) -> Iterator[tuple[str, AST]]:
+    """Yield the author and AST of every submission in the given sources.
+
+    CPGs (".bin" files) may hold any number of submissions, while any other
+    file is parsed as the source code of a single one. Authors are resolved
+    from the "<author>_<submission id>" source filenames.
+    """
+    if isinstance(sources, str):
+        sources = [sources]
+
+    def author(root: AST) -> str:
+        source_filename: str = root.properties["NAME"]
+        return source_filename[: source_filename.rindex("_")]
+
+    for source in sources:
+        # TODO: shift from splitext to reading file signature
+        if os.path.splitext(source)[1] == ".bin":
+            with Graph(source, "r") as graph:
+                for graph_source in graph.schema.sources:
+                    root = AST(graph, graph_source)
+                    yield author(root), root
+        else:
+            with AST.open(source) as root:
+                yield author(root), root
+
+
 def export_bigrams(
     sources: str | Sequence[str],
     output_filename: str | bytes | PathLike,
     output_format: Literal["csv"] = "csv",
+    hash_dim: Optional[int] = None,
 ) -> None:
 
     if output_format != "csv":
@@ -43,47 +93,35 @@ def export_bigrams(
 
     unique_bigrams: set[int] = set()
     feature_set: list[dict[int, int]] = []
+    bigram_counts: list[int] = []
 
-    def bigram_term_frequency(node: AST, features: dict[int, int]):
+    def bigram_term_frequency(node: AST, features: dict[int, int]) -> int:
+        count = 0  # Number of bigrams rooted within this subtree
         for child in node.children:
             bigram_hash = zlib.crc32(f"{node.code} -> {child.code}".encode())
-            features[bigram_hash] = features.get(bigram_hash, 0) + 1
-            bigram_term_frequency(child, features)
+            bigram_hash, sign = _fold_hash(bigram_hash, hash_dim)
+            features[bigram_hash] = features.get(bigram_hash, 0) + sign
+            count += 1 + bigram_term_frequency(child, features)
+        return count
 
     submission_authors: list[str] = []
-    for source in sources:
-        # TODO: shift from splitext to reading file signature
-        if os.path.splitext(source)[1] != "bin":
-            with Graph(source, "r") as graph:
-                for graph_soure in graph.schema.sources:
-                    root = AST(graph, graph_soure)
-                    bigrams = {}  # Populated with bigram term frequency
-                    source_filename: str = root.properties["NAME"]
-                    author = source_filename[: source_filename.rindex("_")]
-                    submission_authors.append(author)
-
-                    bigram_term_frequency(root, bigrams)
-                    unique_bigrams.update(bigrams.keys())
-                    feature_set.append(bigrams)
-
-        else:
-            bigrams = {}  # Populated with bigram term frequency
+    for author, root in _submissions(sources):
+        bigrams = {}  # Populated with bigram term frequency
+        submission_authors.append(author)
 
-            with AST.open(source) as root:
-                # Resolve the author name from the source filename
-                source_filename: str = root.properties["NAME"]
-                author = source_filename[: source_filename.rindex("_")]
-                submission_authors.append(author)
+        bigram_counts.append(bigram_term_frequency(root, bigrams))
+        if hash_dim is None:  # Buckets are known ahead of time
+            unique_bigrams.update(bigrams.keys())
+        feature_set.append(bigrams)
 
-                bigram_term_frequency(root, bigrams)
-                unique_bigrams.update(bigrams.keys())
-                feature_set.append(bigrams)
+    if hash_dim is not None:
+        unique_bigrams = range(hash_dim)  # Fixed-width output columns
 
     with open(output_filename, "wt", encoding="utf-8") as output:
         output.write(f"author,{','.join(map(lambda b: hex(b)[2:], unique_bigrams))}\n")
 
         for submission, bigram_frequency in enumerate(feature_set):
-            bigram_count = sum(bigrams.values())
+            bigram_count = bigram_counts[submission]
 
             output.write(submission_authors[submission])
             for bigram in unique_bigrams:
@@ -91,6 +129,94 @@ def export_bigrams(
             output.write("\n")  # Terminate the record entry and flush the buffer
 
 
+def export_subtrees(
+    sources: str | Sequence[str],
+    output_filename: str | bytes | PathLike,
+    max_depth: int = 3,
+    hash_dim: Optional[int] = None,
+) -> None:
+    """
+    Exports the term frequency of depth-limited AST subtrees from the
+    specified source code files or code property graphs (CPGs).
+
+    Every node contributes one subtree per depth from 1 to `max_depth`, whose
+    Merkle hash combines the node's type with the hashes of its children's
+    subtrees one level shallower (ordered by the `ORDER` property). All hashes
+    are computed bottom-up in a single, iterative post-order pass, so the cost
+    is linear in the number of nodes and unaffected by the recursion limit.
+
+    Args:
+        sources: A string or sequence of strings representing the source code
+            files or CPGs to be processed.
+        output: A string, bytes object, or Path-like object specifying the
+            output CSV file path.
+        max_depth: The depth of the deepest subtrees to hash.
+        hash_dim: The number of signed hash buckets to fold subtrees into, or
+            `None` to emit one column per distinct subtree.
+    """
+
+    if max_depth < 1:
+        raise ValueError("max_depth must be a positive integer")
+
+    unique_subtrees: set[int] = set()
+    feature_set: list[dict[int, int]] = []
+    subtree_counts: list[int] = []
+
+    def subtree_term_frequency(root: AST, features: dict[int, int]) -> int:
+        subtree_hashes: dict[int, list[int]] = {}  # Keyed on `id(node)`
+        stack: list[tuple[AST, Optional[list[AST]]]] = [(root, None)]
+        count = 0  # Number of subtrees hashed within the tree
+
+        while stack:
+            node, children = stack.pop()
+            if children is None:  # Revisit the node once its children are hashed
+                children = sorted(node.children, key=_ast_order)
+                stack.append((node, children))
+                stack.extend((child, None) for child in children)
+                continue
+
+            # Children are only needed by their parent, so release them here
+            child_hashes = [subtree_hashes.pop(id(child)) for child in children]
+            label = zlib.crc32(node.name.encode())
+
+            hashes = []  # Subtree hashes rooted at the node, for each depth
+            for depth in range(1, max_depth + 1):
+                merkle = [depth] + [h[depth - 2] for h in child_hashes if depth > 1]
+                merkle = struct.pack(f"<{len(merkle)}I", *merkle)
+                subtree_hash = zlib.crc32(merkle, label)
+                hashes.append(subtree_hash)
+
+                subtree_hash, sign = _fold_hash(subtree_hash, hash_dim)
+                features[subtree_hash] = features.get(subtree_hash, 0) + sign
+            subtree_hashes[id(node)] = hashes
+            count += max_depth
+        return count
+
+    submission_authors: list[str] = []
+    for author, root in _submissions(sources):
+        subtrees = {}  # Populated with subtree term frequency
+        submission_authors.append(author)
+
+        subtree_counts.append(subtree_term_frequency(root, subtrees))
+        if hash_dim is None:  # Buckets are known ahead of time
+            unique_subtrees.update(subtrees.keys())
+        feature_set.append(subtrees)
+
+    if hash_dim is not None:
+        unique_subtrees = range(hash_dim)  # Fixed-width output columns
+
+    with open(output_filename, "wt", encoding="utf-8") as output:
+        output.write(f"author,{','.join(map(lambda s: hex(s)[2:], unique_subtrees))}\n")
+
+        for submission, subtree_frequency in enumerate(feature_set):
+            subtree_count = subtree_counts[submission]
+
+            output.write(submission_authors[submission])
+            for subtree in unique_subtrees:
+                output.write(f",{subtree_frequency.get(subtree, 0) / subtree_count:.3}")
+            output.write("\n")  # Terminate the record entry and flush the buffer
+
+
 def export_static(
     sources: str | Sequence[str],
     output_filename: str | bytes | PathLike,
@@ -150,43 +276,19 @@ def export_static(
     submission_authors: list[str] = []
     feature_set: list[list[tuple[int, int]]] = []
     node_usage: list[set[str]] = [set() for _ in range(len(AST_NODE_TYPES))]
-    for idx, source in enumerate(sources):
-        # TODO: shift from splitext to reading file signature
-        if os.path.splitext(source)[1] != "bin":
-            with Graph(source, "r") as graph:
-                for graph_soure in graph.schema.sources:
-                    average_depth = [(0, 0)] * len(AST_NODE_TYPES)
-                    root = AST(graph, graph_soure)
-                    source_filename: str = root.properties["NAME"]
-                    author = source_filename[: source_filename.rindex("_")]
-
-                    # Update author submissions with current submission
-                    submission_authors.append(author)
-
-                    max_depth.append(max_node_depth(root))
-                    node_type_average_depth(root, average_depth)
-                    feature_set.append(average_depth)
-
-                    for node_idx, (_, count) in enumerate(average_depth):
-                        if count > 0:  # Only add author if node is present
-                            node_usage[node_idx].add(author)
-        else:
-            average_depth = [(0, 0)] * len(AST_NODE_TYPES)
-            with AST.open(source) as root:
-                # Resolve the author name from the source filename
-                source_filename: str = root.properties["NAME"]
-                author = source_filename[: source_filename.rindex("_")]
+    for author, root in _submissions(sources):
+        average_depth = [(0, 0)] * len(AST_NODE_TYPES)
 
-                # Update author submissions with current submission
-                submission_authors.append(author)
+        # Update author submissions with current submission
+        submission_authors.append(author)
 
-                max_depth.append(max_node_depth(root))
-                node_type_average_depth(root, average_depth)
-                feature_set.append(average_depth)
+        max_depth.append(max_node_depth(root))
+        node_type_average_depth(root, average_depth)
+        feature_set.append(average_depth)
 
-                for node_idx, (_, count) in enumerate(average_depth):
-                    if count > 0:  # Only add author if node is present
-                        node_usage[node_idx].add(author)
+        for node_idx, (_, count) in enumerate(average_depth):
+            if count > 0:  # Only add author if node is present
+                node_usage[node_idx].add(author)
 
     ratio = lambda f: f",{f[0]/max(f[1], 1):3}"  # TF / (# of authors used)
     document_frequency: list[int] = [len(n) for n in node_usage]
@@ -212,54 +314,40 @@ def export_leaves(
     sources: str | Sequence[str],
     output_filename: str | bytes | PathLike,
     output_format: Literal["csv"] = "csv",
+    hash_dim: Optional[int] = None,
 ) -> None:
     if output_format != "csv":
         raise NotImplementedError()
 
     unique_leaves: set[int] = set()
-    feature_set: list[dict[int, int]] = []
+    feature_set: list[dict[int, tuple[int, int, int]]] = []
 
     def leaf_term_frequency(
-        node: AST, depth: int, features: dict[int, tuple[int, int]]
+        node: AST, depth: int, features: dict[int, tuple[int, int, int]]
     ):
         if not node.children:
             node_hash = zlib.crc32(node.code.encode())
-            count, sum_depth = features.get(node_hash, (0, 0))
-            count, sum_depth = count + 1, sum_depth + depth
-            features[node_hash] = (count, sum_depth)
+            node_hash, sign = _fold_hash(node_hash, hash_dim)
+            frequency, count, sum_depth = features.get(node_hash, (0, 0, 0))
+            frequency, count, sum_depth = frequency + sign, count + 1, sum_depth + depth
+            features[node_hash] = (frequency, count, sum_depth)
             return  # Don't try to process any children
 
         for child in node.children:
             leaf_term_frequency(child, depth + 1, features)
 
     submission_authors: list[str] = []
-    for source in sources:
-        # TODO: shift from splitext to reading file signature
-        if os.path.splitext(source)[1] != "bin":
-            with Graph(source, "r") as graph:
-                for graph_soure in graph.schema.sources:
-                    root = AST(graph, graph_soure)
-                    leaves = {}  # Populated with bigram term frequency
-                    source_filename: str = root.properties["NAME"]
-                    author = source_filename[: source_filename.rindex("_")]
-                    submission_authors.append(author)
+    for author, root in _submissions(sources):
+        leaves = {}  # Populated with leaf term frequency
+        submission_authors.append(author)
 
-                    leaf_term_frequency(root, 0, leaves)
-                    unique_leaves.update(leaves.keys())
-                    feature_set.append(leaves)
+        leaf_term_frequency(root, 0, leaves)
+        if hash_dim is None:  # Buckets are known ahead of time
+            unique_leaves.update(leaves.keys())
+        feature_set.append(leaves)
 
-        else:
-            leaves = {}  # Populated with bigram term frequency
-
-            with AST.open(source) as root:
-                # Resolve the author name from the source filename
-                source_filename: str = root.properties["NAME"]
-                author = source_filename[: source_filename.rindex("_")]
-                submission_authors.append(author)
-
-                leaf_term_frequency(root, 0, leaves)
-                unique_leaves.update(leaves.keys())
-                feature_set.append(leaves)
+    if hash_dim is not None:
+        unique_leaves = range(hash_dim)  # Fixed-width output columns
 
     with open(output_filename, "wt", encoding="utf-8") as output:
         output.write(
@@ -267,16 +355,81 @@ def export_leaves(
         )
 
         for submission, leaves in enumerate(feature_set):
-            leaf_count = sum(map(lambda f: f[0], leaves.values()))
+            leaf_count = sum(map(lambda f: f[1], leaves.values()))
 
             output.write(submission_authors[submission])
             for leaf in unique_leaves:
-                count, depth = leaves.get(leaf, (0, 0))
+                frequency, count, depth = leaves.get(leaf, (0, 0, 0))
                 avg_depth = depth / count if count else -1.
-                output.write(f",{count / leaf_count:.3},{avg_depth:.3}")
+                output.write(f",{frequency / leaf_count:.3},{avg_depth:.3}")
             output.write("\n")  # Terminate the record entry and flush the buffer
 
 
+def load_corpus(
+    archive: str | bytes | PathLike,
+    cpg: str | bytes | PathLike,
+    authors: Optional[Sequence[str]] = None,
+    languages: Optional[Sequence[str]] = None,
+) -> str | bytes | PathLike:
+    """Parse the submissions of a packed corpus archive into a single CPG.
+
+    The selected submissions are unpacked as "<author>_<submission id>.<ext>"
+    files, the naming the exporters resolve authors from, and parsed by one
+    joern-parse run rather than one per submission.
+
+    Args:
+        archive: Path to the packed corpus archive (see scripts/corpus.py).
+        cpg: Path the resulting CPG is written to.
+        authors: Only unpack the submissions of these authors, if given.
+        languages: Only unpack the submissions in these languages, if given.
+
+    Returns:
+        The path of the CPG, which the exporters accept as a source.
+    """
+    if SCRIPTS_DIR not in sys.path:
+        sys.path.append(SCRIPTS_DIR)
+    from corpus import Corpus  # pylint: disable=import-outside-toplevel
+
+    corpus = Corpus(archive)
+    with tempfile.TemporaryDirectory() as directory:
+        for index in corpus.select(authors, languages):
+            filename = (
+                f"{corpus.author(index)}_{corpus.submission_id(index)}"
+                f".{corpus.language(index)}"
+            )
+            with open(os.path.join(directory, filename), "wb") as source:
+                source.write(corpus.source(index))
+
+        subprocess.run(["joern-parse", "-o", cpg, directory], check=True)
+    return cpg
+
+
+def _hash_dimension(value: str) -> int:
+    """Parse a `--hash-dim` value, which must be a power of two from 1 to 2^31.
+
+    The value is an integer literal, in decimal or with a 0x, 0o or 0b prefix
+    (e.g., 4096 or 0x1000); expressions such as 2^12 are rejected.
+    """
+    try:
+        hash_dim = int(value, 0)
+    except ValueError:
+        raise ArgumentTypeError(f"{value!r} is not an integer (e.g., 4096 or 0x1000)") from None
+    if hash_dim < 1 or hash_dim & (hash_dim - 1) or hash_dim > 1 << 31:
+        raise ArgumentTypeError(f"{value} is not a power of two from 1 to 2147483648")
+    return hash_dim
+
+
+def _subtree_depth(value: str) -> int:
+    """Parse a `--subtree-depth` value, which must be a positive integer."""
+    try:
+        depth = int(value)
+    except ValueError:
+        raise ArgumentTypeError(f"{value!r} is not an integer") from None
+    if depth < 1:
+        raise ArgumentTypeError(f"{value} is not a positive depth (1 or more)")
+    return depth
+
+
 def _parse_arguments(args: Optional[Sequence[str]] = None) -> Namespace:
     parser = ArgumentParser()
     subparsers = parser.add_subparsers(required=True)
@@ -296,6 +449,22 @@ def _parse_arguments(args: Optional[Sequence[str]] = None) -> Namespace:
         required=False,
         metavar="<file>",
     )
+    syntactic_parser.add_argument(
+        "--subtree-output",
+        default="syntactic_subtrees.csv",
+        dest="subtree_path",
+        required=False,
+        metavar="<file>",
+    )
+    syntactic_parser.add_argument(
+        "--subtree-depth",
+        default=3,
+        type=_subtree_depth,
+        dest="subtree_depth",
+        required=False,
+        metavar="<k>",
+        help="hash AST subtrees of depth 1 through k",
+    )
     syntactic_parser.add_argument(
         "--output",
         default="syntactic.csv",
@@ -303,16 +472,60 @@ def _parse_arguments(args: Optional[Sequence[str]] = None) -> Namespace:
         required=False,
         metavar="<file>",
     )
+    syntactic_parser.add_argument(
+        "--hash-dim",
+        default=None,
+        type=_hash_dimension,
+        dest="hash_dim",
+        required=False,
+        metavar="<n>",
+        help="fold bigram, leaf and subtree features into n signed hash buckets, where n is "
+        "a power of two from 1 to 2^31 given as an integer (e.g., 4096 or 0x1000)",
+    )
+
+    syntactic_parser.add_argument(
+        "--corpus",
+        default=None,
+        dest="corpus",
+        required=False,
+        metavar="<archive>",
+        help="also read the submissions of a packed corpus archive",
+    )
+    syntactic_parser.add_argument(
+        "--language",
+        default=None,
+        action="append",
+        dest="languages",
+        required=False,
+        metavar="<lang>",
+        help="only read archived submissions in this language (may be repeated)",
+    )
 
-    syntactic_parser.add_argument("files", nargs="+", metavar="FILE")
-    return parser.parse_args(args)  # If none are supplied, fall back to CLI
+    syntactic_parser.add_argument("files", nargs="*", metavar="FILE")
+    parsed = parser.parse_args(args)  # If none are supplied, fall back to CLI
+    if not parsed.files and parsed.corpus is None:
+        syntactic_parser.error("no source files or --corpus archive were given")
+    return parsed
 
 
 def main():
     args = _parse_arguments()
-    export_static(args.files, args.static_path)
-    export_bigrams(args.files, args.bigram_path)
-    export_leaves(args.files, args.leaf_path)
+
+    # A corpus's CPG is only needed by the exports, and is removed afterwards
+    with tempfile.TemporaryDirectory() as directory:
+        if args.corpus is not None:
+            cpg = os.path.join(directory, "corpus.bin")  # Written by joern-parse
+            args.files.append(load_corpus(args.corpus, cpg, languages=args.languages))
+
+        export_static(args.files, args.static_path)
+        export_bigrams(args.files, args.bigram_path, hash_dim=args.hash_dim)
+        export_leaves(args.files, args.leaf_path, hash_dim=args.hash_dim)
+        export_subtrees(
+            args.files,
+            args.subtree_path,
+            max_depth=args.subtree_depth,
+            hash_dim=args.hash_dim,
+        )
 
 
 if __name__ == "__main__":
@@ -1,4 +1,3 @@
-import pandas as pd
 import zlib
 
 from flatgraph.layers.ast import Cursor, TranslationUnit
@@ -66,6 +65,8 @@ def _average_leaf_depth(cursor: Cursor) -> dict[int, int]:
 
 
 def export_bigram_term_frequency(source_file: str, output_file: str) -> None:
+    import pandas as pd  # Deferred, since it dominates the module's import time
+
     tu = TranslationUnit.from_source(source_file)
     bigrams = _bigram_term_frequency(tu.cursor)
     
@@ -0,0 +1,199 @@
+import os
+import random
+from argparse import ArgumentParser
+from collections import defaultdict
+
+import numpy as np
+
+from lsh import MinHashLSH
+from ngramValidated import count_ngrams, group_by_author, load_corpus, read_source
+
+# Get the author of a submission file, named "<author>$<submission id>.<ext>".
+def submission_author(file_path):
+    return os.path.basename(file_path).split('$')[0]
+
+# Get the (integer) submission id of a submission file.
+def submission_id(file_path):
+    return int(os.path.basename(file_path).split('$')[1].split('.')[0])
+
+# Order files by their submission ids (numerically, so "a$9" precedes "a$10").
+def submission_order(file_path):
+    return submission_id(file_path), file_path
+
+# Find clusters of near-duplicate submissions, such as resubmissions of almost
+# identical code. Each file's set of byte n-grams is summarized by a MinHash
+# signature and indexed with LSH, so only the files sharing a band are
+# compared, by the fraction of equal signature entries (their estimated
+# Jaccard similarity). Pairs at or above `threshold` are merged into clusters
+# with a union-find, which keeps the whole pass roughly linear in the number
+# of files. Unless `across_authors`, only an author's own files are compared.
+#
+# Returns every file (unreadable ones excepted) in exactly one cluster; files
+# shorter than n bytes are never near-duplicates, so they stay on their own.
+# The files within each cluster are ordered by submission id (see
+# `submission_order`), and the clusters by their first files.
+def find_near_duplicates(
+    file_paths,
+    n=8,
+    threshold=0.8,
+    num_perm=128,
+    bands=32,
+    across_authors=False,
+    seed=0,
+):
+    file_paths = sorted(file_paths)
+    groups = {None: file_paths} if across_authors else group_by_author(file_paths)
+
+    parents = {}  # Union-find forest over the file paths
+
+    def find(file_path):
+        while parents[file_path] != file_path:
+            parents[file_path] = parents[parents[file_path]]  # Path halving
+            file_path = parents[file_path]
+        return file_path
+
+    for files in groups.values():
+        lsh = MinHashLSH(num_perm, bands, seed)
+        indexed_paths, signatures = [], []  # Files indexed within this group
+        for file_path in files:
+            try:
+                hashes, _ = count_ngrams(read_source(file_path), n)
+            except Exception as e:
+                print(f"Error processing file {file_path}: {e}")
+                continue
+
+            parents[file_path] = file_path
+            if len(hashes) == 0:
+                # Shorter than n bytes, so there is nothing to compare: every
+                # such file would share the same (empty set) signature
+                continue
+
+            signature = lsh.signature(hashes)
+            for candidate in lsh.query(signature):
+                if np.mean(signatures[candidate] == signature) >= threshold:
+                    root, other = find(file_path), find(indexed_paths[candidate])
+                    parents[max(root, other)] = min(root, other)
+
+            lsh.insert(len(signatures), signature)
+            indexed_paths.append(file_path)
+            signatures.append(signature)
+
+    clusters = defaultdict(list)
+    for file_path in parents:
+        clusters[find(file_path)].append(file_path)
+    clusters = [sorted(cluster, key=submission_order) for cluster in clusters.values()]
+    return sorted(clusters, key=lambda cluster: submission_order(cluster[0]))
+
+# Keep one submission of every cluster: the earliest, by submission id.
+def deduplicate(clusters):
+    return [min(cluster, key=submission_order) for cluster in clusters]
+
+# Split the files into training and testing sets like
+# `split_files_across_authors`, except that each cluster of near-duplicates is
+# kept whole, so no submission has a near-duplicate on the other side. Every
+# file is filed under its own author, even in clusters spanning several (see
+# `find_near_duplicates`'s `across_authors`).
+def split_clusters_across_authors(clusters, train_proportion=0.80):
+    file_counts = defaultdict(int)
+    for cluster in clusters:
+        for file_path in cluster:
+            file_counts[submission_author(file_path)] += 1
+
+    clusters = list(clusters)
+    random.shuffle(clusters)
+
+    train_files = defaultdict(list)
+    test_files = defaultdict(list)
+    for cluster in clusters:
+        cluster_authors = defaultdict(list)
+        for file_path in cluster:
+            cluster_authors[submission_author(file_path)].append(file_path)
+
+        # Fill the training set first, until any of the cluster's authors
+        # would exceed their proportion
+        in_train = all(
+            len(train_files[author]) + len(files) <= file_counts[author] * train_proportion
+            for author, files in cluster_authors.items()
+        )
+        for author, files in cluster_authors.items():
+            (train_files if in_train else test_files)[author].extend(files)
+
+    return train_files, test_files
+
+
+def _parse_arguments(args=None):
+    parser = ArgumentParser(description="Detect and prune near-duplicate submissions.")
+    parser.add_argument("source_code_dir", metavar="DIR")
+    parser.add_argument("-n", default=8, type=int, dest="n", help="n-gram size")
+    parser.add_argument(
+        "--threshold",
+        default=0.8,
+        type=float,
+        metavar="<j>",
+        help="minimum estimated Jaccard similarity of near-duplicates",
+    )
+    parser.add_argument("--perm", default=128, type=int, dest="num_perm", metavar="<k>")
+    parser.add_argument("--bands", default=32, type=int, metavar="<b>")
+    parser.add_argument(
+        "--across-authors",
+        action="store_true",
+        help="also detect near-duplicates between different authors",
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        metavar="<file>",
+        help="write the deduplicated file list to this file",
+    )
+    parser.add_argument(
+        "--sql",
+        default=None,
+        metavar="<file>",
+        help="write UPDATE statements flagging duplicates in codeforces_submission",
+    )
+    return parser.parse_args(args)  # If none are supplied, fall back to CLI
+
+
+def main():
+    args = _parse_arguments()
+    file_paths = load_corpus(args.source_code_dir)
+
+    clusters = find_near_duplicates(
+        file_paths,
+        args.n,
+        args.threshold,
+        args.num_perm,
+        args.bands,
+        args.across_authors,
+    )
+    kept = deduplicate(clusters)
+    print(
+        f"{len(kept)} of {sum(map(len, clusters))} submissions kept "
+        f"({sum(len(c) > 1 for c in clusters)} clusters of near-duplicates)"
+    )
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.writelines(f"{file_path}\n" for file_path in kept)
+
+    if args.sql is not None:
+        # Submission ids are integers (see `submission_id`), and are bound to
+        # a prepared statement's parameters rather than spliced into the
+        # UPDATE itself. Each cluster's earliest submission is the original.
+        with open(args.sql, 'w') as f:
+            f.write(
+                "PREPARE flag_duplicate FROM "
+                "'UPDATE codeforces_submission SET duplicate_of = ? WHERE id = ?';\n"
+            )
+            for cluster in clusters:
+                for duplicate in cluster[1:]:
+                    f.write(
+                        f"SET @original = {submission_id(cluster[0])}, "
+                        f"@duplicate = {submission_id(duplicate)};\n"
+                        "EXECUTE flag_duplicate USING @original, @duplicate;\n"
+                    )
+            f.write("DEALLOCATE PREPARE flag_duplicate;\n")
+
+
+if __name__ == "__main__":
+    main()
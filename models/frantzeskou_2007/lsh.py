@@ -0,0 +1,284 @@
+import math
+import time
+from argparse import ArgumentParser
+from collections import defaultdict
+
+import numpy as np
+
+from ngramValidated import (
+    NgramCache,
+    Profile,
+    get_author_profiles,
+    k_fold_splits,
+    load_corpus,
+    relative_distance,
+    scapRD,
+    scapSPI,
+)
+
+UINT64_MAX = np.iinfo(np.uint64).max
+
+# The splitmix64 finalizer, applied element-wise to a uint64 array. It is a
+# bijection with good avalanche, so `mix(x ^ seed)` acts as one random
+# permutation of the n-gram hashes per seed.
+def mix(x):
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+# Locality-sensitive hashing of n-gram sets: each set is summarized by a
+# MinHash signature of `num_perm` minima, which is split into `bands` bands of
+# num_perm / bands rows. Two sets become candidates of each other when any of
+# their bands match exactly, which for sets with Jaccard similarity J happens
+# with probability 1 - (1 - J**rows)**bands. More bands (fewer rows) raise the
+# recall, at the cost of more candidates to score.
+class MinHashLSH:
+    def __init__(self, num_perm=128, bands=32, seed=0):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.seeds = mix(np.arange(num_perm, dtype=np.uint64) + np.uint64(seed))
+        self.buckets = [defaultdict(list) for _ in range(bands)]
+
+    # MinHash signature of a set of n-gram hashes (an empty set has all maxima).
+    def signature(self, hashes):
+        signature = np.full(self.num_perm, UINT64_MAX, dtype=np.uint64)
+        for chunk in range(0, len(hashes), 4096):  # Bounds the permuted block
+            block = mix(np.asarray(hashes[chunk:chunk + 4096])[:, None] ^ self.seeds)
+            np.minimum(signature, block.min(axis=0), out=signature)
+        return signature
+
+    # Hash each band of a signature into a single bucket key.
+    def band_keys(self, signature):
+        rows = signature.reshape(self.bands, self.rows)
+        keys = np.zeros(self.bands, dtype=np.uint64)
+        for row in range(self.rows):
+            keys = mix(keys ^ rows[:, row])
+        return keys.tolist()
+
+    # Index `key` under the bands of a signature.
+    def insert(self, key, signature):
+        for band, band_key in enumerate(self.band_keys(signature)):
+            self.buckets[band][band_key].append(key)
+
+    # Get the keys sharing at least one band with a signature, among the first
+    # `bands` bands (or all of them).
+    def query(self, signature, bands=None):
+        candidates = set()
+        for band, band_key in enumerate(self.band_keys(signature)[:bands]):
+            candidates.update(self.buckets[band].get(band_key, ()))
+        return candidates
+
+# LSH for containment, |Q & X| / |Q|, of a query set Q in the indexed sets X
+# (LSH Ensemble, Zhu et al., 2016). A small query is only a sliver of a large
+# set, so their Jaccard similarity, which MinHash estimates, stays low however
+# contained the query is; banding tuned for Jaccard misses such sets. Instead,
+# the sets are partitioned by size, and a containment threshold t is turned
+# into the Jaccard threshold t * q / (q + u - t * q) of a query of size q
+# against the largest set (of size u) of each partition. Each partition is
+# indexed with 1 through `max_rows` rows per band (and as many bands as fit
+# in `num_perm`), and is queried with the layout, and the number of its bands,
+# that retrieves a set at the threshold with probability `recall` but the
+# fewest sets below it.
+class ContainmentLSH:
+    def __init__(self, num_perm=128, partitions=8, max_rows=8, recall=0.95, seed=0):
+        self.num_perm = num_perm
+        self.partitions = partitions
+        self.recall = recall
+        self.signer = MinHashLSH(num_perm, 1, seed)
+        self.layouts = [
+            (num_perm // rows, rows) for rows in range(1, min(max_rows, num_perm) + 1)
+        ]
+        self.entries = []  # (key, signature, size) of every set added
+        self.indexes = []  # (largest size, an index per layout) of each partition
+
+    # MinHash signature of a set of n-gram hashes (see `MinHashLSH.signature`).
+    def signature(self, hashes):
+        return self.signer.signature(hashes)
+
+    # Add `key`'s set, of `size` elements, to be indexed by `build`.
+    def add(self, key, signature, size):
+        self.entries.append((key, signature, size))
+
+    # Partition the added sets by size (equally many per partition) and index
+    # every partition under each layout. Sets added since are not indexed.
+    def build(self):
+        entries = sorted(self.entries, key=lambda entry: entry[2])
+        self.indexes = []
+        for part in np.array_split(np.arange(len(entries)), self.partitions):
+            if not len(part):
+                continue
+            indexes = []
+            for bands, rows in self.layouts:
+                # Only ever given prefixes of signatures, never asked to sign
+                lsh = MinHashLSH(bands * rows, bands)
+                for i in part:
+                    key, signature, _ = entries[i]
+                    lsh.insert(key, signature[:bands * rows])
+                indexes.append(lsh)
+            self.indexes.append((entries[part[-1]][2], indexes))
+
+    # The layout and number of bands queried for a Jaccard threshold J. With r
+    # rows and b bands, a set at J is retrieved with probability
+    # 1 - (1 - J**r)**b, so each layout needs the fewest b reaching `recall`;
+    # of those that fit, the one with the lowest mean probability below J wins.
+    # If none fits, every band of a single row is queried.
+    def layout(self, jaccard):
+        below = np.linspace(0, jaccard, 16, endpoint=False)
+        best, best_false = (0, self.layouts[0][0]), math.inf
+        for i, (max_bands, rows) in enumerate(self.layouts):
+            probability = jaccard ** rows
+            if probability >= 1:
+                bands = 1
+            elif probability > 0:
+                bands = math.ceil(math.log(1 - self.recall) / math.log1p(-probability))
+            else:
+                continue
+            if bands > max_bands:
+                continue
+
+            false = np.mean(1 - (1 - below ** rows) ** bands)
+            if false < best_false:
+                best, best_false = (i, bands), false
+        return best
+
+    # Get the keys whose sets may contain at least `containment` of the query
+    # set of `size` elements.
+    def query(self, signature, size, containment):
+        candidates = set()
+        if size == 0:
+            return candidates  # An empty query is contained in nothing
+
+        shared = containment * size
+        for largest, indexes in self.indexes:
+            jaccard = shared / max(size + largest - shared, 1)
+            layout, bands = self.layout(jaccard)
+            lsh = indexes[layout]
+            candidates.update(lsh.query(signature[:lsh.num_perm], bands))
+        return candidates
+
+# Approximate candidate generation for attribution against many authors. The
+# authors' top-L n-gram sets are indexed with LSH for containment, and only the
+# authors whose sets may contain at least `containment` of a query's n-grams
+# are scored exactly with SCAP's RD or SPI.
+class CandidateIndex:
+    def __init__(self, author_profiles, L, containment=0.2, num_perm=128, partitions=8, seed=0):
+        self.L = L
+        self.containment = containment
+        self.lsh = ContainmentLSH(num_perm, partitions, seed=seed)
+        self.authors = list(author_profiles)
+        self.profiles = [author_profiles[author].truncate(L) for author in self.authors]
+        for author_id, profile in enumerate(self.profiles):
+            self.lsh.add(author_id, self.lsh.signature(profile.hashes), len(profile))
+        self.lsh.build()
+
+    # Ids of the candidate authors for a (truncated) profile, in author order.
+    def candidates(self, unknown_profile):
+        signature = self.lsh.signature(unknown_profile.hashes)
+        return sorted(self.lsh.query(signature, len(unknown_profile), self.containment))
+
+    # Attribute a profile by scoring its candidates exactly. Without any
+    # candidates, every author is scored if `fallback`, or None is returned.
+    def attribute(self, unknown_profile, method=scapRD, fallback=True):
+        unknown_profile = unknown_profile.truncate(self.L)
+        candidates = self.candidates(unknown_profile)
+        if not candidates:
+            if not fallback:
+                return None
+            candidates = range(len(self.authors))
+
+        profiles = [self.profiles[a] for a in candidates]
+        if method is scapRD:
+            scores = [-relative_distance(p, unknown_profile) for p in profiles]
+        elif method is scapSPI:
+            scores = [int(p.intersect(unknown_profile)[0].sum()) for p in profiles]
+        else:
+            raise ValueError(f"candidate attribution is not supported for {method}")
+
+        # Ties resolve to the first author, as `np.argmax` returns the first maximum
+        return self.authors[candidates[int(np.argmax(scores))]]
+
+
+def _parse_arguments(args=None):
+    parser = ArgumentParser(
+        description="Report the recall and latency of LSH candidate search."
+    )
+    parser.add_argument("source_code_dir", metavar="DIR")
+    parser.add_argument("-n", default=30, type=int, dest="n", help="n-gram size")
+    parser.add_argument("-L", default=6000, type=int, dest="L", help="profile length")
+    parser.add_argument("--method", default="rd", choices=("rd", "spi"))
+    parser.add_argument("--folds", default=5, type=int, dest="k_folds", metavar="<k>")
+    parser.add_argument("--perm", default=128, type=int, dest="num_perm", metavar="<k>")
+    parser.add_argument(
+        "--containment",
+        default=0.2,
+        type=float,
+        metavar="<t>",
+        help="retrieve the authors that may hold at least this share of a query's "
+        "n-grams; lower values raise recall and the number of candidates scored",
+    )
+    parser.add_argument(
+        "--partitions",
+        default=8,
+        type=int,
+        metavar="<k>",
+        help="partitions of the authors by n-gram set size",
+    )
+    return parser.parse_args(args)  # If none are supplied, fall back to CLI
+
+
+def main():
+    args = _parse_arguments()
+    method = scapRD if args.method == "rd" else scapSPI
+
+    file_paths = load_corpus(args.source_code_dir)
+    cache = NgramCache(args.n)
+
+    queries = recalled = correct = candidate_count = author_count = fallbacks = 0
+    elapsed = 0.0
+    for train_files, test_files in k_fold_splits(file_paths, args.k_folds):
+        author_profiles = get_author_profiles(train_files, args.n, cache=cache)
+        index = CandidateIndex(
+            author_profiles, args.L, args.containment, args.num_perm, args.partitions
+        )
+
+        for true_author, files in test_files.items():
+            for file_path in files:
+                start = time.perf_counter()
+                unknown_profile = Profile(*cache.counts(file_path)).truncate(args.L)
+                attributed_author = index.attribute(unknown_profile, method)
+                elapsed += time.perf_counter() - start
+
+                # Recall is measured outside of the timing, which covers a
+                # single query as `attribute` serves it
+                candidates = [index.authors[a] for a in index.candidates(unknown_profile)]
+
+                queries += 1
+                recalled += true_author in candidates
+                fallbacks += not candidates
+                correct += attributed_author == true_author
+                candidate_count += len(candidates)
+                author_count += len(index.authors)
+
+    queries = max(queries, 1)
+    # Queries without candidates are scored against every author, so a high
+    # fallback rate means accuracy and latency are mostly the full scan's
+    print(
+        f"Candidate recall: {recalled / queries:.4f} "
+        f"(fallback to every author on {fallbacks / queries:.2%} of queries)"
+    )
+    print(
+        f"Candidates per query: {candidate_count / queries:.1f} "
+        f"({candidate_count / max(author_count, 1):.2%} of authors)"
+    )
+    print(f"Attribution accuracy: {correct / queries:.4f}")
+    print(f"Mean latency: {elapsed / queries * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
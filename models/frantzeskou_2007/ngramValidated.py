@@ -1,81 +1,671 @@
+import hashlib
+import json
 import os
 import random
-from collections import defaultdict, Counter
-from sklearn.model_selection import KFold
+import struct
+import sys
+import tempfile
+import time
+import zipfile
+from argparse import ArgumentParser
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
-# Generate byte-level n-grams from a string of source code.
-def get_ngrams(s, n):
-    s_bytes = s.encode()
-    byte_ngrams = [s_bytes[i:i+n] for i in range(len(s_bytes) - n + 1)]
-    return byte_ngrams
+import numpy as np
+
+# Base of the polynomial rolling hash. It is odd, so it has a multiplicative
+# inverse modulo 2**64, which uint64 arithmetic wraps around for free.
+HASH_BASE = 0x100000001B3
+HASH_BASE_INVERSE = pow(HASH_BASE, -1, 1 << 64)
+HASH_SCHEME = f"polynomial-u64-{HASH_BASE:#x}"
+
+# Profile index files start with these magic bytes and the manifest's offset,
+# mirroring the layout of the flatgraph databases the syntactic model reads.
+INDEX_MAGIC = b"SCAPPROF"
+INDEX_HEADER_FORMAT = f"<{len(INDEX_MAGIC)}sQ"
+INDEX_HEADER_SIZE = struct.calcsize(INDEX_HEADER_FORMAT)
+INDEX_ALIGNMENT = 64  # Array alignment within the index, in bytes
+
+# Documents scored against the authors at a time, which bounds the dense
+# (documents x authors) arrays of batch attribution however many are attributed
+SCORE_CHUNK_SIZE = 256
+
+# Directory holding the scripts shared by every model, such as corpus.py
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'scripts')
+
+# Read a source file as the bytes its n-grams are extracted from. Entries of a
+# packed corpus archive are read as zero-copy views of the archive instead.
+def read_source(file_path):
+    if hasattr(file_path, 'read'):
+        return file_path.read()
+    with open(file_path, 'r') as f:
+        return f.read().encode()
+
+# Identify a source file's current contents by its path, size and
+# modification time (or, for archive entries, the archive's).
+def source_key(file_path):
+    if hasattr(file_path, 'cache_key'):
+        return file_path.cache_key
+    stat = os.stat(file_path)
+    return f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+# List the submissions of a corpus: either a directory of
+# "<author>$<submission id>.<ext>" files, or a packed corpus archive (see
+# scripts/corpus.py), optionally filtered by author or language.
+def load_corpus(path, authors=None, languages=None):
+    if os.path.isdir(path):
+        file_paths = sorted(os.path.join(path, f) for f in os.listdir(path))
+        if authors is not None:
+            authors = set(authors)
+            file_paths = [p for p in file_paths if os.path.basename(p).split('$')[0] in authors]
+        if languages is not None:
+            languages = set(languages)
+            file_paths = [p for p in file_paths if os.path.splitext(p)[1][1:] in languages]
+        return file_paths
+
+    if SCRIPTS_DIR not in sys.path:
+        sys.path.append(SCRIPTS_DIR)
+    from corpus import open_corpus
+
+    return sorted(open_corpus(path).entries(authors, languages))
+
+# Prefix sums of the polynomial rolling hash (see `hash_ngrams`). They do not
+# depend on n, so they can be computed once per file and reused for every n.
+def rolling_hash_prefix(data):
+    powers = np.full(len(data), HASH_BASE, dtype=np.uint64)
+    inverse_powers = np.full(len(data), HASH_BASE_INVERSE, dtype=np.uint64)
+    powers[:1] = inverse_powers[:1] = 1
+    np.cumprod(powers, out=powers)
+    np.cumprod(inverse_powers, out=inverse_powers)
+
+    prefix = np.zeros(len(data) + 1, dtype=np.uint64)
+    np.cumsum(np.frombuffer(data, dtype=np.uint8) * inverse_powers, out=prefix[1:])
+    return prefix, powers
+
+# Hash every byte-level n-gram of `data` with a polynomial rolling hash.
+#
+# With prefix[i] = sum(data[j] * B**-j for j < i), the hash of the n-gram at
+# offset i is (prefix[i + n] - prefix[i]) * B**(i + n - 1), so all n-grams are
+# hashed in a handful of vectorized passes instead of slicing each one out.
+def hash_ngrams(data, n, prefix=None):
+    if len(data) < n:
+        return np.empty(0, dtype=np.uint64)
+
+    prefix, powers = prefix if prefix is not None else rolling_hash_prefix(data)
+    return (prefix[n:] - prefix[:-n]) * powers[n - 1:]
+
+# Count the byte-level n-grams of `data`, returning sorted unique hashes and
+# their counts. With `verify`, every occurrence of a hash is compared against
+# the bytes of its first occurrence to rule out hash collisions.
+def count_ngrams(data, n, verify=False, prefix=None):
+    hashes = hash_ngrams(data, n, prefix)
+    if not verify:
+        return np.unique(hashes, return_counts=True)
+
+    unique_hashes, first, inverse, counts = np.unique(
+        hashes, return_index=True, return_inverse=True, return_counts=True
+    )
+    data = np.frombuffer(data, dtype=np.uint8)
+    windows = np.lib.stride_tricks.sliding_window_view(data, n)
+    if not np.array_equal(windows, windows[first[inverse]]):
+        raise ValueError(f"hash collision between distinct {n}-grams")
+    return unique_hashes, counts
+
+# An n-gram profile: the hashes of its n-grams in ascending order, and the
+# number of times each of them occurs. Truncated (top-L) profiles are cached
+# on the profile itself, so each one is computed once per author per fold.
+class Profile:
+    def __init__(self, hashes, counts):
+        self.hashes = hashes
+        self.counts = counts
+        self._total = None
+        self._ranking = None
+        self._truncated = {}
+
+    # Summed lazily, so loading a memory-mapped table does not read every
+    # profile's counts (only the profiles that are scored are summed).
+    @property
+    def total(self):
+        if self._total is None:
+            self._total = int(self.counts.sum())
+        return self._total
+
+    # Build a profile from a piece of source code.
+    @classmethod
+    def from_code(cls, code, n, verify=False):
+        return cls(*count_ngrams(code, n, verify))
+
+    # Keep only the L most frequent n-grams (ties broken by hash). The ranking
+    # is sorted once, so every L is a prefix of it.
+    def truncate(self, L):
+        if len(self.hashes) <= L:
+            return self
+        if L not in self._truncated:
+            if self._ranking is None:
+                self._ranking = np.argsort(-self.counts, kind='stable')
+            top = np.sort(self._ranking[:L])  # Restore the ascending hash order
+            self._truncated[L] = Profile(self.hashes[top], self.counts[top])
+        return self._truncated[L]
+
+    # Merge-style intersection of the two sorted hash arrays, returning the
+    # counts of the shared n-grams in this profile and in `other`.
+    def intersect(self, other):
+        if len(self.hashes) == 0 or len(other.hashes) == 0:
+            return self.counts[:0], other.counts[:0]
+
+        positions = np.searchsorted(other.hashes, self.hashes)
+        positions[positions == len(other.hashes)] = 0  # Past the end never matches
+        shared = other.hashes[positions] == self.hashes
+        return self.counts[shared], other.counts[positions[shared]]
+
+    def __len__(self):
+        return len(self.hashes)
+
+# Named profiles packed into flat arrays, where row i spans the positions
+# offsets[i]:offsets[i + 1] of `hashes` and `counts`. Tables are saved as a
+# single index file: a header, the aligned arrays, and a JSON manifest holding
+# the names (the author directory), the arrays' locations, and any metadata.
+# A saved table is memory-mapped when loaded, so it opens in milliseconds and
+# several processes share its pages instead of each receiving a copy.
+class ProfileTable:
+    def __init__(self, names, offsets, hashes, counts, metadata=None):
+        self.names = names
+        self.offsets = offsets
+        self.hashes = hashes
+        self.counts = counts
+        self.metadata = metadata if metadata is not None else {}
+
+    @classmethod
+    def pack(cls, names, profiles, metadata=None):
+        offsets = np.cumsum([0] + [len(profile) for profile in profiles])
+        hashes = np.concatenate([p.hashes for p in profiles] or [np.empty(0, np.uint64)])
+        counts = np.concatenate([p.counts for p in profiles] or [np.empty(0, np.int64)])
+        return cls(list(names), offsets.astype(np.int64), hashes, counts, metadata)
+
+    # The index is written to a temporary file beside `path`, then moved into
+    # place, so an interrupted save never leaves a truncated index behind.
+    def save(self, path):
+        arrays = {}
+        directory = os.path.dirname(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as f:
+            try:
+                f.write(bytes(INDEX_HEADER_SIZE))  # Patched once the manifest is written
+                for name in ('offsets', 'hashes', 'counts'):
+                    array = np.ascontiguousarray(getattr(self, name))
+                    f.write(bytes(-f.tell() % INDEX_ALIGNMENT))
+                    arrays[name] = {
+                        'offset': f.tell(),
+                        'dtype': array.dtype.str,
+                        'length': len(array),
+                    }
+                    array.tofile(f)
+
+                manifest_offset = f.tell()
+                manifest = {'names': self.names, 'arrays': arrays, 'metadata': self.metadata}
+                f.write(json.dumps(manifest).encode())
+                f.seek(0)
+                f.write(struct.pack(INDEX_HEADER_FORMAT, INDEX_MAGIC, manifest_offset))
+            except BaseException:
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(path, 'rb') as f:
+            header = f.read(INDEX_HEADER_SIZE)
+            if len(header) < INDEX_HEADER_SIZE:
+                raise ValueError(f"corrupted profile index {path}: truncated header")
+
+            magic, manifest_offset = struct.unpack(INDEX_HEADER_FORMAT, header)
+            if magic != INDEX_MAGIC:
+                raise ValueError(f"corrupted profile index {path}: expected {INDEX_MAGIC}")
+            f.seek(manifest_offset)
+            manifest = json.load(f)
+
+        arrays = []
+        for name in ('offsets', 'hashes', 'counts'):
+            spec = manifest['arrays'][name]
+            dtype, length = np.dtype(spec['dtype']), spec['length']
+            if length == 0:  # Empty regions cannot be memory-mapped
+                arrays.append(np.empty(0, dtype))
+            elif mmap:
+                arrays.append(np.memmap(path, dtype, 'r', spec['offset'], (length,)))
+            else:
+                arrays.append(np.fromfile(path, dtype, length, offset=spec['offset']))
+        return cls(manifest['names'], *arrays, manifest['metadata'])
+
+    # Get the i-th profile, as views of the (memory-mapped) arrays.
+    def __getitem__(self, i):
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return Profile(self.hashes[start:stop], self.counts[start:stop])
+
+    def __len__(self):
+        return len(self.names)
+
+    # Map each name to its profile.
+    def to_dict(self):
+        return {name: self[i] for i, name in enumerate(self.names)}
+
+# Merge counted n-grams, given as (hashes, counts) pairs with sorted unique
+# hashes, into a single pair, summing the counts of shared hashes.
+def merge_counts(*counted):
+    hashes = np.concatenate([h for h, _ in counted] or [np.empty(0, np.uint64)])
+    counts = np.concatenate([c for _, c in counted] or [np.empty(0, np.int64)])
+    unique_hashes, inverse = np.unique(hashes, return_inverse=True)
+    counts = np.bincount(inverse, weights=counts, minlength=len(unique_hashes))
+    return unique_hashes, counts.astype(np.int64)
+
+# Prune counted n-grams to at most `capacity` heavy hitters with a Misra-Gries
+# (SpaceSaving-family) merge step: the (capacity + 1)-th largest count is
+# subtracted from every count, and the n-grams left without a positive count
+# are dropped. Applied after every merge, each surviving count underestimates
+# the exact one by at most total / (capacity + 1), where total is the number
+# of n-grams counted so far, and every n-gram above that bound survives.
+def prune_counts(counted, capacity):
+    hashes, counts = counted
+    if capacity is None or len(counts) <= capacity:
+        return counted
+
+    threshold = np.partition(counts, len(counts) - capacity - 1)[len(counts) - capacity - 1]
+    counts = counts - threshold
+    kept = counts > 0
+    return hashes[kept], counts[kept]
+
+# Keep the `capacity` most frequent of the counted n-grams, in hash order.
+def top_counts(counted, capacity):
+    hashes, counts = counted
+    if capacity is None or len(counts) <= capacity:
+        return counted
+
+    top = np.sort(np.argpartition(counts, len(counts) - capacity)[len(counts) - capacity:])
+    return hashes[top], counts[top]
+
+# Per-file n-gram counts, computed once and reused by every fold. Counts are
+# kept in memory and, if given a directory, also persisted there as .npz files
+# keyed by the file's path, size, modification time and n, so later runs can
+# skip counting as well.
+class NgramCache:
+    def __init__(self, n, directory=None, in_memory=True, verify=False):
+        self.n = n
+        self.directory = directory
+        self.in_memory = in_memory
+        self.verify = verify
+        self._counts = {}
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    # Get the counted n-grams (sorted hashes and counts) of a source file.
+    def counts(self, file_path):
+        if file_path in self._counts:
+            return self._counts[file_path]
+
+        cache_path = self._cache_path(file_path)
+        counted = self._load(cache_path) if cache_path is not None else None
+        if counted is None:
+            counted = count_ngrams(read_source(file_path), self.n, self.verify)
+            if cache_path is not None:
+                self._store(cache_path, counted)
+
+        if self.in_memory:
+            self._counts[file_path] = counted
+        return counted
+
+    # An entry that is missing or unreadable (e.g., left truncated by an
+    # interrupted run) is a cache miss, so the file is simply counted again.
+    @staticmethod
+    def _load(cache_path):
+        try:
+            with np.load(cache_path) as cached:
+                return cached['hashes'], cached['counts']
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            return None
+
+    # Entries are written to a temporary file and renamed into place, so a
+    # reader never sees a partially written one.
+    @staticmethod
+    def _store(cache_path, counted):
+        directory = os.path.dirname(cache_path)
+        with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as f:
+            try:
+                np.savez(f, hashes=counted[0], counts=counted[1])
+            except BaseException:
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, cache_path)
+
+    # Store externally counted n-grams of a source file.
+    def add(self, file_path, counted):
+        self._counts[file_path] = counted
+
+    # Count the files that are not yet cached across a process pool.
+    def prefetch(self, file_paths, executor, chunksize=16):
+        if not self.in_memory:
+            return  # Workers still persist their counts to the directory
+        missing = [file_path for file_path in file_paths if file_path not in self._counts]
+        counter = NgramCache(self.n, self.directory, in_memory=False, verify=self.verify)
+        for file_path, counted in zip(
+            missing, executor.map(counter._try_counts, missing, chunksize=chunksize)
+        ):
+            if counted is not None:  # Unreadable files are reported when used
+                self.add(file_path, counted)
+
+    def _try_counts(self, file_path):
+        try:
+            return self.counts(file_path)
+        except Exception:
+            return None
+
+    def _cache_path(self, file_path):
+        if self.directory is None:
+            return None
+        key = f"{source_key(file_path)}:{self.n}"
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.npz')
 
 # Get the n-gram profiles for each author from their training files.
-def get_author_profiles(author_files, n):
+#
+# Each file is counted on its own and merged into the author's profile, so
+# memory follows the profile's size rather than the author's total code. The
+# per-file counts are buffered until they outgrow the profile, which keeps the
+# merges amortized linear. With `cross_file`, the n-grams spanning consecutive
+# files are also counted, as if the files had been concatenated. Given an
+# NgramCache, each profile is the sum of its files' cached counts instead.
+#
+# Given an `index_path`, the profiles are saved there as a profile index, and
+# later calls memory-map that index instead of rebuilding the profiles, as
+# long as its n, hash scheme and corpus fingerprint still match.
+#
+# Given a `capacity` (at least the largest L to be used), each profile is kept
+# to 2 * capacity heavy hitters while it is built (see `prune_counts`), then to
+# its top `capacity`, so memory per author is O(capacity) regardless of how
+# much code they have written. Counts are underestimated by at most
+# total / (2 * capacity + 1), where total is the author's number of n-grams.
+def get_author_profiles(
+    author_files,
+    n,
+    verify=False,
+    cross_file=False,
+    cache=None,
+    index_path=None,
+    capacity=None,
+):
+    if index_path is not None:
+        metadata = {
+            'n': n,
+            'hash_scheme': HASH_SCHEME,
+            'cross_file': cross_file,
+            'capacity': capacity,
+            'fingerprint': corpus_fingerprint(author_files),
+        }
+        if os.path.exists(index_path):
+            try:
+                table = ProfileTable.load(index_path)
+            except (ValueError, OSError) as e:
+                # An unreadable index is as stale as an outdated one
+                print(f"Rebuilding profile index {index_path}: {e}")
+            else:
+                if table.metadata == metadata:
+                    return table.to_dict()
+
+        author_profiles = get_author_profiles(
+            author_files, n, verify, cross_file, cache, capacity=capacity
+        )
+        ProfileTable.pack(author_profiles, author_profiles.values(), metadata).save(index_path)
+        return author_profiles
+
+    if cache is not None and cache.n != n:
+        raise ValueError(f"cache holds {cache.n}-grams, but {n}-grams were requested")
+    if cache is not None and cross_file:
+        raise ValueError("cross-file n-grams cannot be built from cached counts")
+
+    # Heavy hitters are tracked with twice the capacity, so the final profiles
+    # can still be filled to capacity after Misra-Gries pruning
+    slack = 2 * capacity if capacity is not None else None
+
     author_profiles = {}
     for author, files in author_files.items():
-        author_code = ''
+        profile = merge_counts()  # Empty profile
+        pending, pending_size = [], 0
+        tail = b''  # Trailing n - 1 bytes of the files read so far
+
         for file_path in files:
             try:
-                with open(file_path, 'r') as f:
-                    author_code += f.read()
+                if cache is not None:
+                    pending.append(cache.counts(file_path))
+                else:
+                    data = read_source(file_path)
             except Exception as e:
                 print(f"Error processing file {file_path}: {e}")
+                continue
+
+            if cache is None and cross_file:
+                # Every n-gram of the joined tail and head spans both files
+                pending.append(count_ngrams(tail + data[:n - 1], n, verify))
+                tail = (tail + data)[max(len(tail) + len(data) - n + 1, 0):]
 
-        ngrams = get_ngrams(author_code, n)
-        ngram_freqs = Counter(ngrams)
-        author_profiles[author] = ngram_freqs
+            if cache is None:
+                pending.append(count_ngrams(data, n, verify))
+            pending_size += len(pending[-1][0])
+            if pending_size >= len(profile[0]):
+                profile = prune_counts(merge_counts(profile, *pending), slack)
+                pending, pending_size = [], 0
+
+        profile = prune_counts(merge_counts(profile, *pending), slack)
+        author_profiles[author] = Profile(*top_counts(profile, capacity))
     return author_profiles
 
+# Fingerprint the training corpus by each author's files and their sizes and
+# modification times, so a stale profile index is detected and rebuilt.
+def corpus_fingerprint(author_files):
+    digest = hashlib.sha1()
+    for author in sorted(author_files):
+        digest.update(json.dumps(author).encode())
+        for file_path in author_files[author]:
+            try:
+                digest.update(f"{file_path}:{source_key(file_path)}".encode())
+            except OSError:
+                digest.update(f"{file_path}:missing".encode())
+    return digest.hexdigest()
+
+# Relative distance between two (truncated) profiles: one minus the shared
+# n-gram mass, sum(min), over the combined mass, sum(max). Since the union's
+# maxima are both totals less the shared minima, one intersection suffices.
+def relative_distance(profile, other):
+    shared = int(np.minimum(*profile.intersect(other)).sum())
+    union = profile.total + other.total - shared
+    return 1 - shared / union if union else 1.0
+
 # Attribute the authorship of unknown_code using SCAP with relative distance.
 def scapRD(author_profiles, unknown_code, n, L):
-    unknown_ngrams = get_ngrams(unknown_code, n)
-    unknown_profile = Counter(unknown_ngrams)
-    unknown_profile = Counter(dict(unknown_profile.most_common(L)))
+    unknown_profile = Profile.from_code(unknown_code.encode(), n).truncate(L)
 
     relative_distances = {}
     for author, profile in author_profiles.items():
-        profile = Counter(dict(profile.most_common(L)))
-        common_ngrams = set(profile.keys()) & set(unknown_profile.keys())
-        all_ngrams = set(profile.keys()) | set(unknown_profile.keys())
-        relative_distance = 1 - sum(min(profile[ngram], unknown_profile[ngram]) for ngram in common_ngrams) / sum(
-            max(profile[ngram], unknown_profile.get(ngram, 0)) for ngram in all_ngrams
-        )
-        relative_distances[author] = relative_distance
+        relative_distances[author] = relative_distance(profile.truncate(L), unknown_profile)
 
     attributed_author = min(relative_distances, key=relative_distances.get)
     return attributed_author
 
-# Attribute the authorship of unknown_code using SCAP with SPI.
+# Expand each [start, start + length) range into its individual positions.
+def expand_ranges(start, lengths):
+    offsets = np.cumsum(lengths) - lengths
+    return np.arange(lengths.sum()) - np.repeat(offsets - start, lengths)
+
+# Attribute the authorship of unknown_code using SCAP with SPI: the author
+# whose truncated profile has the most n-gram mass within the code's profile.
 def scapSPI(author_profiles, unknown_code, n, L):
-    unknown_ngrams = get_ngrams(unknown_code, n)
-    unknown_profile = Counter(unknown_ngrams)
-    unknown_profile = Counter(dict(unknown_profile.most_common(L)))
+    unknown_profile = Profile.from_code(unknown_code.encode(), n).truncate(L)
 
     intersections = {}
     for author, profile in author_profiles.items():
-        profile = Counter(dict(profile.most_common(L)))
-        common_ngrams = set(profile.keys()) & set(unknown_profile.keys())
-        intersections[author] = sum(profile[ngram] for ngram in common_ngrams)
+        intersections[author] = int(profile.truncate(L).intersect(unknown_profile)[0].sum())
 
     attributed_author = max(intersections, key=intersections.get)
     return attributed_author
 
 
-# Calculate accuracy
-def calculate_accuracy(author_profiles, test_files, n, L, method):
-    total_predictions = 0
-    correct_predictions = 0
+# Stack profiles into a sparse matrix, one row per profile, whose columns are
+# the positions of the n-gram hashes within the (sorted) `vocabulary`.
+def to_matrix(profiles, vocabulary):
+    import scipy.sparse as sp  # Deferred, as only batch attribution needs it
 
-    for true_author, files in test_files.items():
-        for file_path in files:
-            with open(file_path, 'r') as f:
-                unknown_code = f.read()
+    indptr = np.cumsum([0] + [len(profile) for profile in profiles])
+    hashes = np.concatenate([p.hashes for p in profiles] or [np.empty(0, np.uint64)])
+    counts = np.concatenate([p.counts for p in profiles] or [np.empty(0, np.int64)])
+    columns = np.searchsorted(vocabulary, hashes)
+    return sp.csr_matrix((counts, columns, indptr), shape=(len(profiles), len(vocabulary)))
+
+# Attribute the authorship of every code in unknown_codes at once, scoring all
+# (document, author) pairs with sparse matrix operations instead of per-pair
+# dictionary lookups. Yields the same authors as calling `method` per code.
+def attribute_batch(author_profiles, unknown_codes, n, L, method=scapRD):
+    unknown_profiles = [Profile.from_code(c.encode(), n) for c in unknown_codes]
+    return attribute_profiles(author_profiles, unknown_profiles, L, method)
+
+# Author profiles truncated to L and stacked into a sparse matrix, one row per
+# author, over the vocabulary of their n-grams. Building it is the bulk of the
+# cost of batch attribution, so it can be built once and reused for every
+# batch of documents scored against the same authors and L.
+class AuthorMatrix:
+    def __init__(self, author_profiles, L):
+        if not author_profiles:
+            raise ValueError("no author profiles to attribute against")
+
+        self.L = L
+        self.authors = list(author_profiles)
+        profiles = [author_profiles[author].truncate(L) for author in self.authors]
+        self.vocabulary = np.unique(np.concatenate([p.hashes for p in profiles]))
+        self.matrix = to_matrix(profiles, self.vocabulary)
+        self.postings = self.matrix.T.tocsr()  # Author postings of each column
+        self.totals = self.matrix.sum(axis=1).A1
 
-            attributed_author = method(author_profiles, unknown_code, n, L)
-            total_predictions += 1
-            if attributed_author == true_author:
-                correct_predictions += 1
+    # Stack (truncated) query profiles into a sparse matrix over the authors'
+    # vocabulary. Query n-grams no author has never score, so they are dropped.
+    def query_matrix(self, queries):
+        import scipy.sparse as sp  # Deferred, as only batch attribution needs it
 
+        hashes = np.concatenate([p.hashes for p in queries] or [np.empty(0, np.uint64)])
+        counts = np.concatenate([p.counts for p in queries] or [np.empty(0, np.int64)])
+        rows = np.repeat(np.arange(len(queries)), [len(p) for p in queries])
+
+        columns = np.searchsorted(self.vocabulary, hashes)
+        known = columns < len(self.vocabulary)
+        known[known] = self.vocabulary[columns[known]] == hashes[known]
+        return sp.csr_matrix(
+            (counts[known], (rows[known], columns[known])),
+            shape=(len(queries), len(self.vocabulary)),
+        )
+
+    # Score every (document, author) pair: the relative distance for scapRD
+    # (lower is closer), or the SPI for scapSPI (higher is closer).
+    def scores(self, unknown_profiles, method=scapRD):
+        import scipy.sparse as sp  # Deferred, as only batch attribution needs it
+
+        if method not in (scapRD, scapSPI):
+            raise ValueError(f"batch attribution is not supported for {method}")
+
+        queries = [profile.truncate(self.L) for profile in unknown_profiles]
+        query_matrix = self.query_matrix(queries)
+
+        if method is scapSPI:
+            # SPI sums the author's counts over the shared n-grams, which is the
+            # product of the query's (binary) n-gram set and the author matrix
+            query_matrix.data[:] = 1
+            return (query_matrix @ self.matrix.T).toarray()
+
+        # Join every query entry with the author postings of its column, then
+        # sum min(query, author) per pair
+        entries = query_matrix.tocoo()
+        start = self.postings.indptr[entries.col]
+        lengths = self.postings.indptr[entries.col + 1] - start
+        positions = expand_ranges(start, lengths)
+
+        shared = sp.coo_matrix(
+            (
+                np.minimum(np.repeat(entries.data, lengths), self.postings.data[positions]),
+                (np.repeat(entries.row, lengths), self.postings.indices[positions]),
+            ),
+            shape=(len(queries), len(self.authors)),
+        ).toarray()  # Duplicate (document, author) entries are summed
+
+        # The union's sum(max) follows from both totals less the shared minima
+        query_totals = np.array([query.total for query in queries], dtype=np.int64)
+        union = np.add.outer(query_totals, self.totals) - shared
+        similarity = np.zeros(shared.shape)  # Empty unions keep a distance of 1
+        np.divide(shared, union, out=similarity, where=union > 0)
+        return 1 - similarity
+
+    # Score the profiles SCORE_CHUNK_SIZE at a time (see `scores`), yielding
+    # each chunk's scores matrix in turn.
+    def iter_scores(self, unknown_profiles, method=scapRD):
+        for start in range(0, len(unknown_profiles), SCORE_CHUNK_SIZE):
+            yield self.scores(unknown_profiles[start:start + SCORE_CHUNK_SIZE], method)
+
+    # Rank the `top` closest authors of each profile, as an (author indices,
+    # scores) pair of arrays with one row per profile. Only a chunk's scores
+    # are held at a time. Stable, so ties rank in author order.
+    def rank(self, unknown_profiles, method=scapRD, top=1):
+        indices, scores = [], []
+        for chunk in self.iter_scores(unknown_profiles, method):
+            order = np.argsort(-chunk if method is scapSPI else chunk, axis=1, kind='stable')
+            order = order[:, :top]
+            indices.append(order)
+            scores.append(np.take_along_axis(chunk, order, axis=1))
+
+        top = min(top, len(self.authors))
+        if not indices:
+            return np.empty((0, top), np.int64), np.empty((0, top))
+        return np.concatenate(indices), np.concatenate(scores)
+
+    # Attribute each profile to its closest author, a chunk at a time.
+    def attribute(self, unknown_profiles, method=scapRD):
+        attributed_authors = []
+        for scores in self.iter_scores(unknown_profiles, method):
+            best = np.argmax(scores, axis=1) if method is scapSPI else np.argmin(scores, axis=1)
+            attributed_authors.extend(self.authors[a] for a in best)
+        return attributed_authors
+
+# Batch attribution of already profiled documents (see `attribute_batch`).
+# Passing an AuthorMatrix built for the same L avoids rebuilding it.
+def attribute_profiles(author_profiles, unknown_profiles, L, method=scapRD):
+    if method not in (scapRD, scapSPI):
+        raise ValueError(f"batch attribution is not supported for {method}")
+
+    matrix = author_profiles
+    if not isinstance(matrix, AuthorMatrix) or matrix.L != L:
+        matrix = AuthorMatrix(author_profiles, L)
+    return matrix.attribute(unknown_profiles, method)
+
+# Calculate accuracy. Given an NgramCache, the SCAP methods profile the test
+# files from their cached counts rather than rereading them.
+def calculate_accuracy(author_profiles, test_files, n, L, method, cache=None):
+    true_authors = [a for a, files in test_files.items() for _ in files]
+    test_paths = [file_path for files in test_files.values() for file_path in files]
+
+    if method in (scapRD, scapSPI):
+        matrix = author_profiles
+        if not isinstance(matrix, AuthorMatrix) or matrix.L != L:
+            matrix = AuthorMatrix(author_profiles, L)
+
+        # Profile and attribute a chunk of documents at a time, so neither the
+        # profiles nor their scores are held for the whole test set
+        attributed_authors = []
+        for start in range(0, len(test_paths), SCORE_CHUNK_SIZE):
+            chunk = test_paths[start:start + SCORE_CHUNK_SIZE]
+            if cache is not None:
+                unknown_profiles = [Profile(*cache.counts(p)) for p in chunk]
+            else:
+                unknown_profiles = [Profile.from_code(read_source(p), n) for p in chunk]
+            attributed_authors.extend(matrix.attribute(unknown_profiles, method))
+    else:
+        # Per-document methods take the code as text
+        unknown_codes = [bytes(read_source(p)).decode() for p in test_paths]
+        attributed_authors = [method(author_profiles, c, n, L) for c in unknown_codes]
+
+    total_predictions = len(true_authors)
+    correct_predictions = sum(a == t for a, t in zip(attributed_authors, true_authors))
     return correct_predictions / total_predictions if total_predictions > 0 else 0
 
 # Function to split the files into training and testing sets
@@ -106,50 +696,297 @@ def split_files_across_authors(file_paths, train_proportion=0.80):
     return train_files, test_files
 
 
-# Main execution
-if __name__ == "__main__":
-    # Set source code directory and get a list of all file paths in the directory
-    source_code_dir = ''
-    file_paths = [os.path.join(source_code_dir, f) for f in os.listdir(source_code_dir)]
-    
-    # Split the files across training and testing
-    train_files, test_files = split_files_across_authors(file_paths, train_proportion=0.80)
-    
-    # Define fixed n and L values for cross-validation
-    n = 30  # n-gram size
-    L = 6000  # top n-grams
-    
-    # Perform k-fold cross-validation on the files (not authors)
-    k_folds = 5
-    kf = KFold(n_splits=k_folds, shuffle=True, random_state=42)
-    
-    total_accuracy = 0
+# Group file paths ("<author>$<attempt>.<ext>") by their author.
+def group_by_author(file_paths):
+    author_files = defaultdict(list)
+    for file_path in file_paths:
+        author, attempt_id_with_ext = os.path.basename(file_path).split('$')
+        author_files[author].append(file_path)
+    return author_files
 
-    # Perform k-fold cross-validation
+# Split the files into k folds, yielding the training and testing files of
+# each fold grouped by author.
+def k_fold_splits(file_paths, k_folds=5, random_state=42):
+    # scikit-learn is only needed for cross-validation, so defer its import
+    from sklearn.model_selection import KFold
+
+    kf = KFold(n_splits=k_folds, shuffle=True, random_state=random_state)
     for train_indices, test_indices in kf.split(file_paths):
-        # Split files into training and testing sets
-        train_set = [file_paths[i] for i in train_indices]
-        test_set = [file_paths[i] for i in test_indices]
-        
-        # Group the files by author for the training and testing sets
-        train_files = defaultdict(list)
-        test_files = defaultdict(list)
-        
-        for file_path in train_set:
-            author, attempt_id_with_ext = os.path.basename(file_path).split('$')
-            train_files[author].append(file_path)
-            
-        for file_path in test_set:
-            author, attempt_id_with_ext = os.path.basename(file_path).split('$')
-            test_files[author].append(file_path)
+        train_files = group_by_author([file_paths[i] for i in train_indices])
+        test_files = group_by_author([file_paths[i] for i in test_indices])
+        yield train_files, test_files
+
+# Perform k-fold cross-validation on the files (not authors), returning the
+# average accuracy across all folds. Every file's n-grams are counted once (in
+# `cache`), and each fold's author profiles are summed from those counts. With
+# several `jobs`, the work is spread across a process pool (see below).
+def cross_validate(
+    file_paths,
+    n,
+    L,
+    method=scapRD,
+    k_folds=5,
+    random_state=42,
+    cache=None,
+    jobs=1,
+    capacity=None,
+):
+    if cache is None:
+        cache = NgramCache(n)
+    if jobs > 1:
+        return _cross_validate_parallel(
+            file_paths, n, L, method, k_folds, random_state, cache, jobs, capacity
+        )
 
+    total_accuracy = 0
+    for train_files, test_files in k_fold_splits(file_paths, k_folds, random_state):
         # Generate author profiles from the training set
-        author_profiles = get_author_profiles(train_files, n)
-        
+        author_profiles = get_author_profiles(
+            train_files, n, cache=cache, capacity=capacity
+        )
+
         # Calculate accuracy using the testing set
-        accuracy = calculate_accuracy(author_profiles, test_files, n, L, scapRD)
-        total_accuracy += accuracy
-    
-    # Compute and print the average accuracy across all folds
-    avg_accuracy = total_accuracy / k_folds
-    print(f"Average accuracy across {k_folds}-fold cross-validation: {avg_accuracy:.4f}")
+        total_accuracy += calculate_accuracy(
+            author_profiles, test_files, n, L, method, cache=cache
+        )
+    return total_accuracy / k_folds
+
+# Cross-validation across a process pool. The files are counted by the pool,
+# then every fold's truncated author and test profiles are packed into tables
+# in a temporary directory. Workers memory-map those tables and attribute
+# chunks of test documents from all folds at once. Since each document is
+# scored independently, the accuracy is identical to the serial run.
+def _cross_validate_parallel(
+    file_paths, n, L, method, k_folds, random_state, cache, jobs, capacity
+):
+    if method not in (scapRD, scapSPI):
+        raise ValueError(f"parallel attribution is not supported for {method}")
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor, \
+            tempfile.TemporaryDirectory(prefix='scap-') as directory:
+        cache.prefetch(file_paths, executor)
+
+        folds = []  # Futures and true authors of each fold's test documents
+        splits = k_fold_splits(file_paths, k_folds, random_state)
+        for fold, (train_files, test_files) in enumerate(splits):
+            author_profiles = get_author_profiles(
+                train_files, n, cache=cache, capacity=capacity
+            )
+            true_authors = [a for a, files in test_files.items() for _ in files]
+            test_paths = [file_path for files in test_files.values() for file_path in files]
+
+            fold_directory = os.path.join(directory, str(fold))
+            os.makedirs(fold_directory)
+            ProfileTable.pack(
+                author_profiles, [p.truncate(L) for p in author_profiles.values()]
+            ).save(os.path.join(fold_directory, 'authors.idx'))
+            ProfileTable.pack(
+                test_paths, [Profile(*cache.counts(p)).truncate(L) for p in test_paths]
+            ).save(os.path.join(fold_directory, 'documents.idx'))
+
+            chunks = np.array_split(np.arange(len(test_paths)), jobs)
+            futures = [
+                executor.submit(
+                    _attribute_chunk, fold_directory, chunk[0], chunk[-1] + 1, L, method
+                )
+                for chunk in chunks
+                if len(chunk)
+            ]
+            folds.append((futures, true_authors))
+
+        total_accuracy = 0
+        for futures, true_authors in folds:
+            attributed_authors = [a for future in futures for a in future.result()]
+            correct_predictions = sum(a == t for a, t in zip(attributed_authors, true_authors))
+            total_accuracy += correct_predictions / len(true_authors) if true_authors else 0
+    return total_accuracy / k_folds
+
+# Cross-validate every combination of n-gram size and profile length, and
+# return an {(n, L): (accuracy, seconds)} grid, where seconds is the time spent
+# attributing the test sets. Work is shared across the grid: each file's
+# rolling hash prefix is computed once for all n, and each fold's profiles are
+# built (and ranked) once per n, so every L is a prefix of the same ranking.
+def sweep(file_paths, ns, Ls, method=scapRD, k_folds=5, random_state=42, capacity=None):
+    ns, Ls = sorted(set(ns)), sorted(set(Ls))
+
+    caches = {n: NgramCache(n) for n in ns}
+    for file_path in file_paths:
+        try:
+            data = read_source(file_path)
+        except Exception as e:
+            print(f"Error processing file {file_path}: {e}")
+            continue
+
+        prefix = rolling_hash_prefix(data)
+        for n in ns:
+            caches[n].add(file_path, count_ngrams(data, n, prefix=prefix))
+
+    grid = {(n, L): (0, 0) for n in ns for L in Ls}
+    for train_files, test_files in k_fold_splits(file_paths, k_folds, random_state):
+        true_authors = [a for a, files in test_files.items() for _ in files]
+        test_paths = [file_path for files in test_files.values() for file_path in files]
+
+        for n in ns:
+            author_profiles = get_author_profiles(
+                train_files, n, cache=caches[n], capacity=capacity
+            )
+            unknown_profiles = [Profile(*caches[n].counts(p)) for p in test_paths]
+
+            for L in Ls:
+                start = time.perf_counter()
+                attributed_authors = attribute_profiles(
+                    author_profiles, unknown_profiles, L, method
+                )
+                elapsed = time.perf_counter() - start
+
+                correct_predictions = sum(
+                    a == t for a, t in zip(attributed_authors, true_authors)
+                )
+                accuracy = correct_predictions / len(true_authors) if true_authors else 0
+                total_accuracy, total_elapsed = grid[n, L]
+                grid[n, L] = (total_accuracy + accuracy, total_elapsed + elapsed)
+
+    return {key: (accuracy / k_folds, elapsed) for key, (accuracy, elapsed) in grid.items()}
+
+# Memory-map a fold's saved author profiles, once per worker process. Chunks
+# are queued fold by fold, so only the current fold's are kept.
+@lru_cache(maxsize=1)
+def _load_author_profiles(fold_directory):
+    return ProfileTable.load(os.path.join(fold_directory, 'authors.idx')).to_dict()
+
+# Build a fold's author matrix for L, once per worker process rather than once
+# per chunk of test documents. As above, only the current fold's is kept, so a
+# worker holds one matrix however many folds it handles.
+@lru_cache(maxsize=1)
+def _author_matrix(fold_directory, L):
+    return AuthorMatrix(_load_author_profiles(fold_directory), L)
+
+# Attribute the test documents [start, stop) of a fold saved to disk.
+def _attribute_chunk(fold_directory, start, stop, L, method):
+    author_profiles = _author_matrix(fold_directory, L)
+    documents = ProfileTable.load(os.path.join(fold_directory, 'documents.idx'))
+    unknown_profiles = [documents[i] for i in range(start, stop)]
+    return attribute_profiles(author_profiles, unknown_profiles, L, method)
+
+
+def _parse_arguments(args=None):
+    parser = ArgumentParser(description="Source code authorship attribution with SCAP.")
+    parser.add_argument(
+        "source_code_dir",
+        metavar="DIR",
+        help="directory of source files, or a packed corpus archive",
+    )
+    parser.add_argument(
+        "--language",
+        default=None,
+        action="append",
+        dest="languages",
+        metavar="<lang>",
+        help="only use submissions in this language (may be repeated)",
+    )
+    parser.add_argument(
+        "-n",
+        default=[30],
+        type=int,
+        nargs="+",
+        dest="n",
+        help="n-gram size (several values sweep over them)",
+    )
+    parser.add_argument(
+        "-L",
+        default=[6000],
+        type=int,
+        nargs="+",
+        dest="L",
+        help="profile length (several values sweep over them)",
+    )
+    parser.add_argument(
+        "--method",
+        default="rd",
+        choices=("rd", "spi"),
+        help="relative distance (rd) or simplified profile intersection (spi)",
+    )
+    parser.add_argument("--folds", default=5, type=int, dest="k_folds", metavar="<k>")
+    parser.add_argument(
+        "--random-state", default=42, type=int, dest="random_state", metavar="<seed>"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        dest="cache_dir",
+        metavar="<dir>",
+        help="persist per-file n-gram counts to this directory",
+    )
+    parser.add_argument(
+        "--capacity",
+        default=None,
+        type=int,
+        metavar="<m>",
+        help="keep at most m heavy-hitter n-grams per author profile (m >= L)",
+    )
+    parser.add_argument(
+        "--jobs",
+        default=1,
+        type=int,
+        metavar="<n>",
+        help="spread folds and test documents across n worker processes",
+    )
+    args = parser.parse_args(args)  # If none are supplied, fall back to CLI
+
+    if (len(args.n) > 1 or len(args.L) > 1) and args.jobs > 1:
+        parser.error("--jobs is not supported when sweeping over n or L")
+    if args.capacity is not None and args.capacity < max(args.L):
+        parser.error("--capacity must be at least L")
+    return args
+
+
+def print_grid(grid):
+    ns = sorted({n for n, _ in grid})
+    Ls = sorted({L for _, L in grid})
+
+    for title, column, fmt in (("accuracy", 0, ".4f"), ("seconds", 1, ".3f")):
+        print(f"{title:<8}" + "".join(f"{f'L={L}':>16}" for L in Ls))
+        for n in ns:
+            print(f"{f'n={n}':<8}" + "".join(f"{grid[n, L][column]:>16{fmt}}" for L in Ls))
+
+
+def main():
+    args = _parse_arguments()
+
+    # Get a list of all submissions in the source code directory (or archive)
+    file_paths = load_corpus(args.source_code_dir, languages=args.languages)
+
+    method = scapRD if args.method == "rd" else scapSPI
+    if len(args.n) > 1 or len(args.L) > 1:
+        print_grid(
+            sweep(
+                file_paths,
+                args.n,
+                args.L,
+                method,
+                args.k_folds,
+                args.random_state,
+                capacity=args.capacity,
+            )
+        )
+        return
+
+    cache = NgramCache(args.n[0], args.cache_dir)
+    avg_accuracy = cross_validate(
+        file_paths,
+        args.n[0],
+        args.L[0],
+        method,
+        args.k_folds,
+        args.random_state,
+        cache=cache,
+        jobs=args.jobs,
+        capacity=args.capacity,
+    )
+
+    # Print the average accuracy across all folds
+    print(f"Average accuracy across {args.k_folds}-fold cross-validation: {avg_accuracy:.4f}")
+
+
+if __name__ == "__main__":
+    main()
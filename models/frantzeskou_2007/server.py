@@ -0,0 +1,346 @@
+import json
+import queue
+import signal
+import threading
+import time
+from argparse import ArgumentParser
+from collections import defaultdict, deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from ngramValidated import (
+    AuthorMatrix,
+    Profile,
+    ProfileTable,
+    get_author_profiles,
+    group_by_author,
+    load_corpus,
+    scapRD,
+    scapSPI,
+)
+
+METHODS = {'rd': scapRD, 'spi': scapSPI}
+
+# Author profiles resident in memory: loaded once, from a profile index or by
+# profiling a corpus (directory or archive), and reloaded on demand. The
+# AuthorMatrix of each L in `lengths` is built along with the profiles; any
+# other L's is built on first use and kept until the next reload.
+class ProfileStore:
+    def __init__(self, index_path=None, corpus=None, n=None, lengths=()):
+        if index_path is None and corpus is None:
+            raise ValueError("either a profile index or a corpus is required")
+
+        self.index_path = index_path
+        self.corpus = corpus
+        self.n = n
+        self.lengths = tuple(lengths)
+        self._lock = threading.Lock()
+        self.reload()
+
+    # Load the profiles anew, then swap them in, so requests in flight finish
+    # against the profiles they started with.
+    def reload(self):
+        if self.corpus is not None:
+            author_files = group_by_author(load_corpus(self.corpus))
+            author_profiles = get_author_profiles(
+                author_files, self.n, index_path=self.index_path
+            )
+            n = self.n
+        else:
+            table = ProfileTable.load(self.index_path)
+            author_profiles, n = table.to_dict(), table.metadata['n']
+        if not author_profiles:
+            raise ValueError("no author profiles to attribute against")
+        matrices = {L: AuthorMatrix(author_profiles, L) for L in self.lengths}
+
+        with self._lock:
+            self.author_profiles, self.n, self._matrices = author_profiles, n, matrices
+            self.loaded_at = time.time()
+
+    # Get the profiles' n and the author matrix for L, consistently. A missing
+    # matrix is built outside the lock, so other requests (and stats) aren't
+    # held up by it; if a concurrent request built it first, theirs is kept.
+    def matrix(self, L):
+        with self._lock:
+            n, author_profiles, matrices = self.n, self.author_profiles, self._matrices
+            if L in matrices:
+                return n, matrices[L]
+
+        matrix = AuthorMatrix(author_profiles, L)
+        with self._lock:
+            return n, matrices.setdefault(L, matrix)
+
+# Micro-batching of concurrent requests: a single worker takes the oldest
+# pending request, waits up to `max_delay` seconds for more (up to
+# `max_batch`), and ranks every request sharing an author matrix and method
+# in one sparse product (per chunk of documents, see `AuthorMatrix.rank`).
+# Under load this amortizes the per-batch overhead; a lone request only waits
+# `max_delay`.
+class MicroBatcher:
+    def __init__(self, max_batch=64, max_delay=0.002):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batch_sizes = deque(maxlen=10000)
+        self._pending = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    # Rank the `top` authors of (untruncated) profiles against `matrix`,
+    # returning a Future of the (author indices, scores) arrays, one row per
+    # profile.
+    def submit(self, matrix, method, profiles, top):
+        future = Future()
+        self._pending.put((matrix, method, profiles, top, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._pending.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            self.batch_sizes.append(len(batch))
+
+            groups = defaultdict(list)
+            for matrix, method, profiles, top, future in batch:
+                groups[id(matrix), method].append((matrix, method, profiles, top, future))
+
+            for requests in groups.values():
+                matrix, method = requests[0][:2]
+                try:
+                    indices, scores = matrix.rank(
+                        [p for _, _, ps, _, _ in requests for p in ps],
+                        method,
+                        max(top for _, _, _, top, _ in requests),
+                    )
+                except Exception as e:
+                    for *_, future in requests:
+                        future.set_exception(e)
+                    continue
+
+                offset = 0
+                for _, _, profiles, top, future in requests:
+                    rows = slice(offset, offset + len(profiles))
+                    future.set_result((indices[rows, :top], scores[rows, :top]))
+                    offset += len(profiles)
+
+# The attribution service: profiles each code, scores it through the
+# micro-batcher, and ranks the authors by their scores. Requests may only ask
+# for the default L or one of `lengths`, as every L's matrix is kept resident.
+# Request latencies are kept (the most recent `window`) for percentile
+# reporting.
+class AttributionService:
+    def __init__(self, store, L=6000, method='rd', top=5, batcher=None, window=10000,
+                 lengths=()):
+        self.store = store
+        self.L = L
+        self.lengths = {L, *lengths}
+        self.method = method
+        self.top = top
+        self.batcher = batcher if batcher is not None else MicroBatcher()
+        self.latencies = deque(maxlen=window)
+        self.requests = self.documents = self.errors = 0
+        self._lock = threading.Lock()
+
+    # Rank the top authors of each code, as [{"author": ..., "score": ...}]
+    # lists ordered from the most to the least likely author.
+    def attribute(self, codes, L=None, method=None, top=None):
+        L = self.L if L is None else L
+        method = METHODS[method or self.method]
+        top = self.top if top is None else top
+        if L not in self.lengths:
+            raise ValueError(f"L must be one of {sorted(self.lengths)}")
+        if not isinstance(codes, list) or not all(isinstance(c, str) for c in codes):
+            raise ValueError("codes must be a list of strings")
+        if not isinstance(top, int) or top < 0:
+            raise ValueError("top must be a non-negative integer")
+
+        n, matrix = self.store.matrix(L)
+        profiles = [Profile.from_code(code.encode(), n) for code in codes]
+        indices, scores = self.batcher.submit(matrix, method, profiles, top).result()
+
+        return [
+            [
+                {'author': matrix.authors[a], 'score': float(score)}
+                for a, score in zip(row_indices, row_scores)
+            ]
+            for row_indices, row_scores in zip(indices, scores)
+        ]
+
+    def record(self, seconds, documents, failed=False):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.requests += 1
+            self.documents += documents
+            self.errors += failed
+
+    def stats(self):
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000
+            stats = {
+                'requests': self.requests,
+                'documents': self.documents,
+                'errors': self.errors,
+                'authors': len(self.store.author_profiles),
+                'n': self.store.n,
+                'loaded_at': self.store.loaded_at,
+            }
+
+        batch_sizes = list(self.batcher.batch_sizes)
+        stats['mean_batch_size'] = float(np.mean(batch_sizes)) if batch_sizes else 0.0
+        for percentile in (50, 90, 99):
+            value = np.percentile(latencies, percentile) if len(latencies) else 0.0
+            stats[f'p{percentile}_ms'] = float(value)
+        return stats
+
+# JSON over HTTP, served on localhost:
+#   POST /attribute  {"code": "..."} or {"codes": [...]}, optionally with
+#                    "L" (one of the served lengths), "method" ("rd" or
+#                    "spi") and "top"
+#   POST /reload     reload the profiles (as does SIGHUP)
+#   GET  /stats      request counts, mean batch size and latency percentiles
+class AttributionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so clients reuse connections
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._reply(200, self.server.service.stats())
+        elif self.path == '/health':
+            self._reply(200, {'status': 'ok'})
+        else:
+            self._reply(404, {'error': f"unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        service = self.server.service
+
+        if self.path == '/reload':
+            try:
+                service.store.reload()
+            except Exception as e:
+                self._reply(500, {'error': str(e)})
+            else:
+                self._reply(200, {'authors': len(service.store.author_profiles)})
+            return
+        if self.path != '/attribute':
+            self._reply(404, {'error': f"unknown endpoint {self.path}"})
+            return
+
+        start = time.perf_counter()
+        try:
+            request = json.loads(body)
+            codes = request['codes'] if 'codes' in request else [request['code']]
+            rankings = service.attribute(
+                codes, request.get('L'), request.get('method'), request.get('top')
+            )
+        except (ValueError, KeyError, TypeError) as e:
+            service.record(time.perf_counter() - start, 0, failed=True)
+            self._reply(400, {'error': f"bad request: {e}"})
+            return
+
+        service.record(time.perf_counter() - start, len(codes))
+        if 'codes' in request:
+            self._reply(200, {'results': [{'authors': r} for r in rankings]})
+        else:
+            self._reply(200, {'authors': rankings[0]})
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Latencies are reported by /stats instead of per-request logs
+
+
+class AttributionServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # Bursts of concurrent clients must not be reset
+
+    def __init__(self, address, service):
+        super().__init__(address, AttributionHandler)
+        self.service = service
+
+
+def serve(service, host='127.0.0.1', port=8765):
+    server = AttributionServer((host, port), service)
+
+    # Reload the profiles on SIGHUP, off the signal handler's thread
+    signal.signal(
+        signal.SIGHUP,
+        lambda *_: threading.Thread(target=service.store.reload, daemon=True).start(),
+    )
+    return server
+
+
+def _parse_arguments(args=None):
+    parser = ArgumentParser(description="Resident SCAP attribution server.")
+    parser.add_argument(
+        "--index",
+        default=None,
+        metavar="<file>",
+        help="profile index to serve (rebuilt from --corpus when stale)",
+    )
+    parser.add_argument(
+        "--corpus",
+        default=None,
+        metavar="<dir>",
+        help="training directory of source files, or a packed corpus archive",
+    )
+    parser.add_argument("-n", default=30, type=int, dest="n", help="n-gram size")
+    parser.add_argument("-L", default=6000, type=int, dest="L", help="profile length")
+    parser.add_argument(
+        "--lengths",
+        default=[],
+        type=int,
+        nargs="+",
+        metavar="<L>",
+        help="other profile lengths requests may ask for",
+    )
+    parser.add_argument("--method", default="rd", choices=("rd", "spi"))
+    parser.add_argument("--top", default=5, type=int, metavar="<k>")
+    parser.add_argument("--port", default=8765, type=int)
+    parser.add_argument("--max-batch", default=64, type=int, dest="max_batch")
+    parser.add_argument(
+        "--max-delay",
+        default=2.0,
+        type=float,
+        dest="max_delay",
+        metavar="<ms>",
+        help="how long a request waits for others to batch with",
+    )
+    args = parser.parse_args(args)  # If none are supplied, fall back to CLI
+
+    if args.index is None and args.corpus is None:
+        parser.error("either --index or --corpus is required")
+    return args
+
+
+def main():
+    args = _parse_arguments()
+    store = ProfileStore(args.index, args.corpus, args.n, [args.L, *args.lengths])
+    batcher = MicroBatcher(args.max_batch, args.max_delay / 1000)
+    service = AttributionService(
+        store, args.L, args.method, args.top, batcher, lengths=args.lengths
+    )
+
+    server = serve(service, port=args.port)
+    print(f"Serving {len(store.author_profiles)} author profiles on port {args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,24 @@
-from bs4 import BeautifulSoup
-
-import http.client  # Low level HTTP client
 import json  # Manages REST API responses
 import re  # Regular expression
+import threading
+import time
+
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+from cache import ResponseCache, codeforces_ttl, leetcode_ttl
+from client import HTTPClient, Response, StreamingResponse
+from jsonstream import iter_array, select
+from metrics import Metrics
+from ratelimit import (
+    RETRYABLE_ERRORS,
+    Throttled,
+    TransientError,
+    backoff_delay,
+    call_with_retries,
+    shared_limiter,
+)
 
-from typing import Iterable
+T = TypeVar("T")
 
 
 # TODO Standardize API responses (in some fashion)
@@ -14,46 +28,240 @@ USER_AGENT = (
 )
 
 
+def _retry_after(response: Response) -> Optional[float]:
+    try:
+        return float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None  # Absent, or an HTTP date, which the backoff covers anyway
+
+
 class CodeforcesAPI:
     BASE_URL = "codeforces.com"
     BASE_HEADERS = {"User-Agent": USER_AGENT}
-
-    def __init__(self) -> None:
-        self.client = http.client.HTTPSConnection(host=CodeforcesAPI.BASE_URL)
-
-        # Obtain the `JSESSIONID` to authorize further requests
-        self.BASE_HEADERS.update(self._get_session_headers())
-
-    def _get_session_headers(self):
-        self.client.request("GET", "/", headers={"X-CSRF-Token": "fetch"})
-        response = self.client.getresponse()
-
-        soup = BeautifulSoup(response, "html.parser")
+    API_RATE = 0.5  # The API allows one call per two seconds
+    SOURCE_RATE = 2.0  # Submission sources are served by the website instead
+
+    def __init__(
+        self,
+        host: str = BASE_URL,
+        port: Optional[int] = None,
+        secure: bool = True,
+        pool_size: int = 8,
+        api_rate: float = API_RATE,
+        source_rate: float = SOURCE_RATE,
+        cache: Optional[ResponseCache] = None,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        # Requests share a pool of persistent connections (see `map`)
+        self.client = HTTPClient(host, port, secure, pool_size)
+
+        # Every client of the same host draws from the same token buckets
+        self.api_limiter = shared_limiter((host, port, "api"), api_rate)
+        self.source_limiter = shared_limiter((host, port, "source"), source_rate)
+
+        # Responses are looked up here first, if given (see `cache.ResponseCache`)
+        self.cache = cache
+        # Per-endpoint request metrics, which may be shared between clients
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        # The session is only established once a request reaches the network
+        self._headers: Optional[dict[str, str]] = None
+        self._headers_lock = threading.Lock()
+
+    @property
+    def headers(self) -> dict[str, str]:
+        with self._headers_lock:
+            if self._headers is None:
+                # Obtain the `JSESSIONID` to authorize further requests
+                session_headers = self._get_session_headers()
+                self._headers = {**CodeforcesAPI.BASE_HEADERS, **session_headers}
+            return self._headers
+
+    def _get_session_headers(self) -> dict[str, str]:
+        # Only the session handshake parses HTML, so defer importing its parser
+        from bs4 import BeautifulSoup  # pylint: disable=import-outside-toplevel
+
+        headers = {**CodeforcesAPI.BASE_HEADERS, "X-CSRF-Token": "fetch"}
+        response = self.client.request("GET", "/", headers=headers)
+
+        soup = BeautifulSoup(response.body, "html.parser")
         token = soup.find("meta", attrs={"name": "X-Csrf-Token"})
 
         if not token:  # The X-Csrf-Token is required to scrape the submissions
             raise ValueError("Unable to find X-Csrf-Token")
 
-        for cookie in response.getheader("Set-Cookie").split(";"):
+        for cookie in response.headers.get("Set-Cookie", "").split(";"):
             if re.match("^JSESSIONID=([0-9A-F]+)$", cookie):
-                return ("X-Csrf-Token", token["content"]), ("Cookie", cookie)
+                return {"X-Csrf-Token": token["content"], "Cookie": cookie}
 
         raise ValueError("Unable to find JSESSIONID in response headers")
 
     def _query_endpoint(
         self, method: str, endpoint: str, body: str = None, headers: dict[str, str] = {}
     ) -> dict:
-        headers = {**CodeforcesAPI.BASE_HEADERS, **headers}
-        self.client.request(method, endpoint, body, headers=headers)
-        response = self.client.getresponse()
+        """Queries an endpoint within the rate limits, retrying transient errors.
+
+        Throttling ("Call limit exceeded", 429), 5xx statuses and transport
+        errors are retried with jittered exponential backoff (see
+        `ratelimit.call_with_retries`).
 
+        Responses are served from (and stored in) the cache, if there is one.
+        Requests that reach the network are recorded in `metrics`.
+
+        Raises:
+            ValueError: If the request is rejected for any other reason.
+            cache.CacheMiss: If the cache is offline and lacks the response.
+        """
+        limiter = self.api_limiter
+        if endpoint.startswith("/data/"):
+            limiter = self.source_limiter
+
+        def request() -> dict:
+            merged = {**self.headers, **headers}
+            return call_with_retries(
+                lambda: self._request(method, endpoint, body, merged),
+                limiter,
+                on_retry=lambda _: self.metrics.retried(endpoint),
+            )
+
+        if self.cache is None:
+            return request()
+        return self.cache.fetch(method, endpoint, body, request, codeforces_ttl)
+
+    def _stream_endpoint(
+        self,
+        method: str,
+        endpoint: str,
+        path: tuple[str, ...],
+        body: str = None,
+        headers: dict[str, str] = {},
+    ) -> Iterator[dict]:
+        """Yields the elements of an array within an endpoint's response.
+
+        The response is decompressed and parsed incrementally (see
+        `jsonstream.iter_array`), so only one element is held in memory at a
+        time. Like `_query_endpoint`, the request is rate limited and retried
+        until the response starts, and cached once it has been read in full.
+
+        Transport errors while the body is read are retried too, with the same
+        backoff: the endpoint is requested again, and the elements already
+        yielded are skipped.
+        """
+        if self.cache is not None:
+            cached = self.cache.get(method, endpoint, body)
+            if cached is not None:
+                yield from select(cached, path)
+                return
+
+        merged = {**self.headers, **headers}
+
+        def open_stream():
+            with self.metrics.attempt(endpoint) as attempt:
+                response = self._open(method, endpoint, body, merged)
+                attempt.responded()
+            return response, attempt
+
+        yielded, restarts = 0, 0  # Elements yielded, and requests restarted
+        while True:
+            response, attempt = call_with_retries(
+                open_stream,
+                self.api_limiter,
+                on_retry=lambda _: self.metrics.retried(endpoint),
+            )
+            with response:
+                stream = response
+                if self.cache is not None:
+                    stream = self.cache.record(method, endpoint, body, response)
+
+                fields = {}  # The response's other fields, such as its "status"
+                elements, parsing, skip = iter_array(stream, path, fields), 0.0, yielded
+                try:
+                    while True:
+                        # Only time the parser (and its reads), not the consumer
+                        start = time.perf_counter()
+                        try:
+                            element = next(elements)
+                        except StopIteration:
+                            break
+                        finally:
+                            parsing += time.perf_counter() - start
+                        if skip:
+                            skip -= 1  # Already yielded before a restart
+                            continue
+                        yielded += 1
+                        yield element
+                except RETRYABLE_ERRORS:
+                    if restarts == 6:  # As many as `call_with_retries` allows
+                        raise
+                    self.metrics.retried(endpoint)
+                    time.sleep(backoff_delay(restarts, 1.0, 60.0))
+                    restarts += 1
+                    continue
+                finally:
+                    attempt.parsed(parsing)
+                    attempt.responded(response.transferred)
+
+                if fields.get("status") != "OK":
+                    raise ValueError(f"Invalid API response: {fields.get('comment')}")
+                if self.cache is not None:
+                    stream.commit(codeforces_ttl(endpoint, fields))
+                return
+
+    def _open(
+        self, method: str, endpoint: str, body: Optional[str], headers: dict[str, str]
+    ) -> StreamingResponse:
+        response = self.client.open(method, endpoint, body, headers)
         if response.status != 200:
-            raise ValueError(f"Invalid HTTP status recived: {response.status}")
+            with response:
+                error = Response(response.status, response.headers, response.read())
+            self._parse(endpoint, error)  # Raises the error matching the status
+        return response
+
+    def _request(
+        self, method: str, endpoint: str, body: Optional[str], headers: dict[str, str]
+    ) -> dict:
+        with self.metrics.attempt(endpoint) as attempt:
+            response = self.client.request(method, endpoint, body, headers)
+            attempt.responded(response.transferred)
+            with attempt.parsing():
+                return self._parse(endpoint, response)
+
+    def _parse(self, endpoint: str, response: Response) -> dict:
+        if response.status == 429:
+            raise Throttled(f"Throttled by {endpoint}", _retry_after(response))
+
+        try:
+            api_response = json.loads(response.body)
+        except ValueError:
+            api_response = {}  # Error pages are not necessarily JSON
+
+        comment = str(api_response.get("comment", ""))
+        if "limit exceeded" in comment.lower():
+            raise Throttled(comment, _retry_after(response))
+        if response.status >= 500:
+            raise TransientError(f"HTTP status {response.status} from {endpoint}")
 
-        api_response = json.load(response)
-        assert api_response["status"] == "OK"
+        if response.status != 200:
+            raise ValueError(f"Invalid HTTP status recived: {response.status}")
+        # Only the API wraps its results in a "status"; the website (e.g., the
+        # /data/ endpoints) answers with plain JSON objects
+        is_api = endpoint.startswith("/api/")
+        if not api_response or (is_api and api_response.get("status") != "OK"):
+            raise ValueError(f"Invalid API response: {comment or response.body[:80]}")
         return api_response
 
+    def map(self, fn: Callable[..., T], *iterables: Iterable) -> Iterator[T]:
+        """Concurrently calls `fn` (e.g., `get_submission`) over the iterables.
+
+        Example:
+            >>> sources = list(api.map(api.get_submission, contests, submissions))
+
+        Returns:
+            An iterator of the results, in order, like `map`. At most
+            `pool_size` requests are in flight at once.
+        """
+        return self.client.map(fn, *iterables)
+
     def get_contest_standings(
         self, contest_id: int, offset: int = 1, count: int = 25, show_unoffical=False
     ) -> dict:
@@ -88,6 +296,18 @@ class CodeforcesAPI:
         endpoint = "/api/contest.standings?" + parameters
         return self._query_endpoint("GET", endpoint)
 
+    def iter_contest_standings(
+        self, contest_id: int, offset: int = 1, count: int = 25, show_unoffical=False
+    ) -> Iterator[dict]:
+        """Yields the requested standings rows one at a time.
+
+        Like `get_contest_standings`, except that the response is streamed and
+        parsed incrementally, so memory does not grow with `count`.
+        """
+        parameters = f"contestId={contest_id}&from={offset}&count={count}&showUnofficial={show_unoffical}"
+        endpoint = "/api/contest.standings?" + parameters
+        return self._stream_endpoint("GET", endpoint, ("result", "rows"))
+
     def get_contest_status(
         self, contest_id: int, handle: str = None, offset: int = 1, count: int = 25
     ) -> dict:
@@ -118,6 +338,21 @@ class CodeforcesAPI:
         endpoint = "/api/contest.status?" + parameters
         return self._query_endpoint("GET", endpoint)
 
+    def iter_contest_status(
+        self, contest_id: int, handle: str = None, offset: int = 1, count: int = 25
+    ) -> Iterator[dict]:
+        """Yields the requested submission objects one at a time.
+
+        Like `get_contest_status`, except that the response is streamed and
+        parsed incrementally, so memory does not grow with `count`.
+        """
+        parameters = f"contestId={contest_id}&from={offset}&count={count}"
+        if handle is not None:  # Ensure the parameter has a value
+            parameters += f"&handle={handle}"
+
+        endpoint = "/api/contest.status?" + parameters
+        return self._stream_endpoint("GET", endpoint, ("result",))
+
     def get_user_info(self, handles: str | Iterable[str]) -> dict:
         if isinstance(handles, str):
             handles = (handles,)  # Prepare handles for the endpoint curation
@@ -137,17 +372,65 @@ class CodeforcesAPI:
 class LeetCodeAPI:
     BASE_URL = "leetcode.com"
     BASE_HEADERS = {"User-Agent": USER_AGENT}
-
-    def __init__(self) -> None:
-        self.client = http.client.HTTPSConnection(host=LeetCodeAPI.BASE_URL)
+    RATE = 2.0  # Undocumented, so kept conservative (and adapted if throttled)
+
+    def __init__(
+        self,
+        host: str = BASE_URL,
+        port: Optional[int] = None,
+        secure: bool = True,
+        pool_size: int = 8,
+        rate: float = RATE,
+        cache: Optional[ResponseCache] = None,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        # Requests share a pool of persistent connections (see `map`)
+        self.client = HTTPClient(host, port, secure, pool_size)
+        self.limiter = shared_limiter((host, port), rate)
+
+        # Responses are looked up here first, if given (see `cache.ResponseCache`)
+        self.cache = cache
+        # Per-endpoint request metrics, which may be shared between clients
+        self.metrics = metrics if metrics is not None else Metrics()
 
     def _query_endpoint(self, endpoint: str, headers: dict[str, str] = {}) -> dict:
+        """Queries an endpoint within the rate limit, retrying transient errors.
+
+        See `CodeforcesAPI._query_endpoint`.
+        """
         headers = {**LeetCodeAPI.BASE_HEADERS, **headers}
-        self.client.request("GET", endpoint, headers=headers)
-        response = self.client.getresponse()
 
-        assert response.status == 200
-        return json.load(response)
+        def request() -> dict:
+            return call_with_retries(
+                lambda: self._request(endpoint, headers),
+                self.limiter,
+                on_retry=lambda _: self.metrics.retried(endpoint),
+            )
+
+        if self.cache is None:
+            return request()
+        return self.cache.fetch("GET", endpoint, None, request, leetcode_ttl)
+
+    def _request(self, endpoint: str, headers: dict[str, str]) -> dict:
+        with self.metrics.attempt(endpoint) as attempt:
+            response = self.client.request("GET", endpoint, headers=headers)
+            attempt.responded(response.transferred)
+            if response.status == 429:
+                raise Throttled(f"Throttled by {endpoint}", _retry_after(response))
+            if response.status >= 500:
+                raise TransientError(f"HTTP status {response.status} from {endpoint}")
+
+            if response.status != 200:
+                raise ValueError(f"Invalid HTTP status recived: {response.status}")
+            with attempt.parsing():
+                return json.loads(response.body)
+
+    def map(self, fn: Callable[..., T], *iterables: Iterable) -> Iterator[T]:
+        """Concurrently calls `fn` (e.g., `get_submission`) over the iterables.
+
+        See `CodeforcesAPI.map`.
+        """
+        return self.client.map(fn, *iterables)
 
     def get_contest_info(self, contest_slug: str) -> dict:
         """Returns general information about specified contest.
@@ -0,0 +1,189 @@
+import hashlib
+import json  # Manages REST API responses
+import sqlite3
+import threading
+import time
+import zlib
+
+from os import PathLike
+from typing import BinaryIO, Callable, Optional
+
+# A TTL policy maps an endpoint and its response to how long, in seconds, the
+# response stays fresh: None keeps it forever, and 0 does not cache it at all.
+TTLPolicy = Callable[[str, dict], Optional[float]]
+
+MINUTE, HOUR, DAY = 60, 60 * 60, 24 * 60 * 60
+
+
+class CacheMiss(LookupError):
+    """An offline cache was asked for a response it has not stored."""
+
+
+def codeforces_ttl(endpoint: str, response: dict) -> Optional[float]:
+    """The TTL policy of the Codeforces API (see `TTLPolicy`)."""
+    if endpoint.startswith("/data/submitSource"):
+        # A source never changes once judged, but its verdict may while waiting
+        waiting = str(response.get("waiting", "false")).lower() == "true"
+        return None if response.get("verdict") and not waiting else MINUTE
+    if endpoint.startswith("/api/contest.status"):
+        # Pages are addressed by offset from the newest submission, so every
+        # new submission (even after the contest) shifts what they hold
+        return MINUTE
+    if endpoint.startswith("/api/contest.standings"):
+        contest = response.get("result", {}).get("contest", {})
+        return None if contest.get("phase") == "FINISHED" else MINUTE
+    if endpoint.startswith("/api/user.info"):
+        return DAY  # Ratings and profiles change over time
+    return HOUR
+
+
+def leetcode_ttl(endpoint: str, response: dict) -> Optional[float]:
+    """The TTL policy of the LeetCode API (see `TTLPolicy`)."""
+    if endpoint.startswith("/api/submissions/"):
+        return None
+    if endpoint.startswith("/contest/api/ranking/"):
+        return None if response.get("is_past") else MINUTE
+    return HOUR
+
+
+class ResponseCache:
+    """A persistent cache of API responses, stored in an SQLite database.
+
+    Responses are keyed by the request's method, endpoint and body, and are
+    stored as zlib-compressed JSON along with their expiry time. In offline
+    mode, every response is replayed from the cache regardless of its expiry,
+    and requests that were never cached raise `CacheMiss` instead of reaching
+    the network.
+
+    Args:
+        path: Path to the SQLite database, which is created if necessary.
+        offline: Whether to replay cached responses only.
+    """
+
+    def __init__(self, path: str | PathLike, offline: bool = False) -> None:
+        self.offline = offline
+        self.hits = self.misses = 0
+
+        self._lock = threading.Lock()  # The connection is shared by threads
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS response (key TEXT PRIMARY KEY, "
+            "endpoint TEXT NOT NULL, stored REAL NOT NULL, expires REAL, body BLOB NOT NULL)"
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def _key(method: str, endpoint: str, body: Optional[str]) -> str:
+        request = f"{method} {endpoint}\n{body or ''}"
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def get(self, method: str, endpoint: str, body: Optional[str] = None) -> Optional[dict]:
+        """Returns the fresh cached response to a request, if there is one.
+
+        Raises:
+            CacheMiss: If the cache is offline and the request was never cached.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT expires, body FROM response WHERE key=?",
+                (self._key(method, endpoint, body),),
+            ).fetchone()
+
+            if row is not None and (self.offline or row[0] is None or row[0] > time.time()):
+                self.hits += 1
+                return json.loads(zlib.decompress(row[1]))
+
+            self.misses += 1
+            if self.offline:
+                raise CacheMiss(f"{method} {endpoint} is not cached")
+            return None
+
+    def put(
+        self,
+        method: str,
+        endpoint: str,
+        body: Optional[str],
+        response: dict,
+        ttl: Optional[float] = None,
+    ) -> None:
+        """Caches the response to a request for `ttl` seconds (or forever)."""
+        compressed = zlib.compress(json.dumps(response).encode())
+        self._store(method, endpoint, body, compressed, ttl)
+
+    def _store(
+        self,
+        method: str,
+        endpoint: str,
+        body: Optional[str],
+        compressed: bytes,
+        ttl: Optional[float],
+    ) -> None:
+        if ttl == 0:
+            return
+
+        now = time.time()
+        expires = None if ttl is None else now + ttl
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO response VALUES (?, ?, ?, ?, ?)",
+                (self._key(method, endpoint, body), endpoint, now, expires, compressed),
+            )
+            self._connection.commit()
+
+    def record(
+        self, method: str, endpoint: str, body: Optional[str], stream: BinaryIO
+    ) -> "CacheRecorder":
+        """Wraps a response stream, to cache its body once it has been read."""
+        return CacheRecorder(self, method, endpoint, body, stream)
+
+    def fetch(
+        self,
+        method: str,
+        endpoint: str,
+        body: Optional[str],
+        request: Callable[[], dict],
+        policy: TTLPolicy,
+    ) -> dict:
+        """Returns the cached response to a request, or requests and caches it."""
+        response = self.get(method, endpoint, body)
+        if response is None:
+            response = request()
+            self.put(method, endpoint, body, response, policy(endpoint, response))
+        return response
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class CacheRecorder:
+    """A response stream that compresses its body as it is read.
+
+    Only the compressed body is held in memory. Once the stream has been read
+    to its end, `commit` stores it in the cache like `ResponseCache.put`.
+    """
+
+    def __init__(
+        self,
+        cache: ResponseCache,
+        method: str,
+        endpoint: str,
+        body: Optional[str],
+        stream: BinaryIO,
+    ) -> None:
+        self._cache = cache
+        self._request = method, endpoint, body
+        self._stream = stream
+        self._compressor = zlib.compressobj()
+        self._chunks: list[bytes] = []
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read(size)
+        self._chunks.append(self._compressor.compress(data))
+        return data
+
+    def commit(self, ttl: Optional[float]) -> None:
+        """Caches the body read so far for `ttl` seconds (or forever)."""
+        compressed = b"".join(self._chunks) + self._compressor.flush()
+        self._cache._store(*self._request, compressed, ttl)
@@ -0,0 +1,273 @@
+import http.client  # Low level HTTP client
+import queue
+import threading
+import zlib
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Transport errors after which a connection cannot be reused. The request may
+# not have reached the server, so it is retried once on a fresh connection.
+CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    http.client.ResponseNotReady,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+
+ACCEPT_ENCODING = "gzip, deflate"
+
+
+class Response(NamedTuple):
+    status: int
+    headers: http.client.HTTPMessage
+    body: bytes
+    transferred: int = 0  # Bytes received, before decompression
+
+
+class StreamingResponse:
+    """A response whose body is read (and decompressed) incrementally.
+
+    Closing the response returns its connection to the pool, unless the body
+    was left unread, in which case the connection cannot be reused.
+    """
+
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, client, connection, response: http.client.HTTPResponse):
+        self.status = response.status
+        self.headers = response.headers
+
+        self._client = client
+        self._connection = connection
+        self._response = response
+        self._closed = False
+        self.transferred = 0  # Bytes received so far, before decompression
+        self._pending = b""  # Decompressed bytes not read yet (from `_offset`)
+        self._offset = 0
+
+        encoding = response.headers.get("Content-Encoding", "").lower()
+        self._decompressor = None
+        if encoding in ("gzip", "x-gzip", "deflate"):
+            # Detects both gzip and zlib headers (deflate is zlib-wrapped)
+            self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)
+        self._raw_deflate = encoding == "deflate"
+
+    def _decompress(self, data: bytes) -> bytes:
+        try:
+            decompressed = self._decompressor.decompress(data)
+        except zlib.error:
+            if not self._raw_deflate:
+                raise
+            # Some servers send raw deflate streams, without the zlib header
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            decompressed = self._decompressor.decompress(data)
+        self._raw_deflate = False  # The header was recognized, if any
+        return decompressed
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to `size` decompressed bytes (or all of them, if negative).
+
+        Returns:
+            The bytes read, which are only empty at the end of the body.
+        """
+        if self._decompressor is None:
+            return self._read_raw(size)
+        if size < 0:
+            data = self._pending[self._offset :] + self._decompress(self._read_raw())
+            self._pending, self._offset = b"", 0
+            return data + self._decompressor.flush()
+
+        # A chunk may decompress to more than `size` bytes, so keep the rest
+        while self._offset >= len(self._pending):
+            chunk = self._read_raw(max(size, self.CHUNK_SIZE))
+            data = self._decompress(chunk) if chunk else self._decompressor.flush()
+            self._pending, self._offset = data, 0
+            if not chunk:
+                break
+        data = self._pending[self._offset : self._offset + size]
+        self._offset += len(data)
+        return data
+
+    def _read_raw(self, size: int = -1) -> bytes:
+        data = self._response.read(None if size < 0 else size)
+        self.transferred += len(data)
+        if not data and size != 0 and self._response.length:
+            # Sized reads end quietly where the connection did, short of the
+            # Content-Length, while unsized ones raise this themselves
+            raise http.client.IncompleteRead(b"", self._response.length)
+        return data
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+
+        # Only a fully read response leaves the connection ready for reuse
+        reusable = self._response.isclosed() and not self._response.will_close
+        if not reusable:
+            self._response.close()
+        self._client._release(self._connection, reusable)
+
+    def __enter__(self) -> "StreamingResponse":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+class HTTPClient:
+    """A thread-safe HTTP client over a pool of persistent connections.
+
+    Connections are created lazily, up to `pool_size`, and are kept alive
+    between requests. A connection that the server has dropped (e.g., an idle
+    keep-alive connection) is discarded and the request is retried once on a
+    fresh one, so a single dropped connection does not abort a long run.
+
+    Args:
+        host: The server's host name.
+        port: The server's port, which defaults to that of the scheme.
+        secure: Whether to connect with HTTPS (or plain HTTP, e.g., to a local
+        stand-in server).
+        pool_size: The maximum number of concurrent connections.
+        timeout: The socket timeout of each connection, in seconds.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: Optional[int] = None,
+        secure: bool = True,
+        pool_size: int = 8,
+        timeout: float = 30.0,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.secure = secure
+        self.pool_size = pool_size
+        self.timeout = timeout
+
+        self._idle: queue.LifoQueue[http.client.HTTPConnection] = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.secure:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def open(
+        self,
+        method: str,
+        endpoint: str,
+        body: Optional[str | bytes] = None,
+        headers: Optional[dict[str, str]] = None,
+    ) -> "StreamingResponse":
+        """Send a request over a pooled connection, without reading the body.
+
+        The response body is decompressed as it is read (gzip and deflate are
+        negotiated unless `headers` set Accept-Encoding). The response must be
+        closed (it is a context manager), which returns its connection to the
+        pool if the body was read to the end.
+
+        Raises:
+            OSError, http.client.HTTPException: If the request fails on a
+            fresh connection as well.
+        """
+        headers = {"Accept-Encoding": ACCEPT_ENCODING, **(headers or {})}
+
+        self._slots.acquire()  # Wait for a free connection slot
+        try:
+            try:
+                connection, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                connection, reused = self._connect(), False
+
+            try:
+                try:
+                    response = self._send(connection, method, endpoint, body, headers)
+                except CONNECTION_ERRORS:
+                    if not reused:
+                        raise
+                    connection.close()  # Stale keep-alive connection, so reconnect
+                    connection = self._connect()
+                    response = self._send(connection, method, endpoint, body, headers)
+            except BaseException:
+                connection.close()
+                raise
+        except BaseException:
+            self._slots.release()
+            raise
+        return StreamingResponse(self, connection, response)
+
+    def request(
+        self,
+        method: str,
+        endpoint: str,
+        body: Optional[str | bytes] = None,
+        headers: Optional[dict[str, str]] = None,
+    ) -> Response:
+        """Send a request over a pooled connection and read the whole response.
+
+        See `open`, which this reads the (decompressed) body of.
+        """
+        with self.open(method, endpoint, body, headers) as response:
+            body = response.read()
+            return Response(response.status, response.headers, body, response.transferred)
+
+    @staticmethod
+    def _send(connection, method, endpoint, body, headers) -> http.client.HTTPResponse:
+        connection.request(method, endpoint, body, headers=headers)
+        return connection.getresponse()
+
+    def _release(self, connection: http.client.HTTPConnection, reusable: bool) -> None:
+        if reusable:
+            self._idle.put(connection)
+        else:
+            connection.close()
+        self._slots.release()
+
+    def map(self, fn: Callable[..., T], *iterables: Iterable) -> Iterator[T]:
+        """Call `fn` concurrently, like `map`, with one thread per connection.
+
+        The results are yielded in order. Each call is expected to issue its
+        requests through this client, so at most `pool_size` are in flight.
+        The iterables are consumed lazily: at most twice `pool_size` calls are
+        submitted ahead of the results yielded.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.pool_size)
+        return self._map(self._executor, fn, zip(*iterables), 2 * self.pool_size)
+
+    @staticmethod
+    def _map(executor: ThreadPoolExecutor, fn, arguments, limit: int) -> Iterator:
+        pending: deque[Future] = deque()
+        try:
+            for args in arguments:
+                if len(pending) >= limit:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(fn, *args))
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # Like `Executor.map`, calls not started yet are dropped if the
+            # results are abandoned (or a call failed)
+            for future in pending:
+                future.cancel()
+
+    def close(self) -> None:
+        """Close every idle connection and stop the worker threads."""
+        if self._executor is not None:
+            self._executor.shutdown()
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# Copright (C) 2024 Dylan Middendorf
+# SPDX-License-Identifier: BSD-2-Clause
+
+"""Packed, memory-mapped corpus archives of source code submissions.
+
+An archive stores every submission's source in one concatenated blob, next to
+an index of offsets and the author, submission id and language of each
+submission. Readers memory-map the archive, so a source is a zero-copy
+`memoryview` slice of the blob, and filtering by author or language is a
+vectorized operation on the index instead of a walk over the file system.
+
+The layout mirrors the flatgraph databases: a header holding the magic bytes
+and the offset of a JSON manifest, followed by the blob, the (aligned) index
+arrays, and the manifest itself.
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+
+from argparse import ArgumentParser
+from functools import lru_cache
+from os import PathLike
+from typing import BinaryIO, Iterable, Optional, Sequence, Union
+
+import numpy as np
+
+MAGIC_BYTES = b"HZCORPUS"
+HEADER_FORMAT = f"<{len(MAGIC_BYTES)}sQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+ALIGNMENT = 64
+"""The alignment of the index arrays within the archive, in bytes."""
+
+# Index arrays and their types, in the order they are written
+INDEX_ARRAYS = {
+    "offsets": np.int64,
+    "authors": np.int32,
+    "submissions": np.int64,
+    "languages": np.int16,
+}
+
+
+class CorpusWriter:
+    """Writes submissions, one at a time, into a packed corpus archive."""
+
+    def __init__(self, name: Union[str, bytes, PathLike]) -> None:
+        # Binary I/O, so pylint: disable-next=consider-using-with
+        self.fileobj: BinaryIO = open(name, "wb")
+        self.fileobj.write(bytes(HEADER_SIZE))  # Patched upon closing
+
+        self._offsets = [0]
+        self._authors: dict[str, int] = {}
+        self._languages: dict[str, int] = {}
+        self._author_ids: list[int] = []
+        self._submission_ids: list[int] = []
+        self._language_ids: list[int] = []
+
+    def add(self, author: str, submission_id: int, language: str, source: bytes) -> None:
+        """Append a submission's source code to the archive."""
+        self.fileobj.write(source)
+        self._offsets.append(self._offsets[-1] + len(source))
+        self._author_ids.append(self._authors.setdefault(author, len(self._authors)))
+        self._submission_ids.append(submission_id)
+        self._language_ids.append(
+            self._languages.setdefault(language, len(self._languages))
+        )
+
+    def close(self) -> None:
+        """Write the index and manifest, then close the archive."""
+        columns = (
+            self._offsets,
+            self._author_ids,
+            self._submission_ids,
+            self._language_ids,
+        )
+
+        arrays = {}
+        for (name, dtype), column in zip(INDEX_ARRAYS.items(), columns):
+            self.fileobj.write(bytes(-self.fileobj.tell() % ALIGNMENT))
+            arrays[name] = {"offset": self.fileobj.tell(), "length": len(column)}
+            np.asarray(column, dtype=dtype).tofile(self.fileobj)
+
+        manifest_offset = self.fileobj.tell()
+        manifest = {
+            "blob": {"offset": HEADER_SIZE, "length": self._offsets[-1]},
+            "arrays": arrays,
+            "authors": list(self._authors),
+            "languages": list(self._languages),
+        }
+        self.fileobj.write(json.dumps(manifest).encode())
+        self.fileobj.seek(0)
+        self.fileobj.write(struct.pack(HEADER_FORMAT, MAGIC_BYTES, manifest_offset))
+        self.fileobj.close()
+
+    def __enter__(self) -> CorpusWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+class Corpus:
+    """A read-only, memory-mapped view of a packed corpus archive."""
+
+    def __init__(self, name: Union[str, bytes, PathLike]) -> None:
+        self.name = name
+        with open(name, "rb") as fileobj:
+            self._mmap = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mmap) < HEADER_SIZE:
+            raise ValueError(
+                f"corrupted archive, expected at least {HEADER_SIZE} bytes, but "
+                f"only found {len(self._mmap)}"
+            )
+        magic, manifest_offset = struct.unpack_from(HEADER_FORMAT, self._mmap)
+        if magic != MAGIC_BYTES:
+            raise ValueError(
+                f"corrupted archive, expected header {MAGIC_BYTES}, but found {magic}"
+            )
+
+        manifest = json.loads(self._mmap[manifest_offset:])
+        self.authors: list[str] = manifest["authors"]
+        self.languages: list[str] = manifest["languages"]
+
+        # Index arrays are views of the mapping, so nothing is copied
+        for column, dtype in INDEX_ARRAYS.items():
+            spec = manifest["arrays"][column]
+            array = np.frombuffer(self._mmap, dtype, spec["length"], spec["offset"])
+            setattr(self, f"_{column}", array)
+
+        blob = manifest["blob"]
+        self._blob = memoryview(self._mmap)[
+            blob["offset"] : blob["offset"] + blob["length"]
+        ]
+        self.mtime_ns = os.stat(name).st_mtime_ns
+
+    def __len__(self) -> int:
+        return len(self._submissions)
+
+    def source(self, index: int) -> memoryview:
+        """Get a submission's source code, as a zero-copy view of the archive."""
+        return self._blob[self._offsets[index] : self._offsets[index + 1]]
+
+    def author(self, index: int) -> str:
+        return self.authors[self._authors[index]]
+
+    def submission_id(self, index: int) -> int:
+        return int(self._submissions[index])
+
+    def language(self, index: int) -> str:
+        return self.languages[self._languages[index]]
+
+    def select(
+        self,
+        authors: Optional[Iterable[str]] = None,
+        languages: Optional[Iterable[str]] = None,
+    ) -> np.ndarray:
+        """Get the indices of the submissions matching the given filters."""
+        selected = np.ones(len(self), dtype=bool)
+        if authors is not None:
+            ids = [i for i, a in enumerate(self.authors) if a in set(authors)]
+            selected &= np.isin(self._authors, ids)
+        if languages is not None:
+            ids = [i for i, l in enumerate(self.languages) if l in set(languages)]
+            selected &= np.isin(self._languages, ids)
+        return np.flatnonzero(selected)
+
+    def entries(
+        self,
+        authors: Optional[Iterable[str]] = None,
+        languages: Optional[Iterable[str]] = None,
+    ) -> list[CorpusEntry]:
+        """Get the submissions matching the given filters as entries."""
+        return [CorpusEntry(self, int(i)) for i in self.select(authors, languages)]
+
+
+class CorpusEntry(str):
+    """A submission within an archive, which doubles as its file name.
+
+    The string value is the name the submission would have on disk,
+    "<author>$<submission id>.<language>", so entries can be used wherever the
+    models expect file paths (e.g., to group submissions by author), while the
+    source itself is read from the archive.
+    """
+
+    corpus: Corpus
+    index: int
+
+    def __new__(cls, corpus: Corpus, index: int) -> CorpusEntry:
+        name = f"{corpus.author(index)}${corpus.submission_id(index)}"
+        entry = super().__new__(cls, f"{name}.{corpus.language(index)}")
+        entry.corpus, entry.index = corpus, index
+        return entry
+
+    def read(self) -> memoryview:
+        """Get the submission's source code (see `Corpus.source`)."""
+        return self.corpus.source(self.index)
+
+    @property
+    def cache_key(self) -> str:
+        """A key that changes whenever the archive is rewritten."""
+        path = os.path.abspath(self.corpus.name)
+        return f"{path}:{self.corpus.mtime_ns}:{self.index}"
+
+    def __reduce__(self):
+        # Memory mappings cannot be pickled, so other processes reopen the
+        # archive (once per process) and map it themselves
+        return _open_entry, (self.corpus.name, self.index)
+
+
+@lru_cache(maxsize=None)
+def open_corpus(name: Union[str, bytes, PathLike]) -> Corpus:
+    """Open an archive, sharing one mapping per archive within the process."""
+    return Corpus(name)
+
+
+def _open_entry(name: Union[str, bytes, PathLike], index: int) -> CorpusEntry:
+    return CorpusEntry(open_corpus(name), index)
+
+
+def is_corpus(name: Union[str, bytes, PathLike]) -> bool:
+    """Determine whether a path is a corpus archive, by its magic bytes."""
+    if not os.path.isfile(name):
+        return False
+    with open(name, "rb") as fileobj:
+        return fileobj.read(len(MAGIC_BYTES)) == MAGIC_BYTES
+
+
+def pack(directory: str, name: Union[str, bytes, PathLike]) -> int:
+    """Pack a directory of "<author>$<submission id>.<language>" files."""
+    count = 0
+    with CorpusWriter(name) as writer:
+        for filename in sorted(os.listdir(directory)):
+            try:
+                author, submission = filename.split("$")
+                submission_id, language = submission.split(".", 1)
+                submission_id = int(submission_id)
+            except ValueError:
+                print(f"Filename format error: {filename}")
+                continue
+
+            with open(os.path.join(directory, filename), "rb") as source:
+                writer.add(author, submission_id, language, source.read())
+            count += 1
+    return count
+
+
+def _parse_arguments(args: Optional[Sequence[str]] = None):
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(required=True, dest="command")
+
+    pack_parser = subparsers.add_parser("pack")
+    pack_parser.add_argument("directory", metavar="DIR")
+    pack_parser.add_argument("archive", metavar="ARCHIVE")
+
+    list_parser = subparsers.add_parser("list")
+    list_parser.add_argument("archive", metavar="ARCHIVE")
+    list_parser.add_argument("--author", action="append", dest="authors")
+    list_parser.add_argument("--language", action="append", dest="languages")
+    return parser.parse_args(args)  # If none are supplied, fall back to CLI
+
+
+def main():
+    args = _parse_arguments()
+    if args.command == "pack":
+        print(f"Packed {pack(args.directory, args.archive)} submissions")
+    else:
+        corpus = Corpus(args.archive)
+        for entry in corpus.entries(args.authors, args.languages):
+            print(f"{entry}\t{len(entry.read())}")
+
+
+if __name__ == "__main__":
+    main()
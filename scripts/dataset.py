@@ -1,7 +1,9 @@
 import logging
-from typing import Container, Iterable, cast
+from typing import Container, Iterable, Optional, cast
 
 from api import CodeforcesAPI, LeetCodeAPI
+from cache import ResponseCache
+from metrics import MetricsExporter, Progress
 import mysql.connector
 from mysql.connector.errors import DataError, IntegrityError
 from mysql.connector.types import RowItemType
@@ -13,32 +15,44 @@ from mysql.connector.types import RowItemType
 
 
 class CodeforcesDatasetBuilder:
-    AUTHOR_BLOCK_SIZE = 512
-    SUBMISSION_BLOCK_SIZE = 2048
+    AUTHOR_BLOCK_SIZE = 512  # Bounded by the length of user.info's URL
+    SUBMISSION_BLOCK_SIZE = 16384  # Streamed, so memory does not grow with it
 
-    def __init__(self) -> None:
+    def __init__(
+        self, cache: Optional[ResponseCache] = None, metrics_path: Optional[str] = None
+    ) -> None:
         self.cnx = mysql.connector.connect(
             host="172.24.112.1", user="wsl_root", password="root"
         )
         self.cursor = self.cnx.cursor()  # Used for processing queries
         self.cursor.execute("USE horizon_initiative;")
-        self.api = CodeforcesAPI()  # Connect to the Codeforces API
+        # Connect to the Codeforces API, replaying unexpired responses from the
+        # cache (if given). Submission pages expire after a minute, so only an
+        # offline cache guarantees that re-runs make no requests
+        self.api = CodeforcesAPI(cache=cache)
+
+        # The API's metrics are written periodically (JSON, or Prometheus'
+        # text format for ".prom" files), if a path is given
+        self.exporter = None
+        if metrics_path is not None:
+            self.exporter = MetricsExporter(self.api.metrics, metrics_path).start()
+        self.progress = Progress()  # Rows inserted, reported by `load_metadata`
 
     def load_metadata(self, contests: list[int]) -> None:
+        self.progress = Progress(len(contests), "contests")
         for contest_id in contests:
             try:
-                print(f"Fetching contest info for: {contest_id}")
                 contest = self._fetch_contest_info(contest_id)
                 # contest = (id, name, start_time, duration)
                 end_time = contest[2] + contest[3]
 
-                print("Fetching participant information")
                 participants = self._fetch_contest_standings(contest_id)
-                print("Fetching submission information")
                 self._fetch_contest_submissions(contest_id, end_time, participants)
             except Exception as e:
                 print(e)
                 print(f"Error fetching info from contest {contest_id}")
+            self.progress.step()
+            self.progress.report(force=True)
 
     def _fetch_contest_info(
         self, contest_id: int, force=False
@@ -72,20 +86,18 @@ class CodeforcesDatasetBuilder:
             # to reduce the number of API calls by a considerable amount
             handles = []
 
-            retval = self.api.get_contest_standings(
+            for row in self.api.iter_contest_standings(
                 contest_id, offset, self.AUTHOR_BLOCK_SIZE
-            )
-            assert retval["status"] == "OK", f"Invalid API response: {retval['status']}"
-            contest_standings = retval["result"]
-
-            for row in contest_standings["rows"]:
+            ):
                 party_memebers = row["party"]["members"]
                 assert len(party_memebers) == 1, "Submission MUST contain one author"
                 handles.append(party_memebers[0]["handle"])
             self._fetch_user_info(handles)
             self.cnx.commit()  # Commit all data to the database
             participants.update(handles)
-            if len(contest_standings["rows"]) < self.AUTHOR_BLOCK_SIZE:
+            self.progress.add(len(handles))
+            self.progress.report()
+            if len(handles) < self.AUTHOR_BLOCK_SIZE:
                 break  # All participant standings have been recorded
 
             offset += self.AUTHOR_BLOCK_SIZE
@@ -112,7 +124,6 @@ class CodeforcesDatasetBuilder:
         # Binary Search to prevent linearly probing through up-to 1.4m submissions
         while (high_offset - low_offset) > 2000:
             offset = low_offset + (high_offset - low_offset) // 2
-            print(offset)
             retval = self.api.get_contest_status(contest_id, offset=offset, count=1)
             assert retval["status"] == "OK", "Invalid API response"
             if len(retval["result"]) == 0:
@@ -126,13 +137,12 @@ class CodeforcesDatasetBuilder:
             else:
                 low_offset = offset + 1
         offset = max(1, offset - 2001)
-        print(f"final offset: {offset}")
         while True:
-            retval = self.api.get_contest_status(
+            received = 0  # Submissions are streamed, so count them as they arrive
+            for subm in self.api.iter_contest_status(
                 contest_id, offset=offset, count=self.SUBMISSION_BLOCK_SIZE
-            )
-
-            for subm in retval["result"]:
+            ):
+                received += 1
                 if len(author := subm["author"]["members"]) > 1:
                     continue
 
@@ -160,12 +170,12 @@ class CodeforcesDatasetBuilder:
                     # print(subm)  # Dump out relevent submission information
                     pass
             self.cnx.commit()  # Commit all data to the database
+            self.progress.add(received)
+            self.progress.report()
 
-            if len(retval["result"]) < self.SUBMISSION_BLOCK_SIZE:
+            if received < self.SUBMISSION_BLOCK_SIZE:
                 break  # All participant submissions have been recorded
             offset += self.SUBMISSION_BLOCK_SIZE
-            if offset % 0x4_000:
-                print(f"Processed: {offset}")
 
     def _fetch_user_submissions(self, contest: int, handle: str) -> None:
         retval = self.api.get_contest_status(contest, handle, count=128)
@@ -214,6 +224,8 @@ class CodeforcesDatasetBuilder:
 
     def __del__(self):
         # Prevent resource leaks when exiting the program
+        if self.exporter is not None:
+            self.exporter.stop()  # Writes the final metrics
         self.cursor.close()
         self.cnx.disconnect()
 
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# Copright (C) 2024 Dylan Middendorf
+# SPDX-License-Identifier: BSD-2-Clause
+
+"""Bulk, resumable download of submission sources into a source store.
+
+This is the "deployment" stage of the Codex workflow (see README.md): given
+the ids of the submissions that survived refinement, their sources are
+fetched concurrently (within the API's rate limits) and written to a
+content-addressed store. Submissions already in the store are skipped, so an
+interrupted download resumes where it stopped by rerunning the same command.
+"""
+
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from argparse import ArgumentParser
+from itertools import islice
+from os import PathLike
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, Optional, Sequence
+
+SHARD_SIZE = 1 << 28  # Shards are rotated once they reach 256 MiB
+BATCH_SIZE = 1024  # Submission ids checked and fetched at a time
+
+
+class SourceStore:
+    """A content-addressed store of sources, kept in zstd-compressed shards.
+
+    Every distinct source (by SHA-256 digest) is compressed as an independent
+    zstd frame and appended to the current shard file; identical sources are
+    stored once. An SQLite index maps each digest to its shard, offset and
+    length, and each submission id to its source's digest. A shard's tail that
+    the index does not cover (left by an interrupted write) is truncated when
+    the store is opened.
+
+    Args:
+        directory: The store's directory, which is created if necessary.
+        level: The zstd compression level.
+    """
+
+    def __init__(self, directory: str | PathLike, level: int = 9) -> None:
+        # zstandard is an optional dependency, so defer the import
+        import zstandard as zstd  # pylint: disable=import-outside-toplevel
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._compressor = zstd.ZstdCompressor(level=level)
+        self._decompressor = zstd.ZstdDecompressor()
+        self._lock = threading.Lock()
+
+        self._index = sqlite3.connect(
+            os.path.join(directory, "index.sqlite"), check_same_thread=False
+        )
+        self._index.executescript(
+            "CREATE TABLE IF NOT EXISTS blob (digest TEXT PRIMARY KEY, shard INTEGER "
+            "NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS submission (id INTEGER PRIMARY KEY, "
+            "digest TEXT NOT NULL REFERENCES blob (digest), language TEXT);"
+        )
+
+        # Resume appending to the last shard, past its last indexed blob
+        shard, end = self._index.execute(
+            "SELECT shard, offset + length FROM blob ORDER BY shard DESC, offset DESC LIMIT 1"
+        ).fetchone() or (0, 0)
+        self._shard = shard
+        self._file = self._open_shard(shard, end)
+
+    def _shard_path(self, shard: int) -> str:
+        return os.path.join(self.directory, f"shard-{shard:05d}.zst")
+
+    def _open_shard(self, shard: int, end: int = 0) -> BinaryIO:
+        # Not in append mode, so `tell` is the offset frames are written at,
+        # even once the tail past `end` is truncated
+        path = self._shard_path(shard)
+        file = open(path, "r+b" if os.path.exists(path) else "w+b")  # pylint: disable=consider-using-with
+        file.truncate(end)
+        file.seek(end)
+        return file
+
+    def missing(self, submission_ids: Iterable[int]) -> list[int]:
+        """Returns the given submission ids that are not stored yet, in order."""
+        submission_ids = list(submission_ids)
+        placeholders = ",".join("?" * len(submission_ids))
+        with self._lock:
+            stored = {
+                row[0]
+                for row in self._index.execute(
+                    f"SELECT id FROM submission WHERE id IN ({placeholders})",
+                    submission_ids,
+                )
+            }
+        return [i for i in submission_ids if i not in stored]
+
+    def put(self, submission_id: int, source: bytes, language: Optional[str] = None) -> None:
+        """Stores a submission's source (once per distinct source)."""
+        digest = hashlib.sha256(source).hexdigest()
+        with self._lock:
+            known = self._index.execute(
+                "SELECT 1 FROM blob WHERE digest=?", (digest,)
+            ).fetchone()
+            if known is None:
+                if self._file.tell() >= SHARD_SIZE:
+                    self._file.close()
+                    self._shard += 1
+                    self._file = self._open_shard(self._shard)
+
+                frame = self._compressor.compress(source)
+                offset = self._file.tell()
+                self._file.write(frame)
+                self._file.flush()  # The index must never point past the data
+                self._index.execute(
+                    "INSERT INTO blob VALUES (?, ?, ?, ?)",
+                    (digest, self._shard, offset, len(frame)),
+                )
+
+            self._index.execute(
+                "INSERT OR REPLACE INTO submission VALUES (?, ?, ?)",
+                (submission_id, digest, language),
+            )
+            self._index.commit()
+
+    def get(self, submission_id: int) -> bytes:
+        """Returns a stored submission's source.
+
+        Raises:
+            KeyError: If the submission is not stored.
+        """
+        with self._lock:
+            row = self._index.execute(
+                "SELECT shard, offset, length FROM submission JOIN blob USING (digest) "
+                "WHERE id=?",
+                (submission_id,),
+            ).fetchone()
+        if row is None:
+            raise KeyError(submission_id)
+
+        shard, offset, length = row
+        with open(self._shard_path(shard), "rb") as shard_file:
+            shard_file.seek(offset)
+            return self._decompressor.decompress(shard_file.read(length))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._index.execute("SELECT COUNT(*) FROM submission").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+            self._index.close()
+
+
+def download(
+    store: SourceStore,
+    submissions: Iterable[Any],
+    fetch: Callable[[Any], tuple[bytes, Optional[str]]],
+    fetch_map: Callable[..., Iterator],
+    batch_size: int = BATCH_SIZE,
+    key: Optional[Callable[[Any], int]] = None,
+) -> tuple[int, int, int]:
+    """Fetches the sources of the submissions the store lacks.
+
+    Args:
+        store: The store the sources are written to.
+        submissions: The submissions to download, e.g., read from a file: their
+        ids, or anything `key` maps to their ids (such as (contest id,
+        submission id) pairs).
+        fetch: Fetches one submission's source and language.
+        fetch_map: Maps `fetch` over many submissions concurrently (e.g.,
+        `CodeforcesAPI.map`).
+        batch_size: The number of submissions handled at a time.
+        key: Maps a submission to its id, if the submissions are not ids.
+
+    Returns:
+        The number of submissions downloaded, skipped (already stored), and
+        failed. Failed submissions are not stored, so a rerun retries them.
+        Repeated submissions are only downloaded (and counted) once.
+    """
+    key = key or (lambda submission: submission)
+
+    def try_fetch(submission):
+        try:
+            return fetch(submission)
+        except Exception as e:  # Reported, then retried by the next run
+            print(f"Error fetching submission {key(submission)}: {e}", file=sys.stderr)
+            return None
+
+    downloaded = skipped = failed = 0
+    start = time.perf_counter()
+    submissions = iter(submissions)
+    while batch := list(islice(submissions, batch_size)):
+        unique = {}  # Submission id -> submission, the first of any repeats
+        for submission in batch:
+            unique.setdefault(key(submission), submission)
+        missing = store.missing(unique)
+        skipped += len(unique) - len(missing)
+
+        pending = [unique[submission_id] for submission_id in missing]
+        for submission_id, fetched in zip(missing, fetch_map(try_fetch, pending)):
+            if fetched is None:
+                failed += 1
+                continue
+            store.put(submission_id, *fetched)
+            downloaded += 1
+
+        elapsed = time.perf_counter() - start
+        print(
+            f"Downloaded {downloaded}, skipped {skipped}, failed {failed} "
+            f"({downloaded / max(elapsed, 1e-9):.1f} submissions/s)"
+        )
+    return downloaded, skipped, failed
+
+
+def _read_ids(path: str) -> Iterator[list[str]]:
+    # One submission per line, as whitespace separated fields
+    with open(path, encoding="utf-8") if path != "-" else sys.stdin as lines:
+        for line in lines:
+            if line.strip():
+                yield line.split()
+
+
+def _parse_arguments(args: Optional[Sequence[str]] = None):
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("platform", choices=("codeforces", "leetcode"))
+    parser.add_argument(
+        "ids",
+        metavar="IDS",
+        help='file of "<contest id> <submission id>" (Codeforces) or '
+        '"<submission id>" (LeetCode) lines, or - for stdin',
+    )
+    parser.add_argument("--store", required=True, metavar="<dir>")
+    parser.add_argument(
+        "--jobs",
+        default=8,
+        type=int,
+        metavar="<n>",
+        help="concurrent requests (still bounded by the rate limit)",
+    )
+    parser.add_argument("--batch-size", default=BATCH_SIZE, type=int, metavar="<n>")
+    parser.add_argument(
+        "--metrics",
+        metavar="<path>",
+        help='periodically write request metrics (Prometheus format for ".prom")',
+    )
+    return parser.parse_args(args)  # If none are supplied, fall back to CLI
+
+
+def main():
+    args = _parse_arguments()
+    from api import CodeforcesAPI, LeetCodeAPI  # pylint: disable=import-outside-toplevel
+    from metrics import MetricsExporter  # pylint: disable=import-outside-toplevel
+
+    store = SourceStore(args.store)
+    if args.platform == "codeforces":
+        api = CodeforcesAPI(pool_size=args.jobs)
+
+        # The contest id is needed for the request, so it's kept alongside
+        def submissions() -> Iterator[tuple[int, int]]:
+            for contest_id, submission_id in _read_ids(args.ids):
+                yield int(contest_id), int(submission_id)
+
+        def key(submission: tuple[int, int]) -> int:
+            return submission[1]
+
+        def fetch(submission: tuple[int, int]) -> tuple[bytes, Optional[str]]:
+            response = api.get_submission(*submission)
+            return response["source"].encode(), response.get("lang")
+
+    else:
+        api = LeetCodeAPI(pool_size=args.jobs)
+        key = None
+
+        def submissions() -> Iterator[int]:
+            return (int(fields[0]) for fields in _read_ids(args.ids))
+
+        def fetch(submission_id: int) -> tuple[bytes, Optional[str]]:
+            response = api.get_submission(submission_id)
+            return response["code"].encode(), response.get("lang")
+
+    exporter = None
+    if args.metrics is not None:
+        exporter = MetricsExporter(api.metrics, args.metrics).start()
+    try:
+        download(store, submissions(), fetch, api.map, args.batch_size, key)
+    finally:
+        store.close()
+        if exporter is not None:
+            exporter.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import codecs
+import json  # Manages REST API responses
+import re
+
+from typing import Any, BinaryIO, Iterator, Optional, Sequence
+
+WHITESPACE = " \t\n\r"
+NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")  # What may follow a number's parsed prefix
+TRUNCATION_MARGIN = 16  # Longer than any literal, number prefix or escape
+
+
+class _Reader:
+    """Buffers a binary stream as text, consuming JSON values one at a time."""
+
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, stream: BinaryIO) -> None:
+        self.stream = stream
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+
+    def _fill(self) -> None:
+        # Reading at least as much as is buffered keeps reparsing a value that
+        # spans many reads (see `value`) amortized linear
+        chunk = self.stream.read(max(self.CHUNK_SIZE, len(self.buffer) - self.position))
+        self.buffer = self.buffer[self.position :] + self._decoder.decode(chunk, not chunk)
+        self.position = 0
+        self.eof = not chunk
+
+    def peek(self) -> str:
+        """Returns the next non-whitespace character (empty at the end)."""
+        while True:
+            while self.position < len(self.buffer):
+                if self.buffer[self.position] not in WHITESPACE:
+                    return self.buffer[self.position]
+                self.position += 1
+            if self.eof:
+                return ""
+            self._fill()
+
+    def expect(self, token: str) -> None:
+        if self.peek() != token:
+            raise ValueError(
+                f"Expected {token!r} in JSON stream, but found {self.peek()!r}"
+            )
+        self.position += 1
+
+    def value(self) -> Any:
+        """Decodes the next JSON value, reading more of the stream as needed."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError as e:
+                if self.eof or not self._truncated(e):
+                    raise
+            else:
+                # A number (or literal) reaching the end of the buffer may
+                # continue, e.g., "0." parses as 0 and "1e" as 1
+                if self.eof or NUMBER_TAIL.match(self.buffer, end).end() < len(self.buffer):
+                    self.position = end
+                    return value
+            self._fill()
+
+    def _truncated(self, error: json.JSONDecodeError) -> bool:
+        # Whether an error may be the value being cut short by the end of the
+        # buffer (e.g., "tru" or "[1, "), rather than invalid JSON, which is
+        # raised without reading (possibly all of) the rest of the stream
+        if error.msg.startswith("Unterminated string"):
+            return True  # Strings only end early at the end of the buffer
+        return len(self.buffer[error.pos :].strip(WHITESPACE)) <= TRUNCATION_MARGIN
+
+    def drain(self) -> None:
+        """Reads the stream to its end, verifying only trailing whitespace."""
+        if self.peek() != "":
+            raise ValueError("Unexpected data after the JSON value")
+
+
+def iter_array(
+    stream: BinaryIO, path: Sequence[str], fields: Optional[dict] = None
+) -> Iterator[Any]:
+    """Yields the elements of a JSON array nested within objects, one at a time.
+
+    The stream is parsed incrementally, so only one element is held in memory
+    at a time, no matter how long the array is. Fields that precede the array
+    are kept, e.g., an API response's "status", or the "contest" of a standings
+    page.
+
+    Example:
+        >>> for submission in iter_array(response, ("result",)): ...
+
+    Args:
+        stream: A binary file object holding UTF-8 encoded JSON.
+        path: The keys leading to the array, from the outermost object.
+        fields: A dictionary populated with the fields read before (and after)
+        the array, nested like the document itself.
+
+    Raises:
+        ValueError: If the stream is not valid JSON, or the path does not lead
+        to an array. The error includes the fields read so far (e.g., an
+        error "comment").
+    """
+    reader = _Reader(stream)
+    fields = {} if fields is None else fields
+
+    # Descend into the objects along the path, keeping the fields on the way
+    levels, level = [], fields
+    for depth, key in enumerate(path):
+        reader.expect("{")
+        levels.append(level)
+        while True:
+            if reader.peek() == "}":
+                raise ValueError(f"Missing {key!r} in JSON stream: {fields}")
+            if reader.peek() == ",":
+                reader.position += 1
+            name = reader.value()
+            reader.expect(":")
+            if name == key:
+                break
+            level[name] = reader.value()
+        if depth + 1 < len(path):
+            level = level.setdefault(key, {})
+
+    reader.expect("[")
+    while reader.peek() != "]":
+        if reader.peek() == ",":
+            reader.position += 1
+        yield reader.value()
+    reader.position += 1
+
+    # Climb back out, keeping any fields that follow the array
+    for level in reversed(levels):
+        while reader.peek() != "}":
+            if reader.peek() == ",":
+                reader.position += 1
+            name = reader.value()
+            reader.expect(":")
+            level[name] = reader.value()
+        reader.position += 1
+    reader.drain()
+
+
+def select(document: Any, path: Sequence[str]) -> Iterator[Any]:
+    """Yields the elements of an array in an already decoded document.
+
+    This mirrors `iter_array`, e.g., for responses replayed from a cache.
+    """
+    for key in path:
+        document = document[key]
+    yield from document
@@ -0,0 +1,342 @@
+import bisect
+import json
+import os
+import re
+import threading
+import time
+
+from contextlib import contextmanager
+from os import PathLike
+from typing import Iterator, Optional
+
+from ratelimit import Throttled
+
+# Upper bounds of the latency histogram's buckets, in seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def route(endpoint: str) -> str:
+    """Returns the route an endpoint's metrics are kept under.
+
+    The query string is dropped, and path segments holding ids or slugs (any
+    segment with a digit) are replaced by "*", e.g., "/api/submissions/1234/"
+    becomes "/api/submissions/*/".
+    """
+    path = endpoint.split("?", 1)[0]
+    return re.sub(r"/[^/]*\d[^/]*", "/*", path)
+
+
+class Histogram:
+    """A fixed-bucket histogram (not thread-safe, see `EndpointMetrics`)."""
+
+    def __init__(self, bounds: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last bucket is unbounded
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        """Returns (upper bound, count of values <= bound) pairs, as Prometheus does."""
+        pairs, total = [], 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile, interpolating linearly within its bucket."""
+        rank, lower, below = q * self.count, 0.0, 0
+        for i, count in enumerate(self.counts):
+            if count and below + count >= rank:
+                if i == len(self.bounds):
+                    return lower  # Unbounded, so its lower bound is the best estimate
+                return lower + (self.bounds[i] - lower) * (rank - below) / count
+            below += count
+            lower = self.bounds[min(i, len(self.bounds) - 1)]
+        return lower
+
+
+class EndpointMetrics:
+    """The request metrics of one route (see `route`)."""
+
+    def __init__(self) -> None:
+        self.requests = 0  # Requests sent, including retries
+        self.errors = 0  # Failed requests, other than throttled ones
+        self.throttled = 0
+        self.retries = 0
+        self.bytes = 0  # Response bytes, as transferred (i.e., compressed)
+        self.parse_seconds = 0.0
+        self.latency = Histogram()  # Seconds until the response (headers) arrived
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "bytes": self.bytes,
+                "parse_seconds": round(self.parse_seconds, 6),
+                "latency": {
+                    "count": self.latency.count,
+                    "sum": round(self.latency.sum, 6),
+                    "p50": round(self.latency.quantile(0.5), 6),
+                    "p90": round(self.latency.quantile(0.9), 6),
+                    "p99": round(self.latency.quantile(0.99), 6),
+                    "buckets": {
+                        str(bound): count for bound, count in self.latency.cumulative()
+                    },
+                },
+            }
+
+
+class Attempt:
+    """A single request being measured (see `Metrics.attempt`)."""
+
+    def __init__(self, metrics: EndpointMetrics) -> None:
+        self._metrics = metrics
+        self._start = time.perf_counter()
+        self._responded = False
+
+    def responded(self, transferred: int = 0) -> None:
+        """Records the response's latency (once), and the bytes transferred."""
+        with self._metrics._lock:
+            if not self._responded:
+                self._metrics.latency.observe(time.perf_counter() - self._start)
+                self._responded = True
+            self._metrics.bytes += transferred
+
+    def parsed(self, seconds: float) -> None:
+        """Adds to the route's parse time (e.g., of a streamed response)."""
+        with self._metrics._lock:
+            self._metrics.parse_seconds += seconds
+
+    @contextmanager
+    def parsing(self) -> Iterator[None]:
+        """Adds the time spent within the context to the route's parse time."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.parsed(time.perf_counter() - start)
+
+
+class Metrics:
+    """Thread-safe, per-endpoint request metrics of an API client.
+
+    Every request counts towards its route's requests, errors, throttling,
+    retries, transferred bytes, JSON parse time, and a latency histogram.
+    The metrics are exported as JSON (`snapshot`) or in the Prometheus text
+    format (`prometheus`), e.g., periodically by a `MetricsExporter`.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self._endpoints: dict[str, EndpointMetrics] = {}
+        self._lock = threading.Lock()
+
+    def endpoint(self, endpoint: str) -> EndpointMetrics:
+        """Returns the metrics of an endpoint's route, creating them if needed."""
+        key = route(endpoint)
+        with self._lock:
+            if key not in self._endpoints:
+                self._endpoints[key] = EndpointMetrics()
+            return self._endpoints[key]
+
+    @contextmanager
+    def attempt(self, endpoint: str) -> Iterator[Attempt]:
+        """Measures one request to an endpoint.
+
+        The latency is recorded when `Attempt.responded` is called, or when the
+        context exits otherwise. A `Throttled` error counts as throttling, and
+        any other error as a failed request; the error is then re-raised.
+        """
+        metrics = self.endpoint(endpoint)
+        with metrics._lock:
+            metrics.requests += 1
+
+        attempt = Attempt(metrics)
+        try:
+            yield attempt
+        except Throttled:
+            with metrics._lock:
+                metrics.throttled += 1
+            raise
+        except Exception:
+            with metrics._lock:
+                metrics.errors += 1
+            raise
+        finally:
+            attempt.responded()
+
+    def retried(self, endpoint: str) -> None:
+        """Counts a retry (e.g., as `ratelimit.call_with_retries`'s `on_retry`)."""
+        metrics = self.endpoint(endpoint)
+        with metrics._lock:
+            metrics.retries += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            endpoints = dict(self._endpoints)
+        return {
+            "time": time.time(),
+            "uptime": time.time() - self.started,
+            "endpoints": {key: endpoints[key].snapshot() for key in sorted(endpoints)},
+        }
+
+    def prometheus(self, prefix: str = "codex_api") -> str:
+        """Returns the metrics in the Prometheus text exposition format."""
+        counters = (
+            ("requests", "requests_total", "Requests sent, including retries."),
+            ("errors", "errors_total", "Failed requests, other than throttled ones."),
+            ("throttled", "throttled_total", "Requests rejected by a rate limit."),
+            ("retries", "retries_total", "Requests retried after an error."),
+            ("bytes", "response_bytes_total", "Response bytes transferred."),
+            ("parse_seconds", "parse_seconds_total", "Time spent parsing JSON."),
+        )
+
+        endpoints = self.snapshot()["endpoints"]
+        lines = []
+        for field, name, description in counters:
+            lines.append(f"# HELP {prefix}_{name} {description}")
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for key, snapshot in endpoints.items():
+                lines.append(f'{prefix}_{name}{{endpoint="{_escape(key)}"}} {snapshot[field]}')
+
+        name = f"{prefix}_request_duration_seconds"
+        lines.append(f"# HELP {name} Latency until the response arrived.")
+        lines.append(f"# TYPE {name} histogram")
+        for key, snapshot in endpoints.items():
+            label = f'endpoint="{_escape(key)}"'
+            latency = snapshot["latency"]
+            for bound, count in latency["buckets"].items():
+                bound = "+Inf" if bound == "inf" else bound
+                lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f"{name}_sum{{{label}}} {latency['sum']}")
+            lines.append(f"{name}_count{{{label}}} {latency['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str | PathLike) -> None:
+        """Atomically writes the metrics to a file.
+
+        Files ending in ".prom" are written in the Prometheus text format (for
+        node_exporter's textfile collector), and any other file as JSON.
+        """
+        if os.fspath(path).endswith(".prom"):
+            content = self.prometheus()
+        else:
+            content = json.dumps(self.snapshot(), indent=2) + "\n"
+
+        # Readers must never see a partially written file
+        temporary = f"{os.fspath(path)}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            file.write(content)
+        os.replace(temporary, path)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsExporter:
+    """Periodically writes metrics to a file (see `Metrics.write`).
+
+    The file is written every `interval` seconds from a daemon thread, and
+    once more when the exporter is stopped, so it ends up complete.
+
+    Example:
+        >>> with MetricsExporter(api.metrics, "metrics.prom"): ...
+    """
+
+    def __init__(self, metrics: Metrics, path: str | PathLike, interval: float = 15.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.metrics.write(self.path)
+
+    def start(self) -> "MetricsExporter":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.metrics.write(self.path)
+
+    def __enter__(self) -> "MetricsExporter":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+
+class Progress:
+    """Tracks the progress of a long run, e.g., of a dataset builder.
+
+    Progress is counted in steps (e.g., contests) out of a known total, and
+    rows (e.g., submissions) within them. The summary reports the row rate
+    and, from the average time per step, the estimated time remaining.
+
+    Args:
+        total: The number of steps, if known.
+        unit: The name of a step, for the summary.
+        interval: The minimum number of seconds between `report`s.
+    """
+
+    def __init__(self, total: Optional[int] = None, unit: str = "steps", interval: float = 10.0):
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+
+        self.steps = 0
+        self.rows = 0
+        self._start = self._reported = time.monotonic()
+
+    def add(self, rows: int) -> None:
+        self.rows += rows
+
+    def step(self) -> None:
+        self.steps += 1
+
+    def eta(self) -> Optional[float]:
+        """Returns the estimated seconds remaining, if there is an estimate."""
+        if self.total is None or self.steps == 0:
+            return None
+        elapsed = time.monotonic() - self._start
+        return elapsed / self.steps * (self.total - self.steps)
+
+    def summary(self) -> str:
+        elapsed = time.monotonic() - self._start
+        steps = f"{self.steps}/{self.total}" if self.total is not None else f"{self.steps}"
+        eta = self.eta()
+        return (
+            f"{steps} {self.unit}, {self.rows} rows in {_duration(elapsed)} "
+            f"({self.rows / max(elapsed, 1e-9):.1f} rows/s), "
+            f"ETA {_duration(eta) if eta is not None else 'unknown'}"
+        )
+
+    def report(self, force: bool = False) -> None:
+        """Prints the summary, at most once per `interval` (unless forced)."""
+        now = time.monotonic()
+        if force or now - self._reported >= self.interval:
+            self._reported = now
+            print(self.summary())
+
+
+def _duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
@@ -0,0 +1,156 @@
+import http.client  # Low level HTTP client
+import random
+import threading
+import time
+
+from typing import Callable, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Throttled(Exception):
+    """The server rejected a request for exceeding its rate limit."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TransientError(Exception):
+    """The server failed to answer a request (e.g., a 5xx status)."""
+
+
+# Errors worth retrying: throttling, server failures, and transport errors
+RETRYABLE_ERRORS = (Throttled, TransientError, OSError, http.client.HTTPException)
+
+
+class TokenBucket:
+    """A thread-safe token bucket whose rate adapts to observed throttling.
+
+    Tokens accrue at `rate` per second, up to `burst`, and every request takes
+    one. The bucket starts at the server's documented limit, so a sustained
+    load runs right at it. Whenever the server throttles a request anyway, the
+    rate is halved (down to `min_rate`) and the pending tokens are forfeited;
+    every successful request then recovers a twentieth of the limit, so the
+    rate settles just under wherever the server starts throttling.
+
+    Args:
+        rate: The allowed number of requests per second.
+        burst: The number of requests that may be sent back to back.
+        min_rate: The lowest rate throttling may reduce the bucket to, which
+        defaults to a sixteenth of `rate`.
+    """
+
+    def __init__(self, rate: float, burst: float = 1, min_rate: Optional[float] = None):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate if min_rate is not None else rate / 16
+
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> None:
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available, without blocking."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def throttled(self) -> None:
+        """Multiplicatively back off after the server throttled a request."""
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0)
+
+    def succeeded(self) -> None:
+        """Additively recover the rate after a successful request."""
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+_limiters: dict[Hashable, TokenBucket] = {}
+_limiters_lock = threading.Lock()
+
+
+def shared_limiter(key: Hashable, rate: float, burst: float = 1) -> TokenBucket:
+    """Returns the process-wide token bucket of `key` (e.g., a host).
+
+    Every client of the same server must draw from the same bucket, since the
+    server enforces its limit across all of them. The bucket is created with
+    the first caller's `rate` and `burst`.
+    """
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = TokenBucket(rate, burst)
+        return _limiters[key]
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Returns a "full jitter" exponential backoff delay, in seconds.
+
+    The delay is drawn uniformly from [0, min(max_delay, base_delay * 2^attempt)],
+    so clients throttled together do not retry in lockstep.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+def call_with_retries(
+    fn: Callable[[], T],
+    limiter: TokenBucket,
+    retries: int = 6,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+    on_retry: Optional[Callable[[Exception], None]] = None,
+) -> T:
+    """Calls `fn` within the limiter's rate, retrying retryable errors.
+
+    Throttled calls also slow the limiter down, and wait at least as long as
+    the server's Retry-After, if it sent one. `on_retry` is called with each
+    error that is about to be retried (e.g., to count retries).
+
+    Raises:
+        Exception: The last error, once `retries` retries have failed too.
+        Errors that are not retryable are raised immediately.
+    """
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            result = fn()
+        except RETRYABLE_ERRORS as e:
+            if attempt == retries:
+                raise
+
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            if isinstance(e, Throttled):
+                limiter.throttled()
+                delay = max(delay, e.retry_after or 0)
+            if on_retry is not None:
+                on_retry(e)
+            time.sleep(delay)
+            attempt += 1
+        else:
+            limiter.succeeded()
+            return result
@@ -0,0 +1,581 @@
+#!/usr/bin/env python
+# Copright (C) 2024 Dylan Middendorf
+# SPDX-License-Identifier: BSD-2-Clause
+
+"""A local stand-in for the Codeforces and LeetCode endpoints Codex scrapes.
+
+The server answers the requests `api.CodeforcesAPI` and `api.LeetCodeAPI`
+send (the Codeforces session handshake, contest.standings, contest.status,
+user.info and data/submitSource; LeetCode contest info, rankings and
+submissions) with synthetic data, so scrapers can be benchmarked and tested
+without touching the live sites. The data is derived from the seed and the
+request alone, so any scale can be served without generating it up front, and
+the same request always gets the same answer. Latency, rate limiting,
+server errors and dropped connections can be injected to exercise retries.
+
+Example:
+    $ python standin.py --port 8080 --contests 10 --participants 5000
+    >>> api = CodeforcesAPI("127.0.0.1", 8080, secure=False)
+"""
+
+import gzip
+import json  # Manages REST API responses
+import random
+import threading
+import time
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Optional, Sequence
+from urllib.parse import parse_qs, urlsplit
+
+from ratelimit import TokenBucket
+
+SPAN = 10_000_000  # Submission ids of a contest are `contest * SPAN + index`
+START_TIME = 1_600_000_000  # Of the first contest, one contest per day after it
+DURATION = 2 * 60 * 60
+RANKING_PAGE_SIZE = 25  # LeetCode's ranking pages are fixed in size
+
+PROBLEMS = "ABCDEF"
+LANGUAGES = ("GNU C++17", "GNU C++20 (64)", "Python 3", "PyPy 3-64", "Java 21", "Rust 2021")
+LEETCODE_LANGUAGES = ("cpp", "python3", "java", "rust")
+VERDICTS = ("OK", "OK", "OK", "WRONG_ANSWER", "TIME_LIMIT_EXCEEDED", "RUNTIME_ERROR")
+
+# fmt: off
+TOKENS = (
+    "int", "long long", "auto", "for", "while", "if", "else", "return", "i",
+    "j", "n", "m", "ans", "dp", "cnt", "=", "+=", "==", "<", "++", "(", ")",
+    "[", "]", "{", "}", ";", "0", "1", "std::", "vector<int>", "push_back",
+)
+# fmt: on
+
+
+def _mix(*values: int) -> int:
+    # A cheap deterministic hash of integers (hash() of ints is not salted)
+    return hash(values) & 0x7FFF_FFFF_FFFF_FFFF
+
+
+class SyntheticPlatform:
+    """Deterministic synthetic contests, users and submissions.
+
+    Every contest has the same `participants` users ("user0", "user1", ...),
+    each of whom submits `submissions` times during the contest; a further
+    quarter as many practice submissions follow the contest's end.
+
+    Args:
+        contests: The number of contests (ids and LeetCode weekly contests 1, 2, ...).
+        participants: The number of users, all of whom take part in every contest.
+        submissions: The number of submissions per participant and contest.
+        source_size: The approximate size of each source, in bytes.
+        seed: Varies the generated data.
+    """
+
+    def __init__(
+        self,
+        contests: int = 4,
+        participants: int = 1000,
+        submissions: int = 4,
+        source_size: int = 2000,
+        seed: int = 0,
+    ) -> None:
+        self.contests = contests
+        self.participants = participants
+        self.submissions = submissions
+        self.source_size = source_size
+        self.seed = seed
+
+        self.in_contest = participants * submissions
+        self.practice = self.in_contest // 4
+        self.total = self.in_contest + self.practice  # Submissions per contest
+
+    def has_contest(self, contest_id: int) -> bool:
+        return 1 <= contest_id <= self.contests
+
+    def contest(self, contest_id: int) -> dict:
+        return {
+            "id": contest_id,
+            "name": f"Synthetic Round {contest_id}",
+            "type": "CF",
+            "phase": "FINISHED",
+            "frozen": False,
+            "durationSeconds": DURATION,
+            "startTimeSeconds": START_TIME + contest_id * 24 * 60 * 60,
+        }
+
+    def problems(self, contest_id: int) -> list[dict]:
+        return [
+            {"contestId": contest_id, "index": index, "name": f"Problem {index}"}
+            for index in PROBLEMS
+        ]
+
+    def user(self, handle: str) -> Optional[dict]:
+        if not handle.startswith("user") or not handle[4:].isdigit():
+            return None
+        if int(handle[4:]) >= self.participants:
+            return None
+
+        h = _mix(self.seed, int(handle[4:]))
+        user = {
+            "handle": handle,
+            "rating": 800 + h % 2400,
+            "maxRating": 800 + h % 2400 + h % 97,
+            "registrationTimeSeconds": START_TIME - h % (5 * 365 * 24 * 60 * 60),
+        }
+        if h % 3:
+            user["country"] = ("Poland", "China", "Brazil", "Japan")[h % 4]
+        if h % 5 == 0:
+            user["city"] = "Warsaw"
+        return user
+
+    def standings_row(self, contest_id: int, rank: int) -> dict:
+        handle = f"user{(rank - 1 + contest_id) % self.participants}"
+        return {
+            "party": {
+                "contestId": contest_id,
+                "members": [{"handle": handle}],
+                "participantType": "CONTESTANT",
+                "ghost": False,
+            },
+            "rank": rank,
+            "points": float(3000 - rank * 3000 // (self.participants + 1)),
+            "penalty": 0,
+            "successfulHackCount": 0,
+            "unsuccessfulHackCount": 0,
+            "problemResults": [],
+        }
+
+    def submission(self, contest_id: int, offset: int) -> dict:
+        """Returns a contest's submission, by 0-based offset (newest first)."""
+        h = _mix(self.seed, contest_id, offset)
+        start = START_TIME + contest_id * 24 * 60 * 60
+        if offset < self.practice:  # The newest submissions are practice
+            time_ = start + DURATION + (self.practice - offset) * 60
+        else:
+            time_ = start + DURATION * (self.total - offset) // (self.in_contest + 1)
+
+        index = PROBLEMS[h % len(PROBLEMS)]
+        return {
+            "id": contest_id * SPAN + self.total - 1 - offset,  # Decreasing
+            "contestId": contest_id,
+            "creationTimeSeconds": time_,
+            "relativeTimeSeconds": time_ - start,
+            "problem": {"contestId": contest_id, "index": index, "name": f"Problem {index}"},
+            "author": {
+                "contestId": contest_id,
+                "members": [{"handle": f"user{h % self.participants}"}],
+                "participantType": "PRACTICE" if offset < self.practice else "CONTESTANT",
+                "ghost": False,
+            },
+            "programmingLanguage": LANGUAGES[h % len(LANGUAGES)],
+            "verdict": VERDICTS[h % len(VERDICTS)],
+            "testset": "TESTS",
+            "passedTestCount": h % 40,
+            "timeConsumedMillis": h % 2000,
+            "memoryConsumedBytes": h % (256 << 20),
+        }
+
+    def submissions_of(self, contest_id: int, handle: Optional[str] = None) -> Iterator[dict]:
+        for offset in range(self.total):
+            submission = self.submission(contest_id, offset)
+            if handle is None or submission["author"]["members"][0]["handle"] == handle:
+                yield submission
+
+    def has_submission(self, submission_id: int) -> bool:
+        contest_id, index = divmod(submission_id, SPAN)
+        return self.has_contest(contest_id) and index < self.total
+
+    def source(self, submission_id: int) -> str:
+        """Returns roughly `source_size` bytes of code, unique to the submission."""
+        rng = random.Random(_mix(self.seed, submission_id))
+        lines, length = [f"// Submission {submission_id}"], 0
+        while length < self.source_size:
+            line = " ".join(rng.choices(TOKENS, k=rng.randint(3, 12)))
+            lines.append("    " * rng.randint(0, 3) + line)
+            length += len(lines[-1]) + 1
+        return "\n".join(lines) + "\n"
+
+    def ranking_page(self, contest_id: int, page: int) -> dict:
+        """Returns a LeetCode ranking page, with each participant's submissions."""
+        first = (page - 1) * RANKING_PAGE_SIZE
+        ranks = range(first, min(first + RANKING_PAGE_SIZE, self.participants))
+
+        total_rank, submissions = [], []
+        for rank in ranks:
+            user = (rank + contest_id) % self.participants
+            total_rank.append(
+                {
+                    "contest_id": contest_id,
+                    "username": f"user{user}",
+                    "user_slug": f"user{user}",
+                    "country_code": "",
+                    "rank": rank + 1,
+                    "score": 18 - 18 * rank // max(self.participants, 1),
+                    "finish_time": START_TIME + contest_id * 7 * 24 * 60 * 60 + rank,
+                    "data_region": "US",
+                }
+            )
+            # A submission per question, with ids like Codeforces' (see `SPAN`)
+            solved = {}
+            for question in range(min(self.submissions, 4)):
+                submission_id = contest_id * SPAN + user * 4 + question
+                solved[str(question + 1)] = {
+                    "id": submission_id,
+                    "submission_id": submission_id,
+                    "question_id": question + 1,
+                    "lang": LEETCODE_LANGUAGES[_mix(submission_id) % 4],
+                    "date": START_TIME + contest_id * 7 * 24 * 60 * 60 + question,
+                    "data_region": "US",
+                }
+            submissions.append(solved)
+
+        return {
+            "is_past": True,
+            "submissions": submissions,
+            "questions": [
+                {"question_id": q + 1, "credit": 3 + q, "title": f"Question {q + 1}"}
+                for q in range(4)
+            ],
+            "total_rank": total_rank,
+            "user_num": self.participants,
+        }
+
+    def has_leetcode_submission(self, submission_id: int) -> bool:
+        contest_id, index = divmod(submission_id, SPAN)
+        user, question = divmod(index, 4)
+        return (
+            self.has_contest(contest_id)
+            and user < self.participants
+            and question < min(self.submissions, 4)
+        )
+
+
+class FaultInjector:
+    """Decides the latency of each response, and which to throttle or fail.
+
+    Args:
+        latency: The mean added latency of a response, in seconds (drawn
+        uniformly from zero to twice the mean).
+        rate: The requests per second each endpoint group (the Codeforces API,
+        its website, and LeetCode) serves before throttling, or 0 for no limit.
+        error_rate: The fraction of requests answered by a server error.
+        drop_rate: The fraction of requests whose connection is dropped
+        without a response.
+        truncate_rate: The fraction of responses whose connection is dropped
+        halfway through their body.
+        seed: Seeds the random faults.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        rate: float = 0.0,
+        error_rate: float = 0.0,
+        drop_rate: float = 0.0,
+        truncate_rate: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.rate = rate
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.truncate_rate = truncate_rate
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._buckets: dict[str, TokenBucket] = {}
+
+    def delay(self) -> None:
+        if self.latency > 0:
+            with self._lock:
+                seconds = self._rng.uniform(0, 2 * self.latency)
+            time.sleep(seconds)
+
+    def throttle(self, group: str) -> bool:
+        """Returns whether to reject a request of the group for its rate."""
+        if self.rate <= 0:
+            return False
+        with self._lock:
+            if group not in self._buckets:
+                self._buckets[group] = TokenBucket(self.rate, burst=max(1, self.rate))
+            bucket = self._buckets[group]
+        return not bucket.try_acquire()
+
+    def fault(self) -> Optional[str]:
+        """Returns "error", "drop", "truncate" or None (for a normal response)."""
+        with self._lock:
+            draw = self._rng.random()
+        if draw < self.drop_rate:
+            return "drop"
+        if draw < self.drop_rate + self.error_rate:
+            return "error"
+        if draw < self.drop_rate + self.error_rate + self.truncate_rate:
+            return "truncate"
+        return None
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so clients reuse connections
+    disable_nagle_algorithm = True  # Headers and body are written separately
+    server: "StandinServer"
+
+    def do_GET(self) -> None:
+        self._handle()
+
+    def do_POST(self) -> None:
+        self._handle()
+
+    def _handle(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode() if length else ""
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        leetcode = url.path.startswith(("/contest/api/", "/api/submissions/"))
+        group = "leetcode" if leetcode else "api" if url.path.startswith("/api/") else "site"
+        faults = self.server.faults
+
+        faults.delay()
+        if faults.throttle(group):
+            self.server.count("throttled")
+            if group == "api":  # Codeforces' API reports its limit in the body
+                self._reply(503, {"status": "FAILED", "comment": "Call limit exceeded"})
+            else:
+                self._reply(429, {"error": "Too Many Requests"}, {"Retry-After": "1"})
+            return
+
+        fault = faults.fault()
+        if fault == "drop":
+            self.server.count("dropped")
+            self.close_connection = True  # Hang up without a response
+            return
+        if fault == "error":
+            self.server.count("errors")
+            self._reply(502, {"status": "FAILED", "comment": "Bad Gateway"})
+            return
+
+        self.server.count("requests")
+        try:
+            status, payload, headers = self._route(url.path, query, body)
+        except (KeyError, ValueError) as e:
+            status, payload, headers = 400, {"status": "FAILED", "comment": str(e)}, {}
+        if fault == "truncate":
+            self.server.count("truncated")
+            self.close_connection = True  # Hang up once half the body is sent
+        self._reply(status, payload, headers, truncate=fault == "truncate")
+
+    def _route(self, path: str, query: dict[str, str], body: str) -> tuple:
+        platform = self.server.platform
+        if path == "/":  # The Codeforces session handshake
+            page = '<html><head><meta name="X-Csrf-Token" content="0123456789abcdef"/></head></html>'
+            cookie = {"Set-Cookie": "JSESSIONID=0123456789ABCDEF;Path=/"}
+            return 200, page, cookie
+
+        if path == "/api/contest.standings":
+            contest_id = int(query["contestId"])
+            if not platform.has_contest(contest_id):
+                raise ValueError(f"contestId: Contest with id {contest_id} not found")
+            first, count = int(query.get("from", 1)), int(query.get("count", 25))
+            last = min(first + count, platform.participants + 1)
+            result = {
+                "contest": platform.contest(contest_id),
+                "problems": platform.problems(contest_id),
+                "rows": [platform.standings_row(contest_id, r) for r in range(first, last)],
+            }
+            return 200, {"status": "OK", "result": result}, {}
+
+        if path == "/api/contest.status":
+            contest_id = int(query["contestId"])
+            if not platform.has_contest(contest_id):
+                raise ValueError(f"contestId: Contest with id {contest_id} not found")
+            first, count = int(query.get("from", 1)), int(query.get("count", 25))
+            if "handle" in query:  # Rare, so simply filtered
+                submissions = list(platform.submissions_of(contest_id, query["handle"]))
+                result = submissions[first - 1 : first - 1 + count]
+            else:
+                last = min(first - 1 + count, platform.total)
+                result = [platform.submission(contest_id, o) for o in range(first - 1, last)]
+            return 200, {"status": "OK", "result": result}, {}
+
+        if path == "/api/user.info":
+            users = []
+            for handle in query["handles"].split(";"):
+                user = platform.user(handle)
+                if user is None:
+                    raise ValueError(f"handles: User with handle {handle} not found")
+                users.append(user)
+            return 200, {"status": "OK", "result": users}, {}
+
+        if path == "/data/submitSource":
+            submission_id = int(parse_qs(body)["submissionId"][0])
+            if not platform.has_submission(submission_id):
+                return 404, {"error": f"Submission {submission_id} not found"}, {}
+            source = {"source": platform.source(submission_id), "verdict": "OK"}
+            return 200, source, {}
+
+        parts = path.strip("/").split("/")
+        if path.startswith("/contest/api/") and len(parts) == 4:
+            contest_id = int(parts[3].rsplit("-", 1)[-1])  # weekly-contest-<id>
+            if not platform.has_contest(contest_id):
+                return 404, {"error": f"Contest {parts[3]} not found"}, {}
+            if parts[2] == "ranking":
+                page = int(query.get("pagination", 1))
+                return 200, platform.ranking_page(contest_id, page), {}
+            if parts[2] == "info":
+                contest = {"id": contest_id, "title": f"Weekly Contest {contest_id}"}
+                return 200, {"contest": contest, "questions": [], "survey": None}, {}
+
+        if path.startswith("/api/submissions/") and len(parts) == 3:
+            submission_id = int(parts[2])
+            if not platform.has_leetcode_submission(submission_id):
+                return 404, {"error": f"Submission {submission_id} not found"}, {}
+            language = LEETCODE_LANGUAGES[_mix(submission_id) % 4]
+            code = platform.source(submission_id)
+            return 200, {"id": submission_id, "code": code, "lang": language}, {}
+
+        return 404, {"error": f"Unknown endpoint {path}"}, {}
+
+    def _reply(
+        self, status: int, payload, headers: Optional[dict] = None, truncate: bool = False
+    ) -> None:
+        if isinstance(payload, str):
+            body, content_type = payload.encode(), "text/html; charset=utf-8"
+        else:
+            body, content_type = json.dumps(payload).encode(), "application/json"
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if self.server.compress and len(body) > 1024:
+            if "gzip" in self.headers.get("Accept-Encoding", ""):
+                body = gzip.compress(body, compresslevel=1)  # Spare the benchmark's CPU
+                self.send_header("Content-Encoding", "gzip")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if truncate:
+            body = body[: len(body) // 2]  # Short of the Content-Length
+        self.wfile.write(body)
+        self.server.count("bytes", len(body))
+
+    def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        pass  # Counted in `StandinServer.stats` instead
+
+
+class StandinServer(ThreadingHTTPServer):
+    """Serves a `SyntheticPlatform` over HTTP, with injected faults.
+
+    Example:
+        >>> with StandinServer(("127.0.0.1", 0), SyntheticPlatform()) as server:
+        ...     api = CodeforcesAPI("127.0.0.1", server.server_port, secure=False)
+
+    Args:
+        address: The (host, port) to listen on; port 0 picks a free one.
+        platform: The data served.
+        faults: The faults injected, which default to none.
+        compress: Whether to gzip large responses for clients that accept it.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128  # Bursts of concurrent clients must not be reset
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        platform: SyntheticPlatform,
+        faults: Optional[FaultInjector] = None,
+        compress: bool = True,
+    ) -> None:
+        super().__init__(address, StandinHandler)
+        self.platform = platform
+        self.faults = faults if faults is not None else FaultInjector()
+        self.compress = compress
+
+        self.stats = {
+            "requests": 0,
+            "throttled": 0,
+            "errors": 0,
+            "dropped": 0,
+            "truncated": 0,
+            "bytes": 0,
+        }
+        self._stats_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[name] += value
+
+    def start(self) -> "StandinServer":
+        """Serves requests from a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __enter__(self) -> "StandinServer":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        if self._thread is not None:
+            self.shutdown()
+        self.server_close()
+
+
+def _parse_arguments(args: Optional[Sequence[str]] = None):
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", default=8080, type=int)
+    parser.add_argument("--contests", default=4, type=int, metavar="<n>")
+    parser.add_argument("--participants", default=1000, type=int, metavar="<n>")
+    parser.add_argument(
+        "--submissions",
+        default=4,
+        type=int,
+        metavar="<n>",
+        help="submissions per participant and contest",
+    )
+    parser.add_argument("--source-size", default=2000, type=int, metavar="<bytes>")
+    parser.add_argument(
+        "--latency", default=0.0, type=float, metavar="<s>", help="mean added latency"
+    )
+    parser.add_argument(
+        "--rate",
+        default=0.0,
+        type=float,
+        metavar="<n>",
+        help="requests per second before throttling (0 for no limit)",
+    )
+    parser.add_argument("--error-rate", default=0.0, type=float, metavar="<p>")
+    parser.add_argument("--drop-rate", default=0.0, type=float, metavar="<p>")
+    parser.add_argument("--truncate-rate", default=0.0, type=float, metavar="<p>")
+    parser.add_argument("--no-compress", action="store_false", dest="compress")
+    parser.add_argument("--seed", default=0, type=int)
+    return parser.parse_args(args)  # If none are supplied, fall back to CLI
+
+
+def main():
+    args = _parse_arguments()
+    platform = SyntheticPlatform(
+        args.contests, args.participants, args.submissions, args.source_size, args.seed
+    )
+    faults = FaultInjector(
+        args.latency,
+        args.rate,
+        args.error_rate,
+        args.drop_rate,
+        args.truncate_rate,
+        args.seed,
+    )
+
+    server = StandinServer((args.host, args.port), platform, faults, args.compress)
+    print(f"Serving on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats))
+
+
+if __name__ == "__main__":
+    main()
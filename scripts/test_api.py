@@ -0,0 +1,30 @@
+import time
+
+from api import CodeforcesAPI
+from cache import ResponseCache
+from standin import FaultInjector, StandinServer, SyntheticPlatform
+
+
+def standings(server, cache=None):
+    api = CodeforcesAPI("127.0.0.1", server.server_port, secure=False, api_rate=1e6, cache=cache)
+    return list(api.iter_contest_standings(1, count=200))
+
+
+def test_stream_restarts_after_truncated_body(tmp_path, monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)  # Skip the backoff
+    platform = SyntheticPlatform(1, 200, 1, 100)
+    with StandinServer(("127.0.0.1", 0), platform) as server:
+        rows = standings(server)
+
+    # The seed spares the session handshake, then truncates standings twice
+    faults = FaultInjector(truncate_rate=0.5, seed=22)
+    with StandinServer(("127.0.0.1", 0), platform, faults) as server:
+        cache = ResponseCache(tmp_path / "cache.sqlite")
+        assert standings(server, cache) == rows
+        assert server.stats["truncated"] == 2
+        cache.close()
+
+    # Only the complete body was cached
+    cache = ResponseCache(tmp_path / "cache.sqlite", offline=True)
+    assert standings(server, cache) == rows
+    cache.close()
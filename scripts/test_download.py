@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+pytest.importorskip("zstandard")
+
+from download import SourceStore, download  # pylint: disable=wrong-import-position
+
+
+def source(submission_id):
+    return f"int main() {{ return {submission_id}; }}\n".encode()
+
+
+def test_reopen_after_interrupted_write(tmp_path):
+    store = SourceStore(tmp_path)
+    store.put(1, source(1), "C++")
+    store.put(2, source(2))
+    store.close()
+
+    # A frame written but never indexed, as if interrupted before the commit
+    with open(tmp_path / "shard-00000.zst", "ab") as shard:
+        shard.write(b"\x28\xb5\x2f\xfd partial frame")
+
+    store = SourceStore(tmp_path)
+    store.put(3, source(3))
+    assert [store.get(i) for i in (1, 2, 3)] == [source(1), source(2), source(3)]
+    store.close()
+
+    store = SourceStore(tmp_path)
+    store.put(4, source(4))
+    assert [store.get(i) for i in (1, 2, 3, 4)] == [source(i) for i in (1, 2, 3, 4)]
+    assert len(store) == 4
+    store.close()
+
+
+def test_reopen_without_shard(tmp_path):
+    store = SourceStore(tmp_path)
+    store.put(1, source(1))
+    store.close()
+    os.remove(tmp_path / "shard-00000.zst")
+    os.remove(tmp_path / "index.sqlite")
+
+    store = SourceStore(tmp_path)
+    store.put(2, source(2))
+    assert store.get(2) == source(2)
+    with pytest.raises(KeyError):
+        store.get(1)
+    store.close()
+
+
+def test_identical_sources_stored_once(tmp_path):
+    store = SourceStore(tmp_path)
+    store.put(1, source(0))
+    size = os.path.getsize(tmp_path / "shard-00000.zst")
+    store.put(2, source(0))
+    assert os.path.getsize(tmp_path / "shard-00000.zst") == size
+    assert store.get(1) == store.get(2) == source(0)
+    store.close()
+
+
+def test_download_resumes_and_skips_stored(tmp_path):
+    fetched = []
+
+    def fetch(submission):
+        contest_id, submission_id = submission
+        fetched.append(submission_id)
+        if submission_id == 5:
+            raise ValueError("not judged yet")
+        return source(submission_id), f"contest {contest_id}"
+
+    store = SourceStore(tmp_path)
+    submissions = [(1, i) for i in range(1, 7)]
+    assert download(store, submissions[:3], fetch, map, 2, lambda s: s[1]) == (3, 0, 0)
+    assert download(store, submissions, fetch, map, 2, lambda s: s[1]) == (2, 3, 1)
+    assert fetched == [1, 2, 3, 4, 5, 6]
+    assert [store.get(i) for i in (1, 2, 3, 4, 6)] == [source(i) for i in (1, 2, 3, 4, 6)]
+
+    # Only the failed submission is retried
+    assert download(store, submissions, fetch, map, 2, lambda s: s[1]) == (0, 5, 1)
+    assert fetched[6:] == [5]
+    store.close()
+
+
+def test_download_fetches_repeats_once(tmp_path):
+    fetched = []
+
+    def fetch(submission_id):
+        fetched.append(submission_id)
+        return source(submission_id), None
+
+    store = SourceStore(tmp_path)
+    assert download(store, [1, 1, 2, 1, 2, 3], fetch, map, 4) == (3, 1, 0)
+    assert fetched == [1, 2, 3]
+    assert len(store) == 3
+    store.close()
@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+from jsonstream import _Reader, iter_array
+
+DOCUMENTS = [
+    (
+        b'{"status":"OK","result":[0.5, 2, -1e3, 1E+2, 12.25e-1, true, false, null, '
+        b'"a\\u00e9\\"b", "\xc3\xa9t\xc3\xa9", {"x":[1.5, {}]}, []],"comment":"done"}',
+        ("result",),
+    ),
+    (
+        b'{"result": {"contest": {"id": 1, "phase": "FINISHED"},\n'
+        b'  "problems": [], "rows": [{"rank": 1, "points": 99.5}, {"rank": 2}]},\n'
+        b' "status": "OK"}\n',
+        ("result", "rows"),
+    ),
+    (b'{"result":[1e3]}', ("result",)),
+    (b'{"result":[-0]}', ("result",)),
+]
+
+
+class Chunks:
+    """A stream returning the given chunks, one per read (an empty read ends it)."""
+
+    def __init__(self, chunks):
+        self.chunks = [chunk for chunk in chunks if chunk]
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return self.chunks.pop(0) if self.chunks else b""
+
+
+def expected(document, path):
+    fields = json.loads(document)
+    level = fields
+    for key in path[:-1]:
+        level = level[key]
+    return level.pop(path[-1]), fields
+
+
+def parse(chunks, path):
+    fields = {}
+    return list(iter_array(Chunks(chunks), path, fields)), fields
+
+
+@pytest.mark.parametrize("document, path", DOCUMENTS)
+def test_every_split_point(document, path):
+    elements, fields = expected(document, path)
+    for split in range(len(document) + 1):
+        chunks = [document[:split], document[split:]]
+        assert parse(chunks, path) == (elements, fields), split
+
+
+@pytest.mark.parametrize("document, path", DOCUMENTS)
+@pytest.mark.parametrize("size", [1, 2, 3])
+def test_small_reads(document, path, size):
+    chunks = [document[i : i + size] for i in range(0, len(document), size)]
+    assert parse(chunks, path) == expected(document, path)
+
+
+@pytest.mark.parametrize(
+    "chunks, elements",
+    [
+        ([b'{"result":[0.', b"5, 2]}"], [0.5, 2]),
+        ([b'{"result":[1e', b"3]}"], [1000.0]),
+        ([b'{"result":[1e+', b"3]}"], [1000.0]),
+        ([b'{"result":[-', b"1]}"], [-1]),
+        ([b'{"result":[tr', b"ue]}"], [True]),
+    ],
+)
+def test_scalar_split_at_boundary(chunks, elements):
+    assert parse(chunks, ("result",))[0] == elements
+
+
+def test_top_level_number_split_at_boundary():
+    reader = _Reader(Chunks([b"12", b".5", b"e1"]))
+    assert reader.value() == 125.0
+    reader.drain()
+
+
+@pytest.mark.parametrize(
+    "document",
+    [b'{"result":[1, @]}', b'{"result":[0.5.5]}', b'{"result":[1, 2]', b'{"result":[1}'],
+)
+def test_invalid_json(document):
+    for split in range(len(document) + 1):
+        with pytest.raises(ValueError):
+            parse([document[:split], document[split:]], ("result",))
+
+
+def test_invalid_json_raises_without_reading_the_rest():
+    stream = Chunks([b'{"result":[1, @, ' + b"2, " * 100] + [b"3, "] * 1000 + [b"4]}"])
+    with pytest.raises(ValueError):
+        list(iter_array(stream, ("result",)))
+    assert stream.reads <= 2